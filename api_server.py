@@ -0,0 +1,443 @@
+# Description: Local JSON HTTP API for meter-reading devices and integrations.
+# A standalone asyncio server (standard library only; does not import Streamlit):
+#
+#   python api_server.py --db billing_system.db --port 8080 --workers 8
+#
+#   POST /readings                      one reading object, or a list of them
+#   GET  /bills/<YYYY-MM>                the month's bills; ?limit=&after=<FlatNo> to page
+#   GET  /bills/<YYYY-MM>/<FlatNo>       one bill with its surcharge lines
+#   GET  /bills/<YYYY-MM>/<FlatNo>.pdf   that bill as a PDF
+#   GET  /health                         status and writer counters
+#
+# SQLite and reportlab work runs in a bounded thread pool, never on the event
+# loop. Posted readings go to a single writer that commits everything queued
+# while its previous batch was being written in one import_readings() call,
+# so a burst of devices costs one transaction instead of one each.
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from io import BytesIO
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import pandas as pd
+
+import sql_trace
+from bill_pdf import render_bills
+from billing_engine import BILLING_DATA_QUERY
+from db import get_connection, get_db_path, set_db_path
+from migrations import migrate
+from readings import OPTIONAL_COLUMNS, REQUIRED_COLUMNS, import_readings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+
+# Threads for SQLite and PDF work
+DEFAULT_WORKERS = 8
+# Blocking jobs queued or running at once; further requests wait for a slot
+MAX_PENDING_JOBS = 256
+
+# Most readings committed in one transaction
+READING_BATCH_SIZE = 1000
+
+# Largest header block and request body accepted
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 4 * 1024 * 1024
+
+# Seconds an idle keep-alive connection is held open
+KEEP_ALIVE_TIMEOUT = 15
+
+BILL_PAGE_SIZE = 500
+MAX_BILL_PAGE_SIZE = 5000
+
+MONTH_PATTERN = re.compile(r"\d{4}-(0[1-9]|1[0-2])")
+
+BILL_QUERY = "SELECT * FROM MonthlyBillSummary WHERE BillingMonth = ? AND FlatNo = ?"
+BILL_SURCHARGES_QUERY = """
+    SELECT rsm.SurchargeID, s.SurchargeTypeID, st.TypeName, s.RatePerUnit,
+           rsm.AdjustedBillingMonth, rsm.SurchargeAmount
+    FROM ReadingSurchargeMapping rsm
+    LEFT JOIN Surcharge s ON s.SurchargeID = rsm.SurchargeID
+    LEFT JOIN SurchargeType st ON st.SurchargeTypeID = s.SurchargeTypeID
+    WHERE rsm.ReadingID = ? AND rsm.BillingMonth = ?
+    ORDER BY rsm.AdjustedBillingMonth, rsm.SurchargeID
+"""
+# BILLING_DATA_QUERY narrowed to one flat; the outer filter is pushed into the month/flat index
+BILL_PDF_QUERY = f"SELECT * FROM ({BILLING_DATA_QUERY}) WHERE FlatNo = ?"
+
+Request = namedtuple("Request", ["method", "path", "query", "headers", "body"])
+Response = namedtuple("Response", ["status", "content_type", "body", "headers"])
+
+
+class HTTPError(Exception):
+    """Turned into a JSON {"error": message} response with the given status."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def json_response(status, payload):
+    return Response(status, "application/json", json.dumps(payload).encode(), {})
+
+
+def _records(frame):
+    """DataFrame rows as JSON-safe dicts (NaN becomes null)."""
+    return frame.astype(object).where(frame.notna(), None).to_dict("records")
+
+
+def _fetch_dicts(conn, query, params):
+    cursor = conn.execute(query, params)
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def _month(value):
+    if not MONTH_PATTERN.fullmatch(value):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"{value!r} is not a YYYY-MM month")
+    return value
+
+
+def _int_param(query, name, default, maximum):
+    values = query.get(name)
+    if not values:
+        return default
+    try:
+        value = int(values[-1])
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"{name} must be an integer")
+    if not 1 <= value <= maximum:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"{name} must be between 1 and {maximum}")
+    return value
+
+
+# Blocking work, run on pool threads with each thread's pooled connection;
+# with BILLING_SQL_TRACE=1 each call is traced and logged as a run of its own
+
+@sql_trace.traced("api: list bills")
+def list_bills(billing_month, after=None, limit=BILL_PAGE_SIZE):
+    """One keyset page of a month's MonthlyBillSummary rows, in FlatNo order."""
+    bills = _fetch_dicts(get_connection(), """
+        SELECT * FROM MonthlyBillSummary
+        WHERE BillingMonth = ? AND FlatNo > ?
+        ORDER BY FlatNo
+        LIMIT ?
+    """, (billing_month, after or "", limit + 1))
+    more = len(bills) > limit
+    bills = bills[:limit]
+    return {"month": billing_month, "bills": bills, "next": bills[-1]["FlatNo"] if more else None}
+
+
+@sql_trace.traced("api: get bill")
+def get_bill(billing_month, flat_no):
+    """A flat's bill for the month with its surcharge lines, or None if it has not been billed."""
+    conn = get_connection()
+    bills = _fetch_dicts(conn, BILL_QUERY, (billing_month, flat_no))
+    if not bills:
+        return None
+    bill = bills[0]
+    bill["Surcharges"] = _fetch_dicts(conn, BILL_SURCHARGES_QUERY, (bill["ReadingID"], billing_month))
+    return bill
+
+
+@sql_trace.traced("api: bill pdf")
+def bill_pdf(billing_month, flat_no):
+    """The bill rendered like the bulk PDF, as bytes, or None if it has not been billed."""
+    rows = get_connection().execute(BILL_PDF_QUERY, (billing_month, flat_no)).fetchall()
+    if not rows:
+        return None
+    return render_bills(rows, billing_month, BytesIO()).getvalue()
+
+
+@sql_trace.traced("api: commit readings")
+def commit_readings(requests):
+    """
+    Validate and insert the readings of several requests in one import_readings() call.
+
+    Returns:
+        list: {"inserted": [...], "rejected": [...]} per request, each row
+            carrying its "Index" within that request.
+    """
+    rows = [row for request_rows in requests for row in request_rows]
+    result = import_readings(pd.DataFrame(rows, columns=list(REQUIRED_COLUMNS + OPTIONAL_COLUMNS)))
+    # import_readings numbers rows like CSV lines (header is line 1)
+    inserted_at = result.inserted["Line"].to_numpy() - 2
+    rejected_at = result.rejected["Line"].to_numpy() - 2
+    inserted = _records(result.inserted.drop(columns="Line"))
+    rejected = _records(result.rejected.drop(columns="Line"))
+
+    outcomes, start = [], 0
+    for request_rows in requests:
+        end = start + len(request_rows)
+        outcomes.append({
+            "inserted": [dict(row, Index=int(i - start)) for i, row in zip(inserted_at, inserted) if start <= i < end],
+            "rejected": [dict(row, Index=int(i - start)) for i, row in zip(rejected_at, rejected) if start <= i < end],
+        })
+        start = end
+    return outcomes
+
+
+class ReadingWriter:
+    """
+    Group commit for posted readings.
+
+    Requests queue their rows and await the outcome. One task takes
+    everything queued (up to batch_size rows) and commits it with a single
+    commit_readings() call; whatever arrives meanwhile forms the next batch.
+    """
+
+    def __init__(self, run_blocking, batch_size=READING_BATCH_SIZE):
+        self._run_blocking = run_blocking
+        self._batch_size = batch_size
+        self._queue = asyncio.Queue()
+        self._task = None
+        self.batches = 0
+        self.readings = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def submit(self, rows):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((rows, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            pending = [await self._queue.get()]
+            size = len(pending[0][0])
+            while size < self._batch_size and not self._queue.empty():
+                pending.append(self._queue.get_nowait())
+                size += len(pending[-1][0])
+
+            try:
+                outcomes = await self._run_blocking(commit_readings, [rows for rows, _ in pending])
+            except Exception as e:
+                logger.exception("Committing %d readings failed", size)
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.readings += sum(len(outcome["inserted"]) for outcome in outcomes)
+            for (_, future), outcome in zip(pending, outcomes):
+                if not future.done():
+                    future.set_result(outcome)
+
+
+class BillingAPI:
+    """Routes, handlers and the HTTP/1.1 connection loop."""
+
+    def __init__(self, workers=DEFAULT_WORKERS, batch_size=READING_BATCH_SIZE, max_pending=MAX_PENDING_JOBS):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="billing-api")
+        self._slots = asyncio.Semaphore(max_pending)
+        self.writer = ReadingWriter(self.run_blocking, batch_size)
+        self.routes = (
+            ("GET", re.compile(r"/health"), self.health),
+            ("POST", re.compile(r"/readings"), self.post_readings),
+            ("GET", re.compile(r"/bills/([^/]+)"), self.list_bills),
+            ("GET", re.compile(r"/bills/([^/]+)/([^/]+)\.pdf"), self.bill_pdf),
+            ("GET", re.compile(r"/bills/([^/]+)/([^/]+)"), self.get_bill),
+        )
+
+    async def run_blocking(self, func, *args):
+        """Run func(*args) on the pool; at most max_pending jobs are queued or running."""
+        async with self._slots:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, func, *args)
+
+    async def start(self):
+        self.writer.start()
+
+    async def close(self):
+        await self.writer.stop()
+        self._pool.shutdown(wait=True)
+
+    # Handlers
+
+    async def health(self, request):
+        return json_response(HTTPStatus.OK, {
+            "status": "ok",
+            "db": get_db_path(),
+            "reading_batches": self.writer.batches,
+            "readings_inserted": self.writer.readings,
+        })
+
+    async def post_readings(self, request):
+        try:
+            payload = json.loads(request.body or b"null")
+        except ValueError as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"Invalid JSON: {e}")
+        rows = [payload] if isinstance(payload, dict) else payload
+        if not isinstance(rows, list) or not rows or not all(isinstance(row, dict) for row in rows):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Expected a reading object or a non-empty list of them")
+        outcome = await self.writer.submit(rows)
+        return json_response(HTTPStatus.CREATED if outcome["inserted"] else HTTPStatus.UNPROCESSABLE_ENTITY, outcome)
+
+    async def list_bills(self, request, month):
+        after = request.query.get("after", [None])[-1]
+        limit = _int_param(request.query, "limit", BILL_PAGE_SIZE, MAX_BILL_PAGE_SIZE)
+        return json_response(HTTPStatus.OK, await self.run_blocking(list_bills, _month(month), after, limit))
+
+    async def get_bill(self, request, month, flat_no):
+        bill = await self.run_blocking(get_bill, _month(month), flat_no)
+        if bill is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"No bill for flat {flat_no} in {month}")
+        return json_response(HTTPStatus.OK, bill)
+
+    async def bill_pdf(self, request, month, flat_no):
+        pdf = await self.run_blocking(bill_pdf, _month(month), flat_no)
+        if pdf is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"No bill for flat {flat_no} in {month}")
+        return Response(HTTPStatus.OK, "application/pdf", pdf,
+                        {"Content-Disposition": f'inline; filename="{flat_no}_ElectricBill_{month}.pdf"'})
+
+    async def dispatch(self, request):
+        allowed = []
+        for method, pattern, handler in self.routes:
+            match = pattern.fullmatch(request.path)
+            if match is None:
+                continue
+            if method != request.method:
+                allowed.append(method)
+                continue
+            try:
+                return await handler(request, *(unquote(group) for group in match.groups()))
+            except HTTPError as e:
+                return json_response(e.status, {"error": str(e)})
+            except Exception as e:
+                logger.exception("%s %s failed", request.method, request.path)
+                return json_response(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+        if allowed:
+            response = json_response(HTTPStatus.METHOD_NOT_ALLOWED, {"error": f"Use {', '.join(allowed)}"})
+            return response._replace(headers={"Allow": ", ".join(allowed)})
+        return json_response(HTTPStatus.NOT_FOUND, {"error": f"No route for {request.path}"})
+
+    # HTTP
+
+    async def _read_request(self, reader):
+        """The next request on the connection and whether to keep it open; None at EOF or idle timeout."""
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "Header block too large")
+
+        request_line, *header_lines = head[:-4].decode("latin-1").split("\r\n")
+        try:
+            method, target, version = request_line.split(" ")
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+        headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise HTTPError(HTTPStatus.LENGTH_REQUIRED, "Send a Content-Length body")
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"Body larger than {MAX_BODY_BYTES} bytes")
+        body = await reader.readexactly(length) if length else b""
+
+        url = urlsplit(target)
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+        return Request(method.upper(), url.path, parse_qs(url.query), headers, body), keep_alive
+
+    @staticmethod
+    async def _write_response(writer, response, keep_alive):
+        status = HTTPStatus(response.status)
+        headers = {
+            "Content-Type": response.content_type,
+            "Content-Length": str(len(response.body)),
+            "Connection": "keep-alive" if keep_alive else "close",
+            **response.headers,
+        }
+        head = f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+        head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        writer.write(head.encode("latin-1") + b"\r\n" + response.body)
+        await writer.drain()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    parsed = await self._read_request(reader)
+                except HTTPError as e:
+                    await self._write_response(writer, json_response(e.status, {"error": str(e)}), False)
+                    break
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if parsed is None:
+                    break
+                request, keep_alive = parsed
+
+                started = time.perf_counter()
+                response = await self.dispatch(request)
+                await self._write_response(writer, response, keep_alive)
+                logger.info("%s %s %d %.1f ms", request.method, request.path, response.status,
+                            (time.perf_counter() - started) * 1000)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, workers=DEFAULT_WORKERS, batch_size=READING_BATCH_SIZE):
+    api = BillingAPI(workers, batch_size)
+    await api.start()
+    server = await asyncio.start_server(api.handle_connection, host, port, limit=MAX_HEADER_BYTES, backlog=1024)
+    addresses = ", ".join(str(sock.getsockname()[:2]) for sock in server.sockets)
+    print(f"Billing API on {addresses} ({get_db_path()}, {workers} workers)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await api.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve readings and bills as a local JSON HTTP API.")
+    parser.add_argument("--db", help="Database file (default: BILLING_DB_PATH or billing_system.db)")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Address to listen on (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port (default: {DEFAULT_PORT})")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"Threads for database and PDF work (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--batch-size", type=int, default=READING_BATCH_SIZE,
+                        help=f"Most readings committed per transaction (default: {READING_BATCH_SIZE})")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.environ.get("BILLING_LOG_LEVEL", "WARNING").upper(),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if args.db:
+        set_db_path(args.db)
+    migrate()
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.batch_size))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,12 +2,307 @@
 import streamlit as st
 from datetime import datetime, timedelta
 import os
-from functions import *
+from db import get_connection, table_version
+from pricing import calculate_units_consumed, fetch_surcharge_rate, get_previous_month, insert_bill, update_bill
+from rates import (get_electric_duty_rates, get_gst_rates, get_surcharge_rates, get_tariff_slabs,
+                   set_tariff_pricing_mode, upsert_electric_duty_rate, upsert_gst_rate, upsert_surcharge_rate)
+from records import (delete_bill, delete_user, fetch_complete_bill, get_bill_snapshot, get_billed_flats,
+                     get_reading_months, get_table_data, insert_reading, insert_user, iter_billing_data,
+                     update_user)
+from billing_engine import close_month
+from readings import import_readings
+from surcharges import surcharge_resolver
+from tariff_simulator import Scenario, load_history, simulate
+from tariffs import PRICING_MODES, tariff_slabs
 import pandas as pd
 import sqlite3
+from migrations import MigrationError, migrate
+from ref_cache import reference_cache
+from queries import DEFAULT_PAGE_SIZE, RELEVANCE, TABLES as RECORD_TABLES, query_all, query_page
+import logging
+import sql_trace
+
+# BILLING_LOG_LEVEL=DEBUG shows the debug logging; basicConfig is a no-op on later reruns
+logging.basicConfig(level=os.environ.get("BILLING_LOG_LEVEL", "WARNING").upper(),
+                    format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+if sql_trace.ENABLED:
+    # Trace summaries are INFO; show them even when the rest of the app logs at WARNING
+    sql_trace.logger.setLevel(min(logging.INFO, logging.getLogger().getEffectiveLevel()))
+sql_trace.start_run("rerun")
+
+# Create / upgrade the schema once per server process
+@st.cache_resource(show_spinner=False)
+def ensure_schema():
+    return migrate()
+
+try:
+    ensure_schema()
+except MigrationError as e:
+    # Not cached, so the next rerun tries again once the data is fixed
+    st.error(f"The database needs attention before the app can start.\n\n{e}")
+    st.stop()
+
+
+def show_paged_table(state_key, table, filters=None, contains=None, search=None,
+                     default_sort=None, empty_message="No records found."):
+    """Render one keyset page of a table with sort, page-size and prev/next controls."""
+    columns = list(RECORD_TABLES[table].sortable)
+    if search:
+        # Rank search hits by relevance unless another column is picked
+        columns.insert(0, RELEVANCE)
+        default_sort = RELEVANCE
+    sort_col, order_col, size_col = st.columns(3)
+    with sort_col:
+        sort_by = st.selectbox("Sort by", columns, index=columns.index(default_sort or RECORD_TABLES[table].key),
+                               key=f"{state_key}_sort{'_ranked' if search else ''}")
+    with order_col:
+        descending = st.radio("Order", ["Ascending", "Descending"], horizontal=True,
+                              key=f"{state_key}_order") == "Descending"
+    with size_col:
+        page_size = st.selectbox("Rows per page", [25, DEFAULT_PAGE_SIZE, 100, 250], index=1,
+                                 key=f"{state_key}_page_size")
+
+    # Cursors of the pages visited so far; any change to the query starts over at page 1
+    signature = (table, repr(filters), repr(contains), search, sort_by, descending, page_size)
+    if st.session_state.get(f"{state_key}_signature") != signature:
+        st.session_state[f"{state_key}_signature"] = signature
+        st.session_state[f"{state_key}_cursors"] = [None]
+    cursors = st.session_state[f"{state_key}_cursors"]
+
+    page = query_page(table, filters=filters, contains=contains, search=search, sort_by=sort_by,
+                      descending=descending, after=cursors[-1], page_size=page_size)
+    if page.total == 0:
+        st.warning(empty_message)
+        return
+
+    first_row = (len(cursors) - 1) * page_size + 1
+    st.write(f"### {table} ({page.total} records found)")
+    st.caption(f"Showing {first_row}–{first_row + len(page.rows) - 1} of {page.total}")
+    st.dataframe(page.rows, hide_index=True)
+
+    prev_col, next_col, export_col = st.columns(3)
+    with prev_col:
+        st.button("⬅️ Previous", key=f"{state_key}_prev", disabled=len(cursors) == 1,
+                  on_click=cursors.pop)
+    with next_col:
+        st.button("Next ➡️", key=f"{state_key}_next", disabled=page.cursor is None,
+                  on_click=cursors.append, args=(page.cursor,))
+    with export_col:
+        if st.button("📥 Prepare CSV", key=f"{state_key}_export"):
+            export_df = query_all(table, filters=filters, contains=contains, search=search,
+                                  sort_by=sort_by, descending=descending)
+            st.download_button("📥 Download CSV", export_df.to_csv(index=False), f"{table.lower()}.csv",
+                               "text/csv", key=f"{state_key}_download")
+
+# Enter Bill Record: option lists are built once per session, and each step of the
+# page is a fragment that reruns alone when one of its own widgets changes.
+BILL_ENTRY_TABLES = ("Users", "Flats", "GSTRates", "ElectricDutyRates", "Surcharge", "SurchargeType")
+SURCHARGE_TYPE_NAMES = {1: "Additional PHL", 2: "Uniform Quarterly", 3: "Fuel Charge"}
+# Its rate follows the units consumed, so only the effective date is picked
+BANDED_SURCHARGE = "Additional PHL"
+MONTH_NAMES = ["January", "February", "March", "April", "May", "June",
+               "July", "August", "September", "October", "November", "December"]
+
+
+def bill_entry_options():
+    """Option lists of the Enter Bill Record page, rebuilt only after one of BILL_ENTRY_TABLES is written."""
+    versions = tuple(table_version(table) for table in BILL_ENTRY_TABLES)
+    cached = st.session_state.get("bill_entry_options")
+    if cached is not None and cached[0] == versions:
+        return cached[1]
+
+    users_df = get_table_data("Users")
+    flats = set(get_table_data("Flats")["FlatNo"].tolist())
+    surcharge_df = get_surcharge_rates()
+    surcharge_df = surcharge_df.assign(TypeName=surcharge_df["SurchargeTypeID"].map(SURCHARGE_TYPE_NAMES))
+
+    users = {}
+    for person_id, flat_no, user_category, name in users_df[
+            ["PersonID", "FlatNo", "UserCategory", "Name"]].itertuples(index=False):
+        # A user's flat is only offered if it is in Flats
+        users.setdefault(person_id, (flat_no if flat_no in flats else None, user_category, name))
+
+    surcharge_rates, surcharge_dates = {}, {}
+    for type_name, group in surcharge_df.groupby("TypeName", sort=False):
+        labels = {}
+        for surcharge_id, type_id, rate, effective_date in group[
+                ["SurchargeID", "SurchargeTypeID", "RatePerUnit", "EffectiveDate"]].itertuples(index=False):
+            labels.setdefault(f"Rate: {rate} | Effective: {effective_date}", (int(surcharge_id), float(rate)))
+        surcharge_rates[type_name] = labels
+        surcharge_dates[type_name] = (int(group["SurchargeTypeID"].iloc[0]), group["EffectiveDate"].unique().tolist())
+
+    options = {
+        "person_ids": users_df["PersonID"].tolist(),
+        "users": users,                        # PersonID -> (FlatNo or None, UserCategory, Name)
+        "gst": get_table_data("GSTRates")["GST"].tolist(),
+        "duty": get_table_data("ElectricDutyRates")["ElectricDuty"].tolist(),
+        "surcharge_types": list(surcharge_rates),
+        "surcharge_rates": surcharge_rates,    # TypeName -> {label: (SurchargeID, RatePerUnit)}
+        "surcharge_dates": surcharge_dates,    # TypeName -> (SurchargeTypeID, [EffectiveDate, ...])
+    }
+    st.session_state["bill_entry_options"] = (versions, options)
+    return options
+
+
+def pick_surcharge(options, type_name, units_consumed, key):
+    """Rate picker for one surcharge type; returns (SurchargeID, RatePerUnit), or None if no rate applies."""
+    if type_name != BANDED_SURCHARGE:
+        labels = options["surcharge_rates"][type_name]
+        return labels[st.selectbox(f"Select Rate for {type_name}", list(labels), key=key)]
+
+    type_id, effective_dates = options["surcharge_dates"][type_name]
+    effective_date = st.selectbox(f"Select Effective Date for {type_name}", effective_dates, key=key)
+    # Called from fragments, which rerun on a thread of their own: use that thread's connection
+    data = fetch_surcharge_rate(get_connection().cursor(), type_id, units_consumed, effective_date)
+    if data is None:
+        st.warning(f"No rate found for SurchargeTypeID: {type_id}, Units: {units_consumed}, "
+                   f"Effective Date: {effective_date}.")
+    return data
+
+
+@st.fragment
+@sql_trace.traced("Enter Bill Record: selection")
+def bill_entry_selection():
+    """Person, flat and billing month; changing them starts the entry over."""
+    options = bill_entry_options()
+    person_id = st.selectbox("Select Person ID", options["person_ids"], key="entry_person")
+    user_flat, user_category, name = options["users"][person_id]
+    flat_no = st.selectbox("Select Flat No", [user_flat] if user_flat is not None else [], key="entry_flat")
+
+    # Select Billing Month (format: YYYY-MM)
+    selected_month = st.selectbox("Billing Month", MONTH_NAMES, key="entry_month")
+    billing_month = f"{datetime.now().year}-{MONTH_NAMES.index(selected_month) + 1:02d}"
+
+    # Previous reading from the per-session bill cache
+    previous = get_bill_snapshot(flat_no, get_previous_month(billing_month),
+                                 st.session_state.setdefault("bill_snapshots", {}))
+    selection = {
+        "person_id": person_id, "flat_no": flat_no, "user_category": user_category, "name": name,
+        "billing_month": billing_month, "previous_reading": previous.present_reading if previous else 0.0,
+    }
+
+    entry = st.session_state["bill_entry"]
+    if entry.get("selection") != selection:
+        started = "selection" in entry
+        # An inserted reading belongs to the old flat and month
+        entry.clear()
+        entry["selection"] = selection
+        if started:
+            st.rerun()
+
+
+@st.fragment
+@sql_trace.traced("Enter Bill Record: reading")
+def bill_entry_reading():
+    """Present reading entry; inserting it opens the charge steps."""
+    entry = st.session_state["bill_entry"]
+    selection = entry["selection"]
+
+    # Meter Reading Inputs
+    present_reading = st.number_input("Present Reading (kWh)", min_value=0.0, step=0.01, key="entry_present_reading")
+    units_consumed = calculate_units_consumed(selection["previous_reading"], present_reading)
+    st.caption(f"Previous reading: {selection['previous_reading']} kWh · Units consumed: {units_consumed:.2f}")
+
+    if st.button("📌 Insert Reading", key="entry_insert_reading"):
+        conn = get_connection()
+        try:
+            reading_id = insert_reading(conn.cursor(), conn, selection["flat_no"], selection["previous_reading"],
+                                        present_reading, selection["billing_month"], selection["person_id"])
+        except sqlite3.Error as e:
+            st.error(f"Database Error: {e}")
+        else:
+            if reading_id is not None and reading_id > 0:
+                entry["reading"] = {"reading_id": reading_id, "present_reading": present_reading,
+                                    "units_consumed": units_consumed}
+                st.rerun()
+
+    if "reading" in entry:
+        st.success(f"✅ Reading inserted! ID: {entry['reading']['reading_id']}")
+
+
+@st.fragment
+@sql_trace.traced("Enter Bill Record: charges")
+def bill_entry_charges():
+    """GST, electric duty and adjusted units."""
+    options = bill_entry_options()
+    st.subheader("💰 Additional Charges")
+    gst_selected = st.selectbox("Select GST (%)", options["gst"] + ["Manual Entry"], index=0, key="entry_gst")
+    gst_value = (st.number_input("Enter GST (%)", min_value=0.0, step=0.01, key="entry_gst_manual")
+                 if gst_selected == "Manual Entry" else gst_selected)
+
+    # Electric Duty Selection
+    duty_selected = st.selectbox("Select Electric Duty", options["duty"] + ["Manual Entry"], index=0, key="entry_duty")
+    electric_duty = (st.number_input("Enter Electric Duty", min_value=0.0, step=0.01, key="entry_duty_manual")
+                     if duty_selected == "Manual Entry" else duty_selected)
+
+    # Units Adjusted (for previous months)
+    unit_adjusted = st.number_input("Units Adjusted (if any)", min_value=0.0, step=0.01, value=0.0,
+                                    key="entry_unit_adjusted")
+    st.session_state["bill_entry"]["charges"] = {"gst": gst_value, "electric_duty": electric_duty,
+                                                 "unit_adjusted": unit_adjusted}
+
+
+@st.fragment
+@sql_trace.traced("Enter Bill Record: surcharges")
+def bill_entry_surcharges():
+    """Surcharge types and rates for the current billing month."""
+    options = bill_entry_options()
+    entry = st.session_state["bill_entry"]
+    billing_month = entry["selection"]["billing_month"]
+    units_consumed = entry["reading"]["units_consumed"]
+
+    st.subheader("⚡ Surcharge Handling")
+    selected_types = st.multiselect("Select Surcharge Type for Current Billing Month", options["surcharge_types"],
+                                    key="entry_surcharge_types")
+    # (SurchargeID, AdjustedBillingMonth, SurchargeAmount) rows, written when the bill is saved
+    mappings, total = [], 0.0
+    for type_name in selected_types:
+        st.markdown(f"**Surcharge Type: {type_name}**")
+        picked = pick_surcharge(options, type_name, units_consumed, key=f"entry_surcharge_{type_name}")
+        if picked is not None:
+            surcharge_id, rate = picked
+            amount = float(rate or 0) * units_consumed
+            mappings.append((surcharge_id, billing_month, amount))
+            total += amount
+
+    entry["surcharges"] = {"mappings": mappings, "total": total}
+    st.text(f"🔹 **Current Month Surcharge:** {total:.2f} PKR")
+
+
+@st.fragment
+@sql_trace.traced("Enter Bill Record: adjusted months")
+def bill_entry_adjusted():
+    """Surcharge adjustments for earlier billing months, charged on each month's billed units."""
+    options = bill_entry_options()
+    entry = st.session_state["bill_entry"]
+    flat_no = entry["selection"]["flat_no"]
+    units_consumed = entry["reading"]["units_consumed"]
+    snapshot_cache = st.session_state.setdefault("bill_snapshots", {})
+
+    previous_months = get_reading_months(flat_no, snapshot_cache)[::-1]
+    adjusted_months = st.multiselect("Select Adjusted Billing Months", previous_months, key="entry_adjusted_months")
+    mappings, total = [], 0.0
+    for adjusted_month in adjusted_months:
+        snapshot = get_bill_snapshot(flat_no, adjusted_month, snapshot_cache)
+        units_adjusted = (snapshot.units_consumed or 0) if snapshot and snapshot.bill_id is not None else 0
+        st.markdown(f"**Adjusted Billing Month: {adjusted_month}**")
+        selected_types = st.multiselect(f"Select Surcharge Type for :{adjusted_month}", options["surcharge_types"],
+                                        key=f"entry_adjusted_types_{adjusted_month}")
+        for type_name in selected_types:
+            st.markdown(f"**Surcharge Type: {type_name}**")
+            # The banded rate is looked up on this month's units, as before
+            picked = pick_surcharge(options, type_name, units_consumed,
+                                    key=f"entry_adjusted_{adjusted_month}_{type_name}")
+            if picked is not None:
+                surcharge_id, rate = picked
+                amount = float(rate or 0) * float(units_adjusted)
+                mappings.append((surcharge_id, adjusted_month, amount))
+                total += amount
+
+    entry["adjusted"] = {"mappings": mappings, "total": total}
+    st.text(f"🔹 **Adjusted Surcharge Total:** {total:.2f} PKR")
+
 
-conn = get_connection()
-cursor = conn.cursor()
 # Streamlit UI 
 st.set_page_config(page_title="Electricity Billing System", layout="wide")
 st.sidebar.title("⚡ Electricity Billing System")
@@ -20,12 +315,12 @@ menu_options = {
         "📊 Report Logs": ["User Directory"]
     },
     "📊 Billing Management": {
-        "Billing Operations": ["Enter Bill Record", "Update/Delete Bill Record"],
-        "Billing Actions": ["Generate Bill"],
+        "Billing Operations": ["Enter Bill Record", "Import Readings", "Update/Delete Bill Record"],
+        "Billing Actions": ["Generate Bill", "Close Month"],
         "📊 Report Logs": ["Billing Records"]
     },
     "⚡ Rate Management": {
-        "Rate Operations": ["Insert/Update Rates", "View Rates"]
+        "Rate Operations": ["Insert/Update Rates", "View Rates", "Tariff Simulator"]
     }
 }
 
@@ -86,349 +381,81 @@ if selected_section == "👤 User Management":
     elif selected_option == "User Directory":
         st.title("📜 User Directory")
 
-        # Fetch Users Data
-        users_df = get_table_data("Users")
-
-        if not users_df.empty:
-            st.write("### 🔍 Search Users (Optional)")
-            col1, col2 = st.columns(2)
-
-            with col1:
-                person_id_filter = st.text_input("Search by Person ID (exact match):", key="person_id")
-            with col2:
-                name_filter = st.text_input("Search by Name (contains, case-insensitive):", key="name")
-
-            # Initialize filtered DataFrame with all users
-            filtered_users_df = users_df.copy()
-
-            # Apply search filters if provided
-            if person_id_filter:
-                filtered_users_df = filtered_users_df[filtered_users_df["PersonID"].astype(str) == person_id_filter]
-            if name_filter:
-                filtered_users_df = filtered_users_df[filtered_users_df["Name"].str.contains(name_filter, case=False, na=False)]
-
-            # Display full dataset or filtered results
-            if filtered_users_df.empty:
-                st.warning("No users found matching your search criteria.")
-            else:
-                st.write(f"### Users ({len(filtered_users_df)} records found)")
-                st.dataframe(filtered_users_df.sort_values(by="Name"))
+        st.write("### 🔍 Search Users (Optional)")
+        col1, col2 = st.columns(2)
 
-            # Download Option
-            st.download_button("📥 Download CSV", filtered_users_df.to_csv(index=False), "users.csv", "text/csv")
+        with col1:
+            person_id_filter = st.text_input("Search by Person ID (exact match):", key="person_id")
+        with col2:
+            name_filter = st.text_input("Search by Name (contains, case-insensitive):", key="name")
 
-        else:
-            st.warning("No users available!")
+        show_paged_table(
+            "user_directory", "Users",
+            filters={"PersonID": person_id_filter},
+            contains={"Name": name_filter},
+            default_sort="Name",
+            empty_message="No users found matching your search criteria.",
+        )
 
 # Handling Billing Management section
 elif selected_section == "📊 Billing Management":
     if selected_option == "Enter Bill Record":
         st.title("📋 Insert Billing Data")
 
-        # Fetch necessary data
-        users_df = get_table_data("Users")
-        flats_df = get_table_data("Flats")
-        gst_rates_df = get_table_data("GSTRates")
-        duty_rates_df = get_table_data("ElectricDutyRates")
-        surcharge_types_df = get_surcharge_rates()
-        
-        # Select user and flat
-        person_id = st.selectbox("Select Person ID", users_df["PersonID"].tolist())
-        selected_user = users_df[users_df["PersonID"] == person_id].iloc[0]
-        flat_no = st.selectbox("Select Flat No", flats_df[flats_df["FlatNo"].isin([selected_user["FlatNo"]])]["FlatNo"].tolist())
-        user_category = users_df.loc[users_df["PersonID"] == person_id, "UserCategory"].iloc[0]
-        name = users_df.loc[users_df["PersonID"] == person_id, "Name"]
-
-        if not name.empty:
-         name = name.iloc[0]  # Extract the first value safely
-        else:
-         name = "Unknown"  # Default value if no match found
-
-
-        # Select Billing Month (format: YYYY-MM)
-        current_year = datetime.now().year
-        month_mapping = {m: f"{current_year}-{i:02d}" for i, m in enumerate([
-            "January", "February", "March", "April", "May", "June",
-            "July", "August", "September", "October", "November", "December"], 1)}
-        selected_month = st.selectbox("Billing Month", list(month_mapping.keys()))
-        billing_month = month_mapping[selected_month]
-
-        # Meter Reading Inputs
-        present_reading = st.number_input("Present Reading (kWh)", min_value=0.0, step=0.01)
-        previous_month = get_previous_month(billing_month)
-        reading_id=0
-        # Fetch previous reading
-        cursor.execute("""  
-        SELECT PresentReading FROM BillingReadings 
-        WHERE FlatNo = ? AND BillingMonth = ? 
-        ORDER BY BillingMonth DESC LIMIT 1
-        """, (flat_no, previous_month))
-        previous_reading = cursor.fetchone()
-        previous_reading = previous_reading[0] if previous_reading else 0.0  
-        # Ensure session state for reading_id 
-        if "fetched_reading_id" not in st.session_state:
-          st.session_state.fetched_reading_id = None 
-        # Calculate units consumed
-        units_consumed = calculate_units_consumed(previous_reading, present_reading)
-        if st.button("📌 Insert Reading"):
+        if not bill_entry_options()["person_ids"]:
+            st.warning("⚠️ No users found!")
+            st.stop()
+
+        # Each step reruns on its own; the steps hand their values on through bill_entry
+        entry = st.session_state.setdefault("bill_entry", {})
+        bill_entry_selection()
+        bill_entry_reading()
+
+        if "reading" in entry:
+            bill_entry_charges()
+            bill_entry_surcharges()
+            bill_entry_adjusted()
+
+            # Insert Record Button
+            if st.button("📌 Insert Record"):
+                selection, reading, charges = entry["selection"], entry["reading"], entry["charges"]
+                surcharges, adjusted = entry["surcharges"], entry["adjusted"]
+                insert_bill(selection["person_id"], reading["reading_id"], selection["flat_no"],
+                            selection["user_category"], selection["name"], selection["billing_month"],
+                            selection["previous_reading"], reading["present_reading"], reading["units_consumed"],
+                            charges["electric_duty"], charges["gst"], charges["unit_adjusted"],
+                            surcharges["total"], adjusted["total"],
+                            surcharge_mappings=surcharges["mappings"] + adjusted["mappings"])
+
+    elif selected_option == "Import Readings":
+        st.title("📥 Import Meter Readings")
+        st.write("Upload a CSV with **FlatNo**, **BillingMonth** (YYYY-MM) and **PresentReading** columns "
+                 "(optional: PersonID, ReadingDate). Previous readings are filled in from each flat's latest "
+                 "earlier reading, and all valid rows are written in one transaction.")
+
+        readings_file = st.file_uploader("Readings CSV", type=["csv"])
+        validate_only = st.checkbox("Validate only (do not write readings)")
+
+        if readings_file is not None and st.button("📥 Import Readings"):
             try:
-                fetched_reading_id=insert_reading(cursor,conn,flat_no, previous_reading, present_reading)
-                # Fetch last inserted ID and store it
-                if fetched_reading_id is not None and fetched_reading_id > 0:
-                  st.session_state.fetched_reading_id = fetched_reading_id
-                  st.success(f"✅ Reading inserted! ID: {st.session_state.fetched_reading_id}")
-
-                       
+                result = import_readings(readings_file, dry_run=validate_only)
+                if validate_only:
+                    st.info(f"{len(result.inserted)} rows valid, {len(result.rejected)} rejected. Nothing written.")
+                else:
+                    st.success(f"✅ {len(result.inserted)} readings imported, {len(result.rejected)} rejected.")
+                if not result.rejected.empty:
+                    st.write("### ❌ Rejected Rows")
+                    st.dataframe(result.rejected, hide_index=True)
+                    st.download_button("📥 Download Rejected Rows", result.rejected.to_csv(index=False),
+                                       "rejected_readings.csv", "text/csv")
+                if not result.inserted.empty:
+                    st.write("### ✅ Accepted Rows")
+                    st.dataframe(result.inserted, hide_index=True)
+            except ValueError as e:
+                st.error(f"❌ Invalid file: {e}")
             except sqlite3.Error as e:
-                st.error(f"Database Error: {e}")
-           # GST Selection
-        if "fetched_reading_id" in st.session_state and st.session_state.fetched_reading_id:
-              st.subheader("💰 Additional Charges")
-              gst_options = gst_rates_df["GST"].tolist() if not gst_rates_df.empty else []
-              gst_selected = st.selectbox("Select GST (%)", gst_options + ["Manual Entry"], index=0)
-              gst_value = st.number_input("Enter GST (%)", min_value=0.0, step=0.01) if gst_selected == "Manual Entry" else gst_selected
-
-             # Electric Duty Selection
-              duty_options = duty_rates_df["ElectricDuty"].tolist() if not duty_rates_df.empty else []
-              duty_selected = st.selectbox("Select Electric Duty", duty_options + ["Manual Entry"], index=0)
-              electric_duty = st.number_input("Enter Electric Duty", min_value=0.0, step=0.01) if duty_selected == "Manual Entry" else duty_selected
-
-              # Units Adjusted (for previous months)
-              unit_adjusted = st.number_input("Units Adjusted (if any)", min_value=0.0, step=0.01, value=0.0)
-
-              st.subheader("⚡ Surcharge Handling")
-              surcharge_type_mapping = {
-               1: "Additional PHL",
-               2: "Uniform Quarterly",
-               3: "Fuel Charge"
-               }
-              surcharge_types_df["TypeName"] = surcharge_types_df["SurchargeTypeID"].map(surcharge_type_mapping)
-              # Step 1: Select Surcharge Type for the Current Billing Month
-              surcharge_options = surcharge_types_df["TypeName"].unique().tolist() if not surcharge_types_df.empty else []
-              total_monthly_surcharge =0.0
-              selected_surcharge_types = st.multiselect("Select Surcharge Type for Current Billing Month", surcharge_options)
-        
-              selected_surcharge_data=[]
-              for selected_surcharge_type in selected_surcharge_types:
-
-                  if selected_surcharge_type !="Additional PHL":
-             
-                     st.markdown(f"**Surcharge Type: {selected_surcharge_type}**")
-                     selected_surcharge_df= surcharge_types_df[surcharge_types_df["TypeName"]== selected_surcharge_type] if not surcharge_types_df.empty else []
-                     surcharge_type_id = selected_surcharge_df["SurchargeTypeID"].iloc[0] if not selected_surcharge_df.empty else None
-                     # Add an option for manual rate entry
-                     # manual_entry = st.checkbox(f"Enter custom rate for {selected_surcharge_type}")
-                       # if manual_entry:
-                       #   custom_rate = st.number_input(f"Enter custom rate for {selected_surcharge_type}", min_value=-10.0, max_value=10.0, step=0.01)
-                     #   effective_date = datetime.today().strftime("%m/%d/%Y")  # Today's Date
-
-                     #  if st.button(f"Save Custom Rate for {selected_surcharge_type}"):
-                      #     upsert_surcharge_rate(surcharge_type_id, custom_rate, effective_date)
-                       #     conn.commit()
-
-                       #    # Get the last inserted SurchargeID
-                          #    surcharge_id = cursor.lastrowid
-                         #   st.success(f"Custom rate saved with SurchargeID: {surcharge_id}")
-                           #  selected_surcharge_data.append([
-                            #    surcharge_id, selected_surcharge_type, custom_rate, effective_date
-                             # ])
-
-                   
-                        #else:
-                        #   surcharge_id = None  # Until user saves
-
-                        #else:
-                     if not selected_surcharge_df.empty:
-              
-                          selected_row = st.selectbox(f"Select Rate for {selected_surcharge_type}", selected_surcharge_df.apply(lambda row: f"Rate: {row['RatePerUnit']} | Effective: {row['EffectiveDate']}", axis=1).tolist())
-                         # Extract selected row details
-                          selected_index = selected_surcharge_df.apply(lambda row: f"Rate: {row['RatePerUnit']} | Effective: {row['EffectiveDate']}", axis=1).tolist().index(selected_row)
-                          selected_surcharge_info = selected_surcharge_df.iloc[selected_index]
-                          # Store data in 2D list
-                          selected_surcharge_data.append([
-                          selected_surcharge_info["SurchargeID"],  
-                          selected_surcharge_info["SurchargeTypeID"],
-                          selected_surcharge_type,
-                          selected_surcharge_info["RatePerUnit"],
-                          selected_surcharge_info["EffectiveDate"]
-                           ])
-                  else:
-                     st.markdown(f"**Surcharge Type: {selected_surcharge_type}**")
-                     selected_surcharge_df= surcharge_types_df[surcharge_types_df["TypeName"]== selected_surcharge_type] if not surcharge_types_df.empty else []
-             
-                     surcharge_type_id = selected_surcharge_df["SurchargeTypeID"].iloc[0] if not selected_surcharge_df.empty else None
-                     # Add an option for manual rate entry
-                     #manual_entry = st.checkbox(f"Enter custom rate for {selected_surcharge_type}")
-                     #if manual_entry:
-                           #   for units_from, units_to in [(1, 200), (201, 700)]:
-                          #      custom_rate = st.number_input(
-                         #      f"Enter Custom Rate for {selected_surcharge_type} (Units {units_from}-{units_to})",
-                         #     min_value=-10.0, max_value=10.0, step=0.01
-                             #     )
-        
-                            #  effective_date = datetime.today().strftime("%m/%d/%Y")  # Today's Date
-        
-                            #  if st.button(f"Save Custom Rate for {selected_surcharge_type} ({units_from}-{units_to})"):
-                           #      upsert_surcharge_rate(surcharge_type_id, custom_rate, units_from, units_to, effective_date)
-
-                         #       surcharge_id = cursor.lastrowid
-                          #       st.success(f"Custom rate saved with SurchargeID: {surcharge_id}")
-
-                         # Store selected surcharge info
-                             #       data=fetch_surcharge_rate(cursor,surcharge_type_id,units_consumed,effective_date)
-                           #
-                           #       selected_surcharge_data.append([surcharge_id,selected_surcharge_type,selected_rate,effective_date])
-            
-                    
-
-                          #else:
-                     if not selected_surcharge_df.empty:
-                         effective_date_options = selected_surcharge_df["EffectiveDate"].unique().tolist()
-                         selected_effective_date = st.selectbox(f"Select Effective Date for {selected_surcharge_type}", effective_date_options)
-                     
-                         data=fetch_surcharge_rate(cursor,surcharge_type_id,units_consumed,selected_effective_date)
-                         if data:
-                             surcharge_id,selected_rate=data
-                             if selected_rate is None:
-                                 st.warning(f"No rate found for SurchargeTypeID: {surcharge_type_id}, Units: {units_consumed}, Effective Date: {selected_effective_date}.")
-                             selected_surcharge_data.append([surcharge_id,surcharge_type_id,selected_surcharge_type,selected_rate,selected_effective_date])
-        
-              if selected_surcharge_data:
-                 total_monthly_surcharge = sum(float(row[3]) * units_consumed for row in selected_surcharge_data)
-                 for data in selected_surcharge_data:
-                     surcharge_id = data[0]
-                     surcharge_amount = data[3]*units_consumed
-    
-                     insert_or_update_readingsurchargemapping(
-                     reading_id=reading_id,
-                     surcharge_id=surcharge_id,
-                     billing_month=billing_month,
-                     adjusted_billing_month=billing_month,
-                     surcharge_amount=surcharge_amount,
-                     )
-
-
-              # Step 2: Select Adjusted Months for Surcharge Adjustments
-              previous_months = get_previous_billing_months(cursor,flat_no, billing_month)
-              adjusted_months = st.multiselect("Select Adjusted Billing Months", previous_months)
-              selected_adjusted_surcharge_data=[]
-               # Step 3: Select Surcharge Type for Each Adjusted Month
-              total_adjusted_surcharge = 0.0
-              selected_adjusted_surcharge_data=[]
-              for adjusted_month in adjusted_months:
-                 units_adjusted=get_units_adjusted(cursor,flat_no,adjusted_month)
-                 st.markdown(f"**Adjusted Billing Month: {adjusted_month}**")
-                 selected_adjusted_surcharge_types = st.multiselect(f"Select Surcharge Type for :{adjusted_month}", surcharge_options)
-                 for selected_adjusted_surcharge_type in selected_adjusted_surcharge_types:
-
-                     if selected_adjusted_surcharge_type !="Additional PHL":
-             
-                         st.markdown(f"**Surcharge Type: {selected_adjusted_surcharge_type}**")
-                         selected_surcharge_df= surcharge_types_df[surcharge_types_df["TypeName"]== selected_adjusted_surcharge_type] if not surcharge_types_df.empty else []
-                         surcharge_type_id = selected_surcharge_df["SurchargeTypeID"].iloc[0] if not selected_surcharge_df.empty else None
-                          # Add an option for manual rate entry
-                          #manual_entry = st.checkbox(f"Enter custom rate for {selected_adjusted_surcharge_type}")
-                          #if manual_entry:
-                           #   custom_rate = st.number_input(f"Enter custom rate for {selected_adjusted_surcharge_type}", min_value=-10.0, max_value=10.0, step=0.01)
-                           #   effective_date = datetime.today().strftime("%m/%d/%Y")  # Today's Date
-
-                         #  if st.button(f"Save Custom Rate for {selected_adjusted_surcharge_type}"):
-                         #      upsert_surcharge_rate(surcharge_type_id, custom_rate, effective_date)
-                         #      conn.commit()
-
-                         #      # Get the last inserted SurchargeID
-                         #      surcharge_id = cursor.lastrowid
-                         #      st.success(f"Custom rate saved with SurchargeID: {surcharge_id}")
-                            #      selected_adjusted_surcharge_data.append([
-                             #       surcharge_id, selected_adjusted_surcharge_type, custom_rate, units_adjusted,effective_date
-                            #       ])
-                          #   else:
-                           #       surcharge_id = None  # Until user saves
-
-                            #else:
-                         if not selected_surcharge_df.empty:
-              
-                              selected_row = st.selectbox(f"Select Rate for {selected_adjusted_surcharge_type}", selected_surcharge_df.apply(lambda row: f"Rate: {row['RatePerUnit']} | Effective: {row['EffectiveDate']}", axis=1).tolist())
-                             # Extract selected row details
-                              selected_index = selected_surcharge_df.apply(lambda row: f"Rate: {row['RatePerUnit']} | Effective: {row['EffectiveDate']}", axis=1).tolist().index(selected_row)
-                              selected_surcharge_info = selected_surcharge_df.iloc[selected_index]
-                               # Store data in 2D list
-                              selected_adjusted_surcharge_data.append([
-                              selected_surcharge_info["SurchargeID"],     
-                              selected_surcharge_info["SurchargeTypeID"],
-                              selected_adjusted_surcharge_type,
-                              selected_surcharge_info["RatePerUnit"],
-                              units_adjusted,
-                              adjusted_month,
-                              selected_surcharge_info["EffectiveDate"]
-                              ])
-                     else:
-                          st.markdown(f"**Surcharge Type: {selected_adjusted_surcharge_type}**")
-                          selected_surcharge_df= surcharge_types_df[surcharge_types_df["TypeName"]== selected_adjusted_surcharge_type] if not surcharge_types_df.empty else []
-                          surcharge_type_id = selected_surcharge_df["SurchargeTypeID"].iloc[0] if not selected_surcharge_df.empty else None
-                              # Add an option for manual rate entry
-                              #manual_entry = st.checkbox(f"Enter custom rate for {selected_adjusted_surcharge_type}")
-                                #if manual_entry:
-                               #  for units_from, units_to in [(1, 200), (201, 700)]:
-                             #     custom_rate = st.number_input(
-                              #    f"Enter Custom Rate for {selected_adjusted_surcharge_type} (Units {units_from}-{units_to})",
-                             #   min_value=-10.0, max_value=10.0, step=0.01
-                              #  )
-        
-                             #    effective_date = datetime.today().strftime("%m/%d/%Y")  # Today's Date
-        
-                               #   if st.button(f"Save Custom Rate for {selected_surcharge_type} ({units_from}-{units_to})"):
-                             #       upsert_surcharge_rate(surcharge_type_id, custom_rate, units_from, units_to, effective_date)
-
-                               #       surcharge_id = cursor.lastrowid
-                                  #       st.success(f"Custom rate saved with SurchargeID: {surcharge_id}")
-
-                                  #   # Store selected surcharge info
-                               #selected_rate,surcharge_id=fetch_surcharge_rate(surcharge_type_id,units_adjusted,effective_date)
+                st.error(f"❌ Database Error: {e}")
 
-                               #selected_adjusted_surcharge_data.append([surcharge_id,surcharge_type_id,selected_adjusted_surcharge_type,selected_rate,units_adjusted,adjusted_month,effective_date])
-            
-                    
-
-                                   #else:
-                          if not selected_surcharge_df.empty:
-                                effective_date_options = selected_surcharge_df["EffectiveDate"].unique().tolist()
-                                selected_effective_date = st.selectbox(f"Select Effective Date for {selected_adjusted_surcharge_type}", effective_date_options)
-                     
-                                data=fetch_surcharge_rate(cursor,surcharge_type_id,units_consumed,selected_effective_date)
-                                if data:
-                                      surcharge_id,selected_rate=data
-                                      selected_adjusted_surcharge_data.append([surcharge_id,surcharge_type_id,selected_adjusted_surcharge_type,selected_rate,units_adjusted,adjusted_month,selected_effective_date])
-        
-        
-              total_adjusted_surcharge = sum(float(row[3] if row[3] else 0) * float(row[4] if row[4] else 0) for row in selected_adjusted_surcharge_data)
-              for data in selected_adjusted_surcharge_data:
-                  surcharge_id = data[0]
-                  surcharge_amount = data[3]*data[4]
-                  adjusted_billing_month=data[5]
-    
-                  insert_or_update_readingsurchargemapping(
-                  reading_id=reading_id,
-                  surcharge_id=surcharge_id,
-                  billing_month=billing_month,
-                  adjusted_billing_month=adjusted_billing_month,
-                  surcharge_amount=surcharge_amount,
-                  )
-
-
-        
-
-              # Display Computed Values
-              st.text(f"🔹 **Current Month Surcharge:** {total_monthly_surcharge:.2f} PKR")
-              st.text(f"🔹 **Adjusted Surcharge Total:** {total_adjusted_surcharge:.2f} PKR")
-             # Insert Record Button
-              if st.button("📌 Insert Record"):
-                insert_bill(person_id,st.session_state.fetched_reading_id, flat_no,user_category,name,billing_month,previous_reading,present_reading,units_consumed, electric_duty, gst_value, unit_adjusted,total_monthly_surcharge,total_adjusted_surcharge)
-            
-
-                # Close the connection
-        conn.close()
- 
     elif selected_option == "Update/Delete Bill Record":
      st.title("✏️ Update or 🗑️ Delete Bill Record")
 
@@ -439,30 +466,28 @@ elif selected_section == "📊 Billing Management":
      gst_rates_df = get_table_data("GSTRates")
      duty_rates_df = get_table_data("ElectricDutyRates")
      surcharge_types_df = get_surcharge_rates()
+     # Flats, months and bills are read once per session until something is written
+     snapshot_cache = st.session_state.setdefault("bill_snapshots", {})
      # Fetch available Flats
-     cursor.execute("SELECT DISTINCT FlatNo FROM BillingReadings")
-     flat_list = [row[0] for row in cursor.fetchall()]
+     flat_list = get_billed_flats(snapshot_cache)
      if not flat_list:
         st.warning("⚠️ No flats found with billing records!")
-        conn.close()
         st.stop()
 
      flat_no = st.selectbox("Select Flat No", flat_list)
 
      # Fetch available Billing Months for the selected flat
-     cursor.execute("SELECT DISTINCT BillingMonth FROM BillingReadings WHERE FlatNo=?", (flat_no,))
-     month_list = [row[0] for row in cursor.fetchall()]
+     month_list = get_reading_months(flat_no, snapshot_cache)
      if not month_list:
         st.warning("⚠️ No billing records found for this flat!")
-        conn.close()
         st.stop()
 
      month = st.selectbox("Select Billing Month", month_list)
     
 
-     # Fetch Users associated with the flat
-     cursor.execute("SELECT PersonID, Name FROM Users WHERE FlatNo=?", (flat_no,))
-     users = cursor.fetchall()
+     # Reading, bill, users and surcharges of the flat's month in one query
+     snapshot = get_bill_snapshot(flat_no, month, snapshot_cache)
+     users = snapshot.users if snapshot else []
     
      if users:
         user_dict = {f"{row[1]} (ID: {row[0]})": row for row in users}
@@ -475,15 +500,11 @@ elif selected_section == "📊 Billing Management":
      st.text(f"👤 Person ID: {person_id}")
      st.text(f"📛 Name: {person_name}")
 
-     # Fetch Billing Data
-     bill_data = fetch_complete_bill(flat_no, month)
-
-     if bill_data:
-        (
-            reading_id, previous_reading, present_reading,_,unit_adjusted, 
-            _, _, _, electric_duty, gst, 
-            _,_
-        ) = bill_data
+     if snapshot and snapshot.bill_id is not None:
+        reading_id = snapshot.reading_id
+        previous_reading = snapshot.previous_reading
+        present_reading = snapshot.present_reading
+        unit_adjusted = snapshot.units_adjusted
 
         present_reading = st.number_input("New Present Reading (kWh)", min_value=0.0, step=0.01, value=present_reading)
         units_consumed = calculate_units_consumed(previous_reading, present_reading)
@@ -494,10 +515,12 @@ elif selected_section == "📊 Billing Management":
         
         unit_adjusted = st.number_input("Units Adjusted (if any)", min_value=0.0, step=0.01, value=unit_adjusted)
 
-        surcharge_data = fetch_surcharge_mapping(cursor,reading_id, month)
+        surcharge_data = snapshot.surcharges
         
         total_monthly_surcharge = 0
         total_adjusted_surcharge = 0
+        # (SurchargeID, AdjustedBillingMonth, SurchargeAmount) rows, written when the bill is saved
+        surcharge_mappings = []
         if surcharge_data:
           st.subheader("⚡ Surcharge Handling")
 
@@ -514,7 +537,8 @@ elif selected_section == "📊 Billing Management":
          
 
           for record in surcharge_data:
-             (surcharge_id, surcharge_type_id, surcharge_type, old_rate, adjusted_billing_month, surcharge_amount, adjustment_reason,old_effective_date) = record
+             surcharge_id, surcharge_type_id, surcharge_type = record.surcharge_id, record.surcharge_type_id, record.type_name
+             adjusted_billing_month, old_effective_date = record.adjusted_billing_month, record.effective_date
 
              # Ensure the DataFrame is not empty before filtering
              if not surcharge_types_df.empty:
@@ -563,7 +587,7 @@ elif selected_section == "📊 Billing Management":
                          selected_surcharge_info["EffectiveDate"]
                          ])
                  else:
-                     units_adjusted=get_units_adjusted(cursor,flat_no,adjusted_billing_month)
+                     units_adjusted = record.adjusted_units
                      if surcharge_type == "Additional PHL":
                          st.markdown(f"**Surcharge Type: {surcharge_type}**")
 
@@ -572,7 +596,7 @@ elif selected_section == "📊 Billing Management":
 
                          effective_date = st.selectbox(f"Select Effective Date for {surcharge_type}", effective_date_options)
                          selected_effective_date = st.date_input("Enter Effective Date",  value=old_effective_date)
-                         data = fetch_surcharge_rate(surcharge_type_id, units_consumed, selected_effective_date)
+                         data = fetch_surcharge_rate(cursor, surcharge_type_id, units_consumed, selected_effective_date)
 
                          if data:
                              surcharge_id, selected_rate = data
@@ -610,31 +634,12 @@ elif selected_section == "📊 Billing Management":
           if updated_current_surcharge_data:
              total_monthly_surcharge = sum(float(row[3]) * units_consumed for row in updated_current_surcharge_data)
              for data in updated_current_surcharge_data:
-                 surcharge_id = data[0]
-                 surcharge_amount = data[3]*units_consumed
-    
-                 insert_or_update_readingsurchargemapping(
-                 reading_id=reading_id,
-                 surcharge_id=surcharge_id,
-                 billing_month=month,
-                 adjusted_billing_month=month,
-                 surcharge_amount=surcharge_amount,
-                 )
+                 surcharge_mappings.append((data[0], month, data[3]*units_consumed))
               
           if updated_adjusted_surcharge_data:
            total_adjusted_surcharge = sum(float(row[3] if row[3] else 0) * float(row[4] if row[4] else 0) for row in updated_adjusted_surcharge_data)
            for data in updated_adjusted_surcharge_data:
-              surcharge_id = data[0]
-              surcharge_amount = data[3]*data[4]
-              adjusted_billing_month=data[5]
-    
-              insert_or_update_readingsurchargemapping(
-               reading_id=reading_id,
-               surcharge_id=surcharge_id,
-               billing_month=month,
-               adjusted_billing_month=adjusted_billing_month,
-               surcharge_amount=surcharge_amount,
-               )
+              surcharge_mappings.append((data[0], data[5], data[3]*data[4]))
               
 
 
@@ -645,7 +650,8 @@ elif selected_section == "📊 Billing Management":
         st.text(f"🔹 **Adjusted Surcharge Total:** {total_adjusted_surcharge:.2f} PKR")
             
         if st.button("✏️ Update Bill Record"):
-            update_bill(flat_no, month, present_reading, electric_duty, gst,unit_adjusted,total_monthly_surcharge,total_adjusted_surcharge)
+            update_bill(flat_no, month, present_reading, electric_duty, gst,unit_adjusted,total_monthly_surcharge,total_adjusted_surcharge,
+                        surcharge_mappings=surcharge_mappings)
            
         if "delete_confirm" not in st.session_state:
              st.session_state.delete_confirm = False   
@@ -667,10 +673,11 @@ elif selected_section == "📊 Billing Management":
                      st.success("Deletion Cancelled.")
             
 
-     conn.close()
-
 
     elif selected_option == "Generate Bill":
+        # reportlab loads with the page that prints bills, not with every session
+        from bill_pdf import default_workers, export_bulk_bills, generate_pdf
+
         st.title("⚡ User-Specific Electricity Bill Generation")
         
         # Option 1: Generate Bill for a specific user and month
@@ -703,11 +710,9 @@ elif selected_section == "📊 Billing Management":
 
                     # Fetch user details for PDF generation (Only if person_id is given)
                     if person_id:
-                        conn = sqlite3.connect("billing_system.db")
-                        cursor = conn.cursor()
+                        cursor = get_connection().cursor()
                         cursor.execute("SELECT Name FROM Users WHERE FlatNo = ? AND PersonID = ?", (flat_no, person_id))
                         result = cursor.fetchone()
-                        conn.close()
                         
                         if result:
                             st.session_state.name = result[0]
@@ -784,15 +789,18 @@ elif selected_section == "📊 Billing Management":
         # Option 2: Bulk Electricity Bill Generation
         st.title("📑 Batch Electricity Bill Generation")
         selected_month = st.text_input("Enter Billing Month (YYYY-MM):", key="bulk_bill_month")  # Unique key added
+        render_workers = st.number_input("Render Workers (processes)", min_value=1, step=1,
+                                         value=default_workers(), key="bulk_bill_workers")
 
         if st.button("Generate Bills"):
             if selected_month:
-                billing_data = fetch_billing_data(selected_month)
-                if billing_data:
-                    pdf_file = Generate_bulk_bill_pdf(billing_data, selected_month)
+                # Stream the month off the cursor in batches into a spooled temp file
+                pdf_file, page_count = export_bulk_bills(iter_billing_data(selected_month), selected_month,
+                                                         workers=int(render_workers))
+                if page_count:
                     st.download_button(
                         label="Download PDF",
-                        data=pdf_file.getvalue(),  # Ensure binary data is passed
+                        data=pdf_file.read(),  # Streamlit keeps downloads in memory; read the spooled file once
                         file_name=f"Bulk_Bills_{selected_month}.pdf",
                         mime="application/pdf"
                     )
@@ -802,6 +810,31 @@ elif selected_section == "📊 Billing Management":
             else:
                 st.error("Please enter a valid month in YYYY-MM format.")
 
+    elif selected_option == "Close Month":
+        st.title("🗓️ Month-Close Billing")
+        st.write("Prices every unbilled reading of the month in one batch and writes all charges in a single transaction.")
+
+        close_billing_month = st.text_input("Enter Billing Month (YYYY-MM):", key="close_month")
+        dry_run = st.checkbox("Preview only (do not write charges)")
+
+        if st.button("🧾 Close Month"):
+            if close_billing_month:
+                try:
+                    bills = close_month(close_billing_month, dry_run=dry_run)
+                    if bills.empty:
+                        st.warning("No unbilled readings found for the selected month!")
+                    else:
+                        if dry_run:
+                            st.info(f"Preview: {len(bills)} bills priced, nothing written.")
+                        else:
+                            st.success(f"✅ {len(bills)} bills written for {close_billing_month}!")
+                        st.dataframe(bills[["FlatNo", "Name", "UnitsConsumed", "RatePerUnit", "VariableCharges",
+                                            "TotalAdditionalCharges", "TotalSurcharge", "NetPayableAmount"]])
+                except sqlite3.Error as e:
+                    st.error(f"❌ Database Error: {e}")
+            else:
+                st.error("Please enter a valid month in YYYY-MM format.")
+
     elif selected_option == "Billing Records":
         st.title("📊 View Records")
 
@@ -814,66 +847,25 @@ elif selected_section == "📊 Billing Management":
         # Dropdown to select a table
         selected_table = st.selectbox("Select a Table", tables)
         
-        # Fetch data for the selected table
-        df = get_table_data(selected_table)
-        
-        # Display the raw dataframe
-        st.write(f"### {selected_table} Table")
-        st.dataframe(df)
-
-        # Add advanced search filters
-        st.markdown("---")
+        # Filters pushed into SQL; only the current page is loaded
         st.write("### 🔍 Advanced Search")
-        
-        # Use columns for better alignment
-        col1, col2 = st.columns(2)
-        
-        # Initialize filtered DataFrame
-        filtered_df = df.copy()
-
-        # Dynamic search filters based on the selected table
-        if selected_table == "BillingReadings":
-            with col1:
-                flat_no_filter = st.text_input("Search by Flat No (exact match):")
-            with col2:
-                billing_month_filter = st.text_input("Search by Billing Month (YYYY-MM):")
-            
-            # Apply filters
-            if flat_no_filter:
-                filtered_df = filtered_df[filtered_df["FlatNo"].astype(str) == flat_no_filter]
-            if billing_month_filter:
-                filtered_df = filtered_df[filtered_df["BillingMonth"].astype(str) == billing_month_filter]
-        
-        elif selected_table == "BillingCharges":
-            with col1:
-                flat_no_filter = st.text_input("Search by Flat No (exact match):")
-
-            # Apply filters
-            if flat_no_filter:
-                filtered_df = filtered_df[filtered_df["FlatNo"].astype(str) == flat_no_filter]
-
-        elif selected_table == "ConsumptionHistory":
-            with col1:
-                billing_month_filter = st.text_input("Search by Billing Month (YYYY-MM):")
-
-            # Apply filters
-            if billing_month_filter:
-                filtered_df = filtered_df[filtered_df["BillingMonth"].astype(str) == billing_month_filter]
-
-        # General Search if no specific filters are applied
-        if not any([flat_no_filter, billing_month_filter]):
-            st.markdown("---")
-            st.write("### 🔍 General Search")
-            search_term = st.text_input("Search within the table (all columns):")
-            if search_term:
-                filtered_df = filtered_df[filtered_df.apply(lambda row: row.astype(str).str.contains(search_term, case=False).any(), axis=1)]
-        
-        # Display filtered results
-        if not filtered_df.empty:
-            st.write(f"### Filtered Results ({len(filtered_df)} records found)")
-            st.dataframe(filtered_df)
-        else:
-            st.warning("No records found matching your search criteria.")
+        filters = {}
+        filter_columns = [column for column in ("FlatNo", "PersonID", "BillingMonth")
+                          if column in RECORD_TABLES[selected_table].columns]
+        if filter_columns:
+            for column, col in zip(filter_columns, st.columns(len(filter_columns))):
+                with col:
+                    label = "Search by Billing Month (YYYY-MM):" if column == "BillingMonth" else f"Search by {column} (exact match):"
+                    filters[column] = st.text_input(label, key=f"records_{selected_table}_{column}")
+
+        search_term = st.text_input("Search within the table (all columns):", key=f"records_{selected_table}_search")
+
+        show_paged_table(
+            f"records_{selected_table}", selected_table,
+            filters=filters,
+            search=search_term,
+            empty_message="No records found matching your search criteria.",
+        )
 
 # Rate Management Logic
 elif selected_section == "⚡ Rate Management":
@@ -908,6 +900,26 @@ elif selected_section == "⚡ Rate Management":
             upsert_surcharge_rate(surcharge_type_id, rate_per_unit, units_from, units_to, effective_date)
             st.success("Surcharge Rate updated!")
 
+        # Tariff Pricing Mode
+        st.markdown("### Tariff Pricing Mode")
+        st.caption("Flat charges every unit at the rate of the slab the reading falls in; progressive charges "
+                   "each slab's units at that slab's rate.")
+        slabs_df = get_tariff_slabs()
+        if slabs_df.empty:
+            st.info("No tariff slabs defined.")
+        else:
+            mode_category = st.selectbox("User Category", sorted(slabs_df["UserCategory"].dropna().unique()),
+                                         key="mode_category")
+            schedule_dates = sorted(slabs_df.loc[slabs_df["UserCategory"] == mode_category, "RateEffectiveDate"]
+                                    .dropna().unique(), reverse=True)
+            mode_date = st.selectbox("Slabs Effective From", schedule_dates, key="mode_date")
+            current_mode = tariff_slabs.mode(mode_category, as_of=mode_date)
+            pricing_mode = st.radio("Pricing Mode", PRICING_MODES, index=PRICING_MODES.index(current_mode),
+                                    horizontal=True, key="pricing_mode")
+            if st.button("💾 Save Pricing Mode"):
+                updated = set_tariff_pricing_mode(mode_category, mode_date, pricing_mode)
+                st.success(f"Pricing mode set to {pricing_mode} on {updated} slab(s)!")
+
     elif selected_option == "View Rates":
         st.subheader("View Rates")
 
@@ -924,4 +936,106 @@ elif selected_section == "⚡ Rate Management":
         # Surcharge Rates
         st.markdown("### Surcharge Rates")
         surcharge_rates_df = get_surcharge_rates()
-        st.dataframe(surcharge_rates_df)
\ No newline at end of file
+        st.dataframe(surcharge_rates_df)
+
+        # Tariff Slabs
+        st.markdown("### Tariff Slabs")
+        st.dataframe(get_tariff_slabs())
+
+    elif selected_option == "Tariff Simulator":
+        st.subheader("🧮 What-if Tariff Simulator")
+        st.caption("Re-prices the recorded readings under proposed rates and compares them with the rates "
+                   "in force each month. Nothing is saved.")
+
+        history_months = list(load_history()["BillingMonth"].cat.categories)
+        if not history_months:
+            st.warning("⚠️ No readings to simulate!")
+            st.stop()
+        start_col, end_col = st.columns(2)
+        start_month = start_col.selectbox("From Month", history_months, index=0, key="sim_start")
+        end_month = end_col.selectbox("To Month", history_months, index=len(history_months) - 1, key="sim_end")
+
+        def edited_bands(frame, low, high):
+            # Editor rows without a rate are ignored; empty bounds are open-ended
+            frame = frame.dropna(subset=["RatePerUnit"])
+            return [(None if pd.isna(row[low]) else float(row[low]), None if pd.isna(row[high]) else float(row[high]),
+                     float(row["RatePerUnit"])) for _, row in frame.iterrows()]
+
+        st.markdown("### Tariff Slabs")
+        proposed_slabs, proposed_modes = {}, {}
+        for category in tariff_slabs.categories():
+            if st.checkbox(f"Propose slabs for {category}", key=f"sim_slabs_on_{category}"):
+                current = pd.DataFrame(tariff_slabs.schedule(category), columns=["MinUnits", "MaxUnits", "RatePerUnit"])
+                edited = st.data_editor(current, num_rows="dynamic", hide_index=True, key=f"sim_slabs_{category}")
+                proposed_slabs[category] = edited_bands(edited, "MinUnits", "MaxUnits")
+                proposed_modes[category] = st.radio(
+                    "Pricing Mode", PRICING_MODES, index=PRICING_MODES.index(tariff_slabs.mode(category)),
+                    horizontal=True, key=f"sim_mode_{category}")
+
+        st.markdown("### GST & Electric Duty")
+        gst_col, duty_col = st.columns(2)
+        proposed_gst = gst_col.number_input("GST (%)", min_value=0.0, step=0.1, value=None,
+                                            placeholder="As scheduled", key="sim_gst")
+        proposed_duty = duty_col.number_input("Electric Duty (%)", min_value=0.0, step=0.1, value=None,
+                                              placeholder="As scheduled", key="sim_duty")
+
+        st.markdown("### Surcharges")
+        surcharge_rates_df = get_surcharge_rates()
+        proposed_surcharges = {}
+        for _, surcharge_type in get_table_data("SurchargeType").iterrows():
+            type_id = int(surcharge_type["SurchargeTypeID"])
+            if st.checkbox(f"Propose rates for {surcharge_type['TypeName']}", key=f"sim_surcharge_on_{type_id}"):
+                effective = surcharge_resolver.effective_date(type_id)
+                current = surcharge_rates_df[(surcharge_rates_df["SurchargeTypeID"] == type_id) &
+                                             (surcharge_rates_df["EffectiveDate"] == effective)]
+                edited = st.data_editor(current[["UnitsFrom", "UnitsTo", "RatePerUnit"]].sort_values("UnitsFrom"),
+                                        num_rows="dynamic", hide_index=True, key=f"sim_surcharge_{type_id}")
+                proposed_surcharges[type_id] = edited_bands(edited, "UnitsFrom", "UnitsTo")
+
+        started = datetime.now()
+        result = simulate(Scenario(proposed_slabs, proposed_gst, proposed_duty, proposed_surcharges, proposed_modes),
+                          start_month, end_month)
+        elapsed_ms = (datetime.now() - started).total_seconds() * 1000
+
+        totals = result.totals
+        st.markdown("### Impact")
+        baseline_col, proposed_col, delta_col = st.columns(3)
+        baseline_col.metric("As Scheduled (PKR)", f"{totals['baseline']:,.0f}")
+        proposed_col.metric("Proposed (PKR)", f"{totals['proposed']:,.0f}")
+        delta_col.metric("Change (PKR)", f"{totals['delta']:+,.0f}",
+                         f"{totals['delta'] / totals['baseline']:+.2%}" if totals["baseline"] else None,
+                         delta_color="inverse")
+        st.caption(f"{totals['readings']:,} readings from {start_month} to {end_month} simulated in {elapsed_ms:.0f} ms")
+
+        if totals["readings"]:
+            st.bar_chart(result.by_month.set_index("BillingMonth")["Delta"])
+            st.markdown("#### Per Month")
+            st.dataframe(result.by_month, hide_index=True)
+            st.markdown("#### Per Flat")
+            st.dataframe(result.by_flat.sort_values("Delta", ascending=False), hide_index=True)
+
+# Reference-data cache counters (rendered last so they include this rerun)
+with st.sidebar.expander("🗄️ Reference Cache"):
+    cache_stats = reference_cache.stats()
+    st.metric("Hit Rate", f"{cache_stats['hit_rate']:.0%}")
+    st.caption(
+        f"{cache_stats['hits']} hits · {cache_stats['misses']} misses · "
+        f"{cache_stats['entries']} entries · "
+        f"{cache_stats['bytes'] / 1024:.1f} / {cache_stats['max_bytes'] / 1024 / 1024:.0f} MiB · "
+        f"{cache_stats['evictions']} evictions · {cache_stats['invalidations']} invalidations"
+    )
+
+# SQL trace of this rerun (BILLING_SQL_TRACE=1)
+if sql_trace.ENABLED:
+    trace = sql_trace.end_run()
+    with st.sidebar.expander("🔍 SQL Trace"):
+        st.metric("Queries", trace["queries"], help=f"{trace['statements']} statements including triggers")
+        st.caption(f"{trace['total_ms']:.1f} ms in SQL of {trace['wall_ms']:.1f} ms")
+        if trace["slowest"]:
+            st.dataframe(pd.DataFrame([
+                {"ms": round(group["total_ms"], 2), "calls": group["count"], "rows": group["rows"],
+                 "query": group["sql"], "callers": ", ".join(group["callers"])}
+                for group in trace["slowest"]
+            ]), hide_index=True)
+        for repeat in trace["repeated"]:
+            st.warning(f"Possible N+1: {repeat['count']}× `{repeat['sql'][:120]}` from {repeat['caller']}")
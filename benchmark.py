@@ -0,0 +1,269 @@
+# Description: Benchmarks for the billing hot paths on a synthetic database.
+#
+#   python benchmark.py --users 5000 --months 12 --output results.json
+#   python benchmark.py --compare baseline.json --output results.json
+#
+# Every benchmark reports throughput, p50/p95/max latency and the peak Python
+# memory of one extra traced call; results are written as JSON and can be
+# compared against a previous run to catch regressions.
+import argparse
+import gc
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+import synthetic_data
+from db import get_connection, get_db_path
+
+# Relative slowdown of p50 (or growth of peak memory) reported as a regression
+DEFAULT_THRESHOLD = 0.2
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Run in a fresh interpreter: time appchanged.py's first render with Streamlit and pandas
+# already imported, as they are in a running server. Prints milliseconds and max RSS (KiB).
+FIRST_RENDER_SCRIPT = """
+import contextlib, io, resource, runpy, sys, time
+from streamlit import config, logger
+config.get_config_options()
+logger.set_log_level("error")
+import pandas, streamlit
+with contextlib.redirect_stdout(io.StringIO()):
+    streamlit.empty()  # the one-off bare-mode REPL check is not part of the app
+started = time.perf_counter()
+runpy.run_path(sys.argv[1], run_name="__main__")
+print((time.perf_counter() - started) * 1000, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+class Benchmark:
+    """
+    One hot path.
+
+    Args:
+        name (str): Key in the results.
+        run (callable): Called with the iteration number; one call is one operation.
+        repeat (int): Timed calls.
+        items (int): Items processed per call (bills, pages, rows) for throughput.
+        self_timed (bool): run() returns (seconds, peak bytes) measured in a subprocess.
+    """
+
+    def __init__(self, name, run, repeat, items=1, self_timed=False):
+        self.name = name
+        self.run = run
+        self.repeat = repeat
+        self.items = items
+        self.self_timed = self_timed
+
+
+def measure(benchmark):
+    """Time benchmark.repeat calls, then trace one more for peak memory."""
+    if benchmark.self_timed:
+        latencies, peaks = zip(*(benchmark.run(i) for i in range(benchmark.repeat)))
+        return _result(benchmark, list(latencies), max(peaks))
+
+    latencies = []
+    gc.collect()
+    for i in range(benchmark.repeat):
+        started = time.perf_counter()
+        benchmark.run(i)
+        latencies.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    benchmark.run(benchmark.repeat)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return _result(benchmark, latencies, peak)
+
+
+def _result(benchmark, latencies, peak):
+
+    latencies = np.array(latencies)
+    return {
+        "runs": benchmark.repeat,
+        "items_per_run": benchmark.items,
+        "total_s": round(float(latencies.sum()), 4),
+        "throughput_per_s": round(benchmark.repeat * benchmark.items / float(latencies.sum()), 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 3),
+        "max_ms": round(float(latencies.max()) * 1000, 3),
+        "peak_mem_mb": round(peak / 1024 / 1024, 3),
+    }
+
+
+def first_render(db_path, work_dir):
+    """One cold first render of the app in a new interpreter: (seconds, max RSS bytes)."""
+    env = dict(os.environ, BILLING_DB_PATH=db_path, PYTHONPATH=REPO_DIR)
+    output = subprocess.run([sys.executable, "-c", FIRST_RENDER_SCRIPT, os.path.join(REPO_DIR, "appchanged.py")],
+                            cwd=work_dir, env=env, capture_output=True, text=True, check=True).stdout
+    ms, max_rss_kib = output.split()[-2:]
+    return float(ms) / 1000, int(max_rss_kib) * 1024
+
+
+def build_benchmarks(summary, repeat):
+    """The benchmark list for a database produced by synthetic_data.generate()."""
+    # Streamlit-bound helpers; messages go nowhere outside `streamlit run`, and the
+    # bare-mode "missing ScriptRunContext" warning would otherwise fire on every st.* call
+    from streamlit import config, logger
+    config.get_config_options()  # parsing the config later would reset the level
+    logger.set_log_level("error")
+    import functions
+    from bill_pdf import Generate_bulk_bill_pdf
+    from billing_engine import close_month, fetch_billing_data
+    from queries import RELEVANCE, query_page
+    from tariff_simulator import Scenario, simulate
+    conn = get_connection()
+    billed_month = synthetic_data.month_range(summary["first_month"], summary["months"])[-2]
+    open_month = summary["last_month"]
+    billed = conn.execute("""
+        SELECT br.FlatNo, br.PresentReading FROM BillingReadings br
+        JOIN BillingCharges bc ON bc.ReadingID = br.ReadingID
+        WHERE br.BillingMonth = ? ORDER BY br.FlatNo
+    """, (billed_month,)).fetchall()
+    unbilled = conn.execute("""
+        SELECT br.ReadingID, br.FlatNo, br.PersonID, u.UserCategory, u.Name,
+               br.PreviousReading, br.PresentReading, br.UnitsConsumed
+        FROM BillingReadings br JOIN Users u ON u.PersonID = br.PersonID
+        WHERE br.BillingMonth = ? ORDER BY br.FlatNo
+    """, (open_month,)).fetchall()
+    # Every category 10% dearer, GST and duty overridden, fuel charge re-banded
+    scenario = Scenario(
+        slabs={category: [(low, high, rate * 1.1) for low, high, rate in synthetic_data.TARIFFS[category]]
+               for category in synthetic_data.TARIFFS},
+        gst_rate=18, electric_duty=2, surcharges={3: [(None, 300, 1.5), (301, None, 2.5)]})
+    month_rows = len(fetch_billing_data(billed_month))
+    pdf_rows = fetch_billing_data(billed_month)[:min(month_rows, 500)]
+
+    def insert_bill(i):
+        reading_id, flat_no, person_id, category, name, previous, present, units = unbilled[i]
+        functions.insert_bill(person_id, reading_id, flat_no, category, name, open_month, previous, present,
+                              units, 1.5, 17, 0, 0.0, 0.0)
+
+    def update_bill(i):
+        flat_no, present = billed[i % len(billed)]
+        functions.update_bill(flat_no, billed_month, present_reading=present, electric_duty=1.5, gst=17,
+                              unit_adjusted=0, total_montly_surcharge=0.0, total_adjusted_surcharge=0.0)
+
+    work_dir = os.getcwd()
+    db_path = os.path.abspath(get_db_path())
+    benchmarks = [
+        # peak_mem_mb of first_render is the subprocess' max RSS, not a tracemalloc peak
+        Benchmark("first_render", lambda i: first_render(db_path, work_dir), 5, self_timed=True),
+        Benchmark("insert_bill", insert_bill, min(repeat, len(unbilled) - 1)),
+        Benchmark("update_bill", update_bill, repeat),
+        Benchmark("fetch_complete_bill",
+                  lambda i: functions.fetch_complete_bill(billed[i % len(billed)][0], billed_month), repeat),
+        Benchmark("fetch_billing_data", lambda i: fetch_billing_data(billed_month), max(repeat // 10, 3), month_rows),
+        Benchmark("Generate_bulk_bill_pdf", lambda i: Generate_bulk_bill_pdf(pdf_rows, billed_month),
+                  3, len(pdf_rows)),
+        Benchmark("month_close_dry_run", lambda i: close_month(open_month, dry_run=True),
+                  3, len(unbilled)),
+        Benchmark("simulate_tariff", lambda i: simulate(scenario), max(repeat // 10, 3), summary["readings"]),
+        Benchmark("search_billing_readings",
+                  lambda i: query_page("BillingReadings", search=f"{billed[i % len(billed)][0]} {billed_month[:4]}",
+                                       sort_by=RELEVANCE), repeat),
+        Benchmark("filter_billing_readings",
+                  lambda i: query_page("BillingReadings", filters={"BillingMonth": billed_month},
+                                       sort_by="UnitsConsumed", descending=True), repeat),
+        Benchmark("search_users",
+                  lambda i: query_page("Users", contains={"Name": "khan"}, sort_by="Name"), repeat),
+    ]
+    return benchmarks
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Lines describing changes against a baseline run; regressions are prefixed with "!"."""
+    lines, regressions = [], 0
+    for name, current in results["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        for metric in ("p50_ms", "p95_ms", "peak_mem_mb"):
+            before, after = previous[metric], current[metric]
+            change = (after - before) / before if before else 0.0
+            regressed = change > threshold
+            regressions += regressed
+            lines.append(f"{'!' if regressed else ' '} {name:28s} {metric:12s} {before:10.3f} -> {after:10.3f} "
+                         f"({change:+.0%})")
+    return lines, regressions
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=REPO_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the billing hot paths on synthetic data.")
+    parser.add_argument("--users", type=int, default=2000, help="Synthetic flats / users (default: 2000)")
+    parser.add_argument("--months", type=int, default=12, help="Synthetic months of readings (default: 12)")
+    parser.add_argument("--seed", type=int, default=42, help="Synthetic data seed (default: 42)")
+    parser.add_argument("--repeat", type=int, default=50, help="Timed calls per fast benchmark (default: 50)")
+    parser.add_argument("--only", nargs="*", help="Run only these benchmarks")
+    parser.add_argument("--output", help="Write results JSON here (default: benchmark-<timestamp>.json)")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Relative change counted as a regression (default: {DEFAULT_THRESHOLD})")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output or f"benchmark-{datetime.now():%Y%m%d-%H%M%S}.json")
+
+    with tempfile.TemporaryDirectory(prefix="billing_bench_") as work_dir:
+        # insert_bill writes its PDF to the working directory
+        os.chdir(work_dir)
+        started = time.perf_counter()
+        summary = synthetic_data.generate(os.path.join(work_dir, "billing_system.db"),
+                                          users=args.users, months=args.months, seed=args.seed)
+        print(f"Generated {summary['readings']} readings / {summary['bills']} bills "
+              f"in {time.perf_counter() - started:.1f}s")
+
+        results = {
+            "meta": {
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "revision": _git_revision(),
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "platform": platform.platform(),
+                "dataset": summary,
+                "repeat": args.repeat,
+            },
+            "results": {},
+        }
+        for benchmark in build_benchmarks(summary, args.repeat):
+            if args.only and benchmark.name not in args.only:
+                continue
+            result = measure(benchmark)
+            results["results"][benchmark.name] = result
+            print(f"{benchmark.name:28s} {result['throughput_per_s']:>10.1f}/s  p50 {result['p50_ms']:>9.3f} ms  "
+                  f"p95 {result['p95_ms']:>9.3f} ms  peak {result['peak_mem_mb']:>8.2f} MB")
+        os.chdir(os.path.dirname(output))
+
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        lines, regressions = compare(results, baseline, args.threshold)
+        print("\n".join(lines))
+        if regressions:
+            print(f"{regressions} regression(s) above {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
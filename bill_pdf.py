@@ -0,0 +1,420 @@
+# Description: Bill PDF rendering from one shared template, serial or split across a process pool.
+import os
+import tempfile
+import zlib
+from array import array
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from datetime import datetime
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+
+# Bills per worker task; big enough to amortise process start-up and pickling
+MIN_CHUNK_SIZE = 50
+
+# Bills rendered per PDF part when streaming a month from the database
+STREAM_BATCH_SIZE = 500
+
+# Bulk exports stay in memory up to this size, then spill to a temp file on disk
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+
+def default_workers():
+    """Worker count from BILLING_PDF_WORKERS, else one per CPU core."""
+    return int(os.environ.get("BILLING_PDF_WORKERS", os.cpu_count() or 1))
+
+
+# Shared bill layout: y positions are measured down from the top of the page.
+# Static text is drawn once per document into a form XObject.
+TEMPLATE_NAME = "BillTemplate"
+
+# (text, x, y, font, size, colour); x=None centres the text on the page
+TEMPLATE_TEXT = (
+    ("NED UNIVERSITY OF ENGINEERING & TECHNOLOGY", None, 50, "Helvetica-Bold", 14, colors.black),
+    ("DIRECTORATE OF WORKS & SERVICES", None, 70, "Helvetica-Bold", 14, colors.black),
+    ("ELECTRIC BILL FOR NED STAFF COLONY", None, 90, "Helvetica-Bold", 14, colors.black),
+    ("Billing Detail Residential Tariff (October 2024 - Onwards)", 50, 230, "Helvetica-Bold", 12, colors.blue),
+    ("Units Details", 50, 250, "Helvetica-Bold", 11, colors.black),
+    ("Charges Details (PKR)", 50, 380, "Helvetica-Bold", 11, colors.black),
+    ("Note: Meter Reading will be taken on 1st of every month.", 50, 550, "Helvetica-Oblique", 10, colors.black),
+    ("This is a computer-generated bill and does not require a signature.", 50, 570, "Helvetica-Oblique", 10, colors.black),
+)
+
+# (field, label, x, y, font, size); the value is filled per bill
+TEMPLATE_FIELDS = (
+    ("flat_no", "Flat No: ", 50, 120, "Helvetica", 11),
+    ("load_sanctioned", "Load Sanctioned (kW): ", 250, 120, "Helvetica", 11),
+    ("phase", "Phase: ", 250, 140, "Helvetica", 11),
+    ("person_id", "Pers No: ", 50, 140, "Helvetica", 11),
+    ("name", "Name: ", 50, 160, "Helvetica", 11),
+    ("billing_month", "Billing Month: ", 50, 200, "Helvetica", 11),
+    ("reading_date", "Reading Date: ", 250, 200, "Helvetica", 11),
+    ("variable_charges", "Variable Charges: ", 50, 400, "Helvetica", 11),
+    ("rate_per_unit", "Rate per Unit: ", 250, 400, "Helvetica", 11),
+    ("electric_duty", "Electric Duty: ", 50, 420, "Helvetica", 11),
+    ("fuel_charge", "Fuel Charge Adjustment: ", 50, 440, "Helvetica", 11),
+    ("gst", "GST: ", 50, 460, "Helvetica", 11),
+    ("surcharge", "Surcharge: ", 50, 480, "Helvetica", 11),
+    ("net_amount", "Net Amount: ", 50, 500, "Helvetica", 11),
+    ("payable_amount", "Payable Amount: ", 50, 520, "Helvetica", 11),
+    ("previous_reading", "Previous Reading: ", 50, 270, "Helvetica-Bold", 11),
+    ("present_reading", "Present Reading: ", 50, 290, "Helvetica-Bold", 11),
+    ("units_consumed", "Units Consumed: ", 50, 310, "Helvetica-Bold", 11),
+    ("units_adjusted", "Units Adjusted: ", 50, 330, "Helvetica-Bold", 11),
+    ("billing_units", "Billing Units: ", 50, 350, "Helvetica-Bold", 11),
+    ("generated_on", "Bill Generated on: ", 400, 590, "Helvetica-Oblique", 10),
+)
+
+# Fields each layout always fills; their labels go into that layout's template.
+# Any other TEMPLATE_FIELDS entry is drawn, label and value, only on bills that supply it.
+SINGLE_LAYOUT = (
+    "flat_no", "person_id", "name", "billing_month", "reading_date", "variable_charges", "electric_duty", "gst",
+    "surcharge", "net_amount", "payable_amount", "previous_reading", "present_reading", "units_consumed",
+    "units_adjusted", "billing_units", "generated_on",
+)
+BULK_LAYOUT = (
+    "flat_no", "name", "billing_month", "variable_charges", "rate_per_unit", "electric_duty", "fuel_charge", "gst",
+    "surcharge", "payable_amount", "previous_reading", "present_reading", "units_consumed", "units_adjusted",
+    "billing_units", "generated_on",
+)
+
+PAGE_WIDTH, PAGE_HEIGHT = letter
+
+# field -> (label, label x, value x, y, font, size); the value starts right after its label
+_FIELD_POSITIONS = {
+    field: (label, x, x + stringWidth(label, font, size), PAGE_HEIGHT - y, font, size)
+    for field, label, x, y, font, size in TEMPLATE_FIELDS
+}
+
+
+def new_bill_canvas(output, compress=True, layout=SINGLE_LAYOUT):
+    """Canvas for bills with the static template of layout registered once as a form XObject."""
+    pdf = canvas.Canvas(output, pagesize=letter, pageCompression=1 if compress else 0)
+
+    pdf.beginForm(TEMPLATE_NAME)
+    for text, x, y, font, size, colour in TEMPLATE_TEXT:
+        pdf.setFont(font, size)
+        pdf.setFillColor(colour)
+        if x is None:
+            pdf.drawCentredString(PAGE_WIDTH / 2, PAGE_HEIGHT - y, text)
+        else:
+            pdf.drawString(x, PAGE_HEIGHT - y, text)
+    pdf.setFillColor(colors.black)
+    for field in layout:
+        label, x, _, y, font, size = _FIELD_POSITIONS[field]
+        pdf.setFont(font, size)
+        pdf.drawString(x, y, label)
+    pdf.endForm()
+    return pdf
+
+
+def draw_bill_page(pdf, fields, layout=SINGLE_LAYOUT):
+    """
+    Stamp the template and fill in one bill's values on the current page.
+
+    Every layout field must be in fields. Other fields are printed with
+    their label when fields has a value for them, and left off otherwise.
+    """
+    pdf.doForm(TEMPLATE_NAME)
+    pdf.setFillColor(colors.black)
+    current_font = None
+    for field, (label, label_x, x, y, font, size) in _FIELD_POSITIONS.items():
+        in_layout = field in layout
+        value = fields[field] if in_layout else fields.get(field)
+        if not in_layout and value is None:
+            continue
+        if (font, size) != current_font:
+            pdf.setFont(font, size)
+            current_font = (font, size)
+        if not in_layout:
+            pdf.drawString(label_x, y, label)
+        pdf.drawString(x, y, "" if value is None else str(value))
+
+
+def bulk_bill_fields(bill, selected_month, generated_on):
+    """Template fields for one fetch_billing_data row."""
+    (flat_no, name, prev_read, pres_read, units, month, rate, var_charges, gst_id, gst, duty_id, duty,
+     surcharge, fuel_charge, payable, gst_amount, duty_amount) = bill
+    return {
+        "flat_no": flat_no,
+        "name": name,
+        "billing_month": selected_month,
+        "previous_reading": prev_read,
+        "present_reading": pres_read,
+        "units_consumed": units,
+        "units_adjusted": 0,
+        "billing_units": units,
+        "rate_per_unit": rate,
+        "variable_charges": var_charges,
+        "electric_duty": f"{round(duty_amount, 2)} ({duty}%)",
+        "gst": f"{round(gst_amount, 2)} ({gst}%)",
+        "surcharge": surcharge,
+        "fuel_charge": fuel_charge,
+        "payable_amount": payable,
+        "generated_on": generated_on,
+    }
+
+
+def generate_pdf(flat_no, person_id, name,billing_month, reading_date, 
+                 previous_reading, present_reading, units_consumed, electric_duty, 
+                 gst, surcharge, variable_charges, net_amount, payable_amount, compress=True,
+                 rate_per_unit=None, load_sanctioned=None, phase=None):
+    """One bill in the single layout; rate_per_unit, load_sanctioned and phase are printed when given."""
+
+    file_path = f"{flat_no}_ElectricBill_{billing_month}.pdf"
+    pdf = new_bill_canvas(file_path, compress)
+    draw_bill_page(pdf, {
+        "flat_no": flat_no,
+        "person_id": person_id,
+        "name": name,
+        "billing_month": billing_month,
+        "reading_date": reading_date,
+        "previous_reading": previous_reading,
+        "present_reading": present_reading,
+        "units_consumed": units_consumed,
+        "units_adjusted": 0,
+        "billing_units": units_consumed,
+        "variable_charges": variable_charges,
+        "electric_duty": electric_duty,
+        "gst": gst,
+        "surcharge": surcharge,
+        "net_amount": net_amount,
+        "payable_amount": payable_amount,
+        "generated_on": datetime.now().strftime('%d/%m/%Y'),
+        "rate_per_unit": rate_per_unit,
+        "load_sanctioned": load_sanctioned,
+        "phase": phase,
+    })
+    pdf.save()
+    return file_path
+
+
+def render_bills(billing_data, selected_month, output, compress=True):
+    """Render bills one page each onto a single canvas written to output (path or file object)."""
+    pdf = new_bill_canvas(output, compress, BULK_LAYOUT)
+    generated_on = datetime.now().strftime('%d/%m/%Y')
+
+    for idx, bill in enumerate(billing_data):
+        draw_bill_page(pdf, bulk_bill_fields(bill, selected_month, generated_on), BULK_LAYOUT)
+
+        # Page Break
+        if idx < len(billing_data) - 1:
+            pdf.showPage()
+
+    pdf.save()
+    return output
+
+
+def _render_chunk(task):
+    """Process-pool task: render one chunk of bills to its own PDF part on disk."""
+    chunk, selected_month, part_path, compress = task
+    render_bills(chunk, selected_month, part_path, compress)
+    return part_path
+
+
+# A part's stream with its references translated: dictionary without /Filter,
+# /DecodeParms or /Length, the decoded data, and whether to Flate-encode it
+_Stream = namedtuple("_Stream", ["dictionary", "data", "compress"])
+
+
+class PdfConcatenator:
+    """
+    Appends the pages of finished PDF parts to one output file, part by part.
+
+    Objects are copied straight to the output as each part is read, so only
+    the current part and one file offset per object are held in memory;
+    peak memory does not grow with the number of pages written.
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self._offsets = array("q", [0])
+        self._page_numbers = array("q")
+        self.output.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self._pages_number = self._reserve()
+
+    def _reserve(self):
+        self._offsets.append(0)
+        return len(self._offsets) - 1
+
+    def _write_object(self, number, obj):
+        from pypdf.generic import NameObject, NumberObject
+
+        self._offsets[number] = self.output.tell()
+        self.output.write(f"{number} 0 obj\n".encode())
+        if isinstance(obj, _Stream):
+            data = zlib.compress(obj.data) if obj.compress else obj.data
+            if obj.compress:
+                obj.dictionary[NameObject("/Filter")] = NameObject("/FlateDecode")
+            obj.dictionary[NameObject("/Length")] = NumberObject(len(data))
+            obj.dictionary.write_to_stream(self.output)
+            self.output.write(b"\nstream\n" + data + b"\nendstream")
+        else:
+            obj.write_to_stream(self.output)
+        self.output.write(b"\nendobj\n")
+
+    def _translate(self, obj, mapping, queue):
+        from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+        if isinstance(obj, IndirectObject):
+            if obj.idnum not in mapping:
+                mapping[obj.idnum] = self._reserve()
+                queue.append((mapping[obj.idnum], obj.get_object()))
+            return IndirectObject(mapping[obj.idnum], 0, None)
+        if isinstance(obj, StreamObject):
+            # Re-encoded from get_data() rather than copying pypdf's private raw buffer
+            dictionary = DictionaryObject()
+            for key, value in obj.items():
+                if key not in ("/Filter", "/DecodeParms", "/Length"):
+                    dictionary[key] = self._translate(value, mapping, queue)
+            return _Stream(dictionary, obj.get_data(), "/Filter" in obj)
+        if isinstance(obj, DictionaryObject):
+            copy = DictionaryObject()
+            for key, value in obj.items():
+                copy[key] = self._translate(value, mapping, queue)
+            return copy
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self._translate(value, mapping, queue) for value in obj)
+        return obj
+
+    def append(self, part):
+        """Copy every page of a PDF part (path or file object) to the output."""
+        from pypdf import PdfReader
+        from pypdf.generic import DictionaryObject, IndirectObject, NameObject
+
+        reader = PdfReader(part)
+        mapping = {}
+        queue = deque()
+        for page in reader.pages:
+            number = self._reserve()
+            self._page_numbers.append(number)
+            page_dict = DictionaryObject({key: value for key, value in page.items() if key != "/Parent"})
+            page_copy = self._translate(page_dict, mapping, queue)
+            page_copy[NameObject("/Parent")] = IndirectObject(self._pages_number, 0, None)
+            self._write_object(number, page_copy)
+            # Fonts, forms and content streams of this page; shared ones are written once per part.
+            # Each is translated too, so its own references point at the output's numbers.
+            while queue:
+                queued_number, obj = queue.popleft()
+                self._write_object(queued_number, self._translate(obj, mapping, queue))
+
+    def close(self):
+        """Write the page tree, cross-reference table and trailer."""
+        write = self.output.write
+
+        self._offsets[self._pages_number] = self.output.tell()
+        write(f"{self._pages_number} 0 obj\n<< /Type /Pages /Count {len(self._page_numbers)} /Kids [".encode())
+        for start in range(0, len(self._page_numbers), 1000):
+            write(" ".join(f"{n} 0 R" for n in self._page_numbers[start:start + 1000]).encode() + b" ")
+        write(b"] >>\nendobj\n")
+
+        catalog_number = self._reserve()
+        self._offsets[catalog_number] = self.output.tell()
+        write(f"{catalog_number} 0 obj\n<< /Type /Catalog /Pages {self._pages_number} 0 R >>\nendobj\n".encode())
+
+        xref_offset = self.output.tell()
+        write(f"xref\n0 {len(self._offsets)}\n0000000000 65535 f \n".encode())
+        for start in range(1, len(self._offsets), 1000):
+            write("".join(f"{offset:010d} 00000 n \n" for offset in self._offsets[start:start + 1000]).encode())
+        write(f"trailer\n<< /Size {len(self._offsets)} /Root {catalog_number} 0 R >>\n"
+              f"startxref\n{xref_offset}\n%%EOF\n".encode())
+
+
+def write_bulk_bills(batches, selected_month, output, workers=1, compress=True):
+    """
+    Render batches of bills to PDF parts on disk and join them into output in order.
+
+    Args:
+        batches (iterable): Lists of billing rows; consumed lazily.
+        selected_month (str): Billing month printed on every page.
+        output (file object): Binary file the joined PDF is written to.
+        workers (int): Processes rendering parts in parallel (1 renders inline).
+        compress (bool): Compress page content streams.
+
+    Returns:
+        int: Number of pages written.
+    """
+    concatenator = PdfConcatenator(output)
+    pages = 0
+
+    with tempfile.TemporaryDirectory(prefix="bulk_bills_") as part_dir:
+        tasks = ((list(batch), selected_month, os.path.join(part_dir, f"part_{n:05d}.pdf"), compress)
+                 for n, batch in enumerate(batches))
+
+        def collect(part_path, count):
+            concatenator.append(part_path)
+            os.remove(part_path)
+            return count
+
+        if workers <= 1:
+            for task in tasks:
+                if task[0]:
+                    pages += collect(_render_chunk(task), len(task[0]))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                # Keep a bounded number of parts in flight so rows are not all read up front
+                in_flight = deque()
+                for task in tasks:
+                    if not task[0]:
+                        continue
+                    in_flight.append((pool.submit(_render_chunk, task), len(task[0])))
+                    if len(in_flight) >= workers * 2:
+                        future, count = in_flight.popleft()
+                        pages += collect(future.result(), count)
+                while in_flight:
+                    future, count = in_flight.popleft()
+                    pages += collect(future.result(), count)
+
+    concatenator.close()
+    return pages
+
+
+def render_bills_parallel(billing_data, selected_month, output, workers=None, compress=True):
+    """
+    Render bills across a process pool and join the parts in flat order.
+
+    Each worker renders a contiguous chunk of billing_data to a temporary
+    PDF part; the parts are then concatenated so the result matches
+    render_bills() page for page.
+    """
+    workers = workers or default_workers()
+    chunk_size = max(MIN_CHUNK_SIZE, -(-len(billing_data) // (workers * 4)))
+    chunks = (billing_data[i:i + chunk_size] for i in range(0, len(billing_data), chunk_size))
+    write_bulk_bills(chunks, selected_month, output, workers, compress)
+    return output
+
+
+def export_bulk_bills(batches, selected_month, workers=None, compress=True):
+    """
+    Streaming bulk export: render batches straight into a spooled temp file.
+
+    Pass the month as batches read from the cursor (see iter_billing_data);
+    only one batch of rows and one PDF part are in memory at a time.
+
+    Returns:
+        tuple: (SpooledTemporaryFile with the joined PDF rewound to the start, page count).
+    """
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, mode="w+b")
+    pages = write_bulk_bills(batches, selected_month, output, workers or default_workers(), compress)
+    output.seek(0)
+    return output, pages
+
+
+def Generate_bulk_bill_pdf(billing_data, selected_month, workers=None, compress=True):
+    """Generate a multi-page PDF with bills for all flats in a selected month."""
+    billing_data = list(billing_data)
+    workers = workers or default_workers()
+    buffer = BytesIO()
+
+    if workers > 1 and len(billing_data) > MIN_CHUNK_SIZE:
+        render_bills_parallel(billing_data, selected_month, buffer, workers, compress)
+    else:
+        render_bills(billing_data, selected_month, buffer, compress)
+
+    buffer.seek(0)
+    return buffer
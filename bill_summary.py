@@ -0,0 +1,94 @@
+# Description: Rebuild and consistency check for the MonthlyBillSummary table.
+#
+#   python bill_summary.py --check                # report rows that drifted from the bill tables
+#   python bill_summary.py --rebuild --month 2025-03
+#
+# The table is kept current by the migration v4 triggers; this is for repairs
+# after manual edits and for verifying the triggers against the source joins.
+import argparse
+import sys
+from collections import namedtuple
+
+from db import get_connection, set_db_path, transaction
+from migrations import MONTHLY_BILL_SUMMARY_SELECT, migrate
+
+SummaryDrift = namedtuple("SummaryDrift", [
+    "missing",   # ReadingIDs billed in the source tables but absent from the summary
+    "stale",     # ReadingIDs whose summary row differs from the source
+    "orphaned",  # ReadingIDs in the summary with no billed source row
+])
+
+
+def _month_filter(column, billing_month):
+    return (f" WHERE {column} = ?", (billing_month,)) if billing_month else ("", ())
+
+
+def rebuild(billing_month=None, conn=None):
+    """
+    Re-derive the summary rows of one month (or every month) in one transaction.
+
+    Returns:
+        int: Rows written.
+    """
+    if conn is None:
+        conn = get_connection()
+    where, params = _month_filter("BillingMonth", billing_month)
+    source_where, _ = _month_filter("br.BillingMonth", billing_month)
+    with transaction(conn):
+        conn.execute(f"DELETE FROM MonthlyBillSummary{where}", params)
+        rows = conn.execute(f"INSERT INTO MonthlyBillSummary {MONTHLY_BILL_SUMMARY_SELECT}{source_where}",
+                            params).rowcount
+    return rows
+
+
+def check(billing_month=None, conn=None):
+    """Compare the summary with the source joins; returns a SummaryDrift of sorted ReadingIDs."""
+    if conn is None:
+        conn = get_connection()
+    where, params = _month_filter("BillingMonth", billing_month)
+    source_where, _ = _month_filter("br.BillingMonth", billing_month)
+    source_query = f"{MONTHLY_BILL_SUMMARY_SELECT}{source_where}"
+    summary_query = f"SELECT * FROM MonthlyBillSummary{where}"
+
+    source_ids = {row[0] for row in conn.execute(f"SELECT ReadingID FROM ({source_query})", params)}
+    summary_ids = {row[0] for row in conn.execute(f"SELECT ReadingID FROM MonthlyBillSummary{where}", params)}
+    # Rows on either side without an identical twin on the other
+    differing = {row[0] for row in conn.execute(
+        f"SELECT ReadingID FROM ({source_query} EXCEPT {summary_query})"
+        f" UNION SELECT ReadingID FROM ({summary_query} EXCEPT {source_query})", params * 4)}
+    return SummaryDrift(
+        missing=sorted(source_ids - summary_ids),
+        stale=sorted(differing & source_ids & summary_ids),
+        orphaned=sorted(summary_ids - source_ids),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check or rebuild the MonthlyBillSummary table.")
+    parser.add_argument("--db", help="Database file (default: BILLING_DB_PATH or billing_system.db)")
+    parser.add_argument("--month", help="Only this billing month, YYYY-MM (default: every month)")
+    parser.add_argument("--rebuild", action="store_true", help="Re-derive the rows instead of only checking them")
+    parser.add_argument("--check", action="store_true", help="Report drift (the default without --rebuild)")
+    args = parser.parse_args()
+
+    if args.db:
+        set_db_path(args.db)
+    migrate()
+    scope = args.month or "all months"
+
+    if args.rebuild:
+        print(f"Rebuilt {rebuild(args.month)} summary rows ({scope})")
+    drift = check(args.month)
+    for field in SummaryDrift._fields:
+        ids = getattr(drift, field)
+        if ids:
+            print(f"{field}: {len(ids)} (ReadingIDs {', '.join(map(str, ids[:20]))}{' ...' if len(ids) > 20 else ''})")
+    if any(drift):
+        print(f"MonthlyBillSummary drifted from the bill tables ({scope}); run with --rebuild to repair")
+        return 1
+    print(f"MonthlyBillSummary is consistent ({scope})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,306 @@
+# Description: Vectorized month-close billing engine.
+# Prices every reading of a billing month in one pass and writes the charge
+# rows with executemany inside a single transaction.
+import json
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from db import bump_table_version, get_connection, transaction
+from tariffs import tariff_slabs
+
+# Readings priced and committed per transaction by close_month_in_batches()
+CLOSE_BATCH_SIZE = 1000
+
+# One row per billed reading of a month, in bill (flat) order; feeds the bulk PDF and CSV.
+# MonthlyBillSummary is maintained by triggers (migration v4), so this is one index range scan.
+BILLING_DATA_QUERY = """
+        SELECT FlatNo, Name, PreviousReading, PresentReading,
+               UnitsConsumed, BillingMonth, RatePerUnit,
+               VariableCharges, GSTID, GST, ElectricDutyID, ElectricDuty,
+               TotalSurcharge, FuelChargeAdjustment, NetPayableAmount,
+               GSTAmount, ElectricDutyAmount
+        FROM MonthlyBillSummary
+        WHERE BillingMonth = ?
+        ORDER BY FlatNo
+"""
+
+
+def get_date(billing_month: str) -> str:
+    """
+    Returns the 1st day of the next month after the given billing month.
+
+    Args:
+        billing_month (str): A string in "YYYY-MM" format (e.g., "2024-03").
+
+    Returns:
+        str: The date as "YYYY-MM-DD" format (e.g., "2024-04-01").
+    """
+    try:
+        # Convert "YYYY-MM" to a datetime object
+        month_dt = datetime.strptime(billing_month, "%Y-%m")
+
+        # Move to the first day of the next month
+        next_month_dt = (month_dt.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+        return next_month_dt.strftime("%Y-%m-%d")
+
+    except ValueError:
+        return "Invalid billing month format!"
+
+
+def compute_charges(units, rate_per_unit, gst_rate, electric_duty, monthly_surcharge, adjusted_surcharge,
+                    variable_charges=None):
+    """
+    Bill arithmetic shared by insert_bill, update_bill and the batch engine.
+
+    Every argument may be a scalar or a NumPy array; the maths is element-wise.
+    Pass variable_charges from tariff_slabs.price() / prices() for progressive
+    schedules; without it the units are charged at rate_per_unit.
+
+    Returns:
+        dict: variable charges, GST/duty amounts, surcharge split and net payable amount.
+    """
+    if variable_charges is None:
+        variable_charges = units * rate_per_unit
+
+    # GST & Electric Duty on the variable charges
+    gst_amount = (variable_charges * gst_rate) / 100
+    electric_duty_amount = (variable_charges * electric_duty) / 100
+
+    # GST & Electric Duty on the surcharges
+    computed_surcharge = monthly_surcharge + adjusted_surcharge
+    gst_on_surcharge = (computed_surcharge * gst_rate) / 100
+    electric_duty_on_surcharge = (computed_surcharge * electric_duty) / 100
+    final_total_surcharge = computed_surcharge + gst_on_surcharge + electric_duty_on_surcharge
+
+    total_additional_charges = gst_amount + electric_duty_amount
+    net_payable_amount = variable_charges + final_total_surcharge + total_additional_charges
+
+    return {
+        "VariableCharges": variable_charges,
+        "GST": gst_amount,
+        "ElectricDuty": electric_duty_amount,
+        "ComputedSurcharge": computed_surcharge,
+        "GSTOnSurcharge": gst_on_surcharge,
+        "ElectricDutyOnSurcharge": electric_duty_on_surcharge,
+        "TotalSurcharge": final_total_surcharge,
+        "TotalAdditionalCharges": total_additional_charges,
+        "NetPayableAmount": net_payable_amount,
+    }
+
+
+def load_month_readings(conn, billing_month, include_billed=False):
+    """Load every reading of a month with its user category and surcharge totals."""
+    query = """
+        SELECT br.ReadingID, br.FlatNo, u.PersonID, u.Name, u.UserCategory,
+               br.PreviousReading, br.PresentReading,
+               ac.AdditionalChargeID, sgd.SurchargeGSTDutyID,
+               COALESCE(rsm.MonthSurcharge, 0) AS MonthSurcharge,
+               COALESCE(rsm.AdjustedSurcharge, 0) AS AdjustedSurcharge
+        FROM BillingReadings br
+        LEFT JOIN Users u
+               ON u.PersonID = COALESCE(br.PersonID, (SELECT PersonID FROM Users WHERE FlatNo = br.FlatNo LIMIT 1))
+        LEFT JOIN AdditionalCharges ac ON ac.ReadingID = br.ReadingID
+        LEFT JOIN SurchargeGSTDuty sgd ON sgd.ReadingID = br.ReadingID
+        LEFT JOIN (
+            SELECT ReadingID,
+                   TOTAL(CASE WHEN AdjustedBillingMonth = BillingMonth THEN SurchargeAmount END) AS MonthSurcharge,
+                   TOTAL(CASE WHEN AdjustedBillingMonth <> BillingMonth THEN SurchargeAmount END) AS AdjustedSurcharge
+            FROM ReadingSurchargeMapping
+            WHERE BillingMonth = ?
+            GROUP BY ReadingID
+        ) rsm ON rsm.ReadingID = br.ReadingID
+        WHERE br.BillingMonth = ?
+    """
+    if not include_billed:
+        query += " AND NOT EXISTS (SELECT 1 FROM BillingCharges bc WHERE bc.ReadingID = br.ReadingID)"
+    query += " ORDER BY br.ReadingID"
+
+    return pd.read_sql_query(query, conn, params=(billing_month, billing_month))
+
+
+def _effective_rate(cursor, table, id_column, value_column, reading_date, value=None):
+    if value is not None:
+        cursor.execute(f"SELECT {id_column} FROM {table} WHERE {value_column} = ?", (value,))
+        row = cursor.fetchone()
+        return (row[0] if row else None), float(value)
+
+    cursor.execute(f"""
+        SELECT {id_column}, {value_column} FROM {table}
+        WHERE EffectiveDate <= ?
+        ORDER BY EffectiveDate DESC LIMIT 1
+    """, (reading_date,))
+    row = cursor.fetchone()
+    if row is None:
+        cursor.execute(f"SELECT {id_column}, {value_column} FROM {table} ORDER BY EffectiveDate DESC LIMIT 1")
+        row = cursor.fetchone()
+    return (row[0], float(row[1])) if row else (None, 0.0)
+
+
+def price_readings(conn, readings, billing_month, gst_rate=None, electric_duty=None):
+    """Price a frame of readings; returns it with every charge column filled in."""
+    cursor = conn.cursor()
+    reading_date = get_date(billing_month)
+    gst_id, gst_rate = _effective_rate(cursor, "GSTRates", "GSTID", "GST", reading_date, gst_rate)
+    duty_id, electric_duty = _effective_rate(cursor, "ElectricDutyRates", "DutyID", "ElectricDuty",
+                                             reading_date, electric_duty)
+
+    bills = readings.copy()
+    previous = bills["PreviousReading"].to_numpy(dtype=float)
+    present = bills["PresentReading"].to_numpy(dtype=float)
+    units = np.abs(present - previous)
+
+    variable_charges, rates = tariff_slabs.prices(units, bills["UserCategory"].to_numpy(), as_of=reading_date,
+                                                  conn=conn)
+
+    charges = compute_charges(
+        units, rates, gst_rate, electric_duty,
+        bills["MonthSurcharge"].to_numpy(dtype=float),
+        bills["AdjustedSurcharge"].to_numpy(dtype=float),
+        variable_charges,
+    )
+    bills["UnitsConsumed"] = units
+    bills["RatePerUnit"] = rates
+    bills["GSTID"] = gst_id
+    bills["ElectricDutyID"] = duty_id
+    bills["GSTRate"] = gst_rate
+    bills["ElectricDutyRate"] = electric_duty
+    for column, values in charges.items():
+        bills[column] = values
+    return bills
+
+
+def _assign_ids(cursor, bills, column, table):
+    """Fill missing surrogate keys with a contiguous block after the current maximum."""
+    ids = [None if pd.isna(value) else int(value) for value in bills[column]]
+    missing = np.array([value is None for value in ids], dtype=bool)
+    cursor.execute(f"SELECT COALESCE(MAX({column}), 0) FROM {table}")
+    next_id = cursor.fetchone()[0] + 1
+    for position in np.flatnonzero(missing):
+        ids[position] = next_id
+        next_id += 1
+    bills[column] = pd.Series(ids, index=bills.index, dtype=object)
+    return missing
+
+
+def write_bills(conn, bills):
+    """
+    Insert AdditionalCharges, SurchargeGSTDuty and BillingCharges for priced bills in one transaction.
+
+    The readings are checked again under the write lock: one billed since
+    the bills were loaded (insert_bill from the UI or the API) is dropped and
+    left as it is, and the charge row IDs are re-read.
+
+    Returns:
+        DataFrame: The bills written, with their AdditionalChargeID / SurchargeGSTDutyID filled in.
+    """
+    if bills.empty:
+        return bills
+
+    with transaction(conn):
+        cursor = conn.cursor()
+        current = cursor.execute("""
+            SELECT r.value, ac.AdditionalChargeID, sgd.SurchargeGSTDutyID,
+                   EXISTS (SELECT 1 FROM BillingCharges bc WHERE bc.ReadingID = r.value)
+            FROM json_each(?) r
+            LEFT JOIN AdditionalCharges ac ON ac.ReadingID = r.value
+            LEFT JOIN SurchargeGSTDuty sgd ON sgd.ReadingID = r.value
+        """, (json.dumps([int(reading_id) for reading_id in bills["ReadingID"]]),)).fetchall()
+        billed = {reading_id for reading_id, _, _, is_billed in current if is_billed}
+        bills = bills[~bills["ReadingID"].isin(billed)].copy()
+        bills["AdditionalChargeID"] = bills["ReadingID"].map({row[0]: row[1] for row in current})
+        bills["SurchargeGSTDutyID"] = bills["ReadingID"].map({row[0]: row[2] for row in current})
+
+        new_additional = _assign_ids(cursor, bills, "AdditionalChargeID", "AdditionalCharges")
+        new_surcharge = _assign_ids(cursor, bills, "SurchargeGSTDutyID", "SurchargeGSTDuty")
+
+        additional = bills[new_additional]
+        cursor.executemany("""
+            INSERT INTO AdditionalCharges (AdditionalChargeID, ReadingID, GSTID, ElectricDutyID, GST, ElectricDuty)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, zip(additional["AdditionalChargeID"].tolist(), additional["ReadingID"].tolist(),
+                 additional["GSTID"].tolist(), additional["ElectricDutyID"].tolist(),
+                 additional["GST"].tolist(), additional["ElectricDuty"].tolist()))
+
+        surcharge = bills[new_surcharge]
+        cursor.executemany("""
+            INSERT INTO SurchargeGSTDuty (SurchargeGSTDutyID, ReadingID, MonthSurcharge, AdjustedSurcharge,
+                                          TotalSurcharge, GSTID, ElectricDutyID, GSTAmount, ElectricDutyAmount)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, zip(surcharge["SurchargeGSTDutyID"].tolist(), surcharge["ReadingID"].tolist(),
+                 surcharge["MonthSurcharge"].tolist(), surcharge["AdjustedSurcharge"].tolist(),
+                 surcharge["ComputedSurcharge"].tolist(), surcharge["GSTID"].tolist(),
+                 surcharge["ElectricDutyID"].tolist(), surcharge["GSTOnSurcharge"].tolist(),
+                 surcharge["ElectricDutyOnSurcharge"].tolist()))
+
+        cursor.executemany("""
+            INSERT INTO BillingCharges (ReadingID, RatePerUnit, VariableCharges, AdditionalChargeID, SurchargeGSTDutyID,
+                                        TotalAdditionalCharges, TotalSurcharge, NetPayableAmount, Status, Remarks)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'Due', 'No remarks')
+        """, zip(bills["ReadingID"].tolist(), bills["RatePerUnit"].tolist(), bills["VariableCharges"].tolist(),
+                 bills["AdditionalChargeID"].tolist(), bills["SurchargeGSTDutyID"].tolist(),
+                 bills["TotalAdditionalCharges"].tolist(), bills["TotalSurcharge"].tolist(),
+                 bills["NetPayableAmount"].tolist()))
+    bump_table_version("AdditionalCharges", "SurchargeGSTDuty", "BillingCharges")
+    return bills
+
+
+def close_month(billing_month, gst_rate=None, electric_duty=None, dry_run=False, conn=None):
+    """
+    Price and bill every unbilled reading of a month at once.
+
+    Args:
+        billing_month (str): Month in "YYYY-MM" format.
+        gst_rate (float, optional): GST % to apply; defaults to the rate effective for the month.
+        electric_duty (float, optional): Electric duty % to apply; defaults to the effective rate.
+        dry_run (bool): Price the month without writing anything.
+
+    Returns:
+        DataFrame: One priced row per bill.
+    """
+    if conn is None:
+        conn = get_connection()
+    readings = load_month_readings(conn, billing_month)
+    bills = price_readings(conn, readings, billing_month, gst_rate, electric_duty)
+    if not dry_run:
+        bills = write_bills(conn, bills)
+    return bills
+
+
+def close_month_in_batches(billing_month, batch_size=CLOSE_BATCH_SIZE, gst_rate=None, electric_duty=None, conn=None):
+    """
+    Like close_month(), but commits every batch_size readings in its own transaction.
+
+    Already-billed readings are never loaded, so calling this again after a
+    crash picks up exactly where the last committed batch left off.
+
+    Yields:
+        DataFrame: The bills of each batch, after it has been committed.
+    """
+    if conn is None:
+        conn = get_connection()
+    readings = load_month_readings(conn, billing_month)
+    for start in range(0, len(readings), batch_size):
+        batch = readings.iloc[start:start + batch_size]
+        yield write_bills(conn, price_readings(conn, batch, billing_month, gst_rate, electric_duty))
+
+
+def fetch_billing_data(selected_month, conn=None):
+    """All billing rows of a month (see BILLING_DATA_QUERY)."""
+    if conn is None:
+        conn = get_connection()
+    return conn.execute(BILLING_DATA_QUERY, (selected_month,)).fetchall()
+
+
+def iter_billing_data(selected_month, batch_size, conn=None):
+    """Yield the month's billing rows in lists of at most batch_size, straight off the cursor."""
+    if conn is None:
+        conn = get_connection()
+    cursor = conn.execute(BILLING_DATA_QUERY, (selected_month,))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
@@ -0,0 +1,260 @@
+# Description: Shared SQLite connection manager for the billing system.
+import os
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+
+import sql_trace
+
+DEFAULT_DB_PATH = "billing_system.db"
+
+# Seconds a writer waits on a locked database before raising "database is locked"
+BUSY_TIMEOUT = 30
+
+# Idle connections kept around for the next thread / Streamlit rerun
+MAX_IDLE_CONNECTIONS = 8
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT * 1000}",
+    "PRAGMA cache_size=-65536",      # 64 MiB page cache
+    "PRAGMA mmap_size=268435456",    # 256 MiB memory-mapped I/O
+    "PRAGMA temp_store=MEMORY",
+)
+
+_db_path = os.environ.get("BILLING_DB_PATH", DEFAULT_DB_PATH)
+_local = threading.local()
+_idle = []
+_idle_lock = threading.Lock()
+
+# In-process write counters, bumped by the helpers that modify a table
+_table_versions = {}
+
+# Commits from other connections or processes, as seen through any pooled connection
+_external_lock = threading.Lock()
+_external_generation = 0
+_seen_data_versions = {}
+
+# (id(conn), table) -> (data_version, table_version, signature), for table_signature()
+_signatures = {}
+_signatures_lock = threading.Lock()
+
+# Called after set_db_path() switches files
+_path_listeners = []
+
+
+class _Lease:
+    """Ties a pooled connection to the thread that checked it out.
+
+    The lease lives in thread-local storage, so when the thread finishes
+    (e.g. a Streamlit script run ends) the lease is collected and the
+    connection goes back to the idle pool instead of being closed.
+    """
+
+    def __init__(self, conn, path):
+        self.conn = conn
+        self.path = path
+        weakref.finalize(self, _release, conn, path)
+
+
+def _release(conn, path):
+    if conn.in_transaction:
+        conn.rollback()
+    with _idle_lock:
+        if path == _db_path and len(_idle) < MAX_IDLE_CONNECTIONS:
+            _idle.append(conn)
+            return
+    conn.close()
+
+
+def _connect(path):
+    # BILLING_SQL_TRACE swaps in the recording connection class; off, it is a plain connection
+    factory = sql_trace.TracedConnection if sql_trace.ENABLED else sqlite3.Connection
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False, factory=factory)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_db_path():
+    return _db_path
+
+
+def set_db_path(path):
+    """Point every subsequent get_connection() call at another database file."""
+    global _db_path
+    with _idle_lock:
+        _db_path = path
+        stale = list(_idle)
+        _idle.clear()
+    for conn in stale:
+        conn.close()
+    with _signatures_lock:
+        _signatures.clear()
+    for callback in _path_listeners:
+        callback()
+
+
+def on_db_path_change(callback):
+    """Register callback() to run whenever set_db_path() is called, e.g. to drop caches of the old file."""
+    _path_listeners.append(callback)
+
+
+def get_connection():
+    """Return this thread's long-lived connection, reusing an idle one if possible."""
+    lease = getattr(_local, "lease", None)
+    if lease is not None and lease.path == _db_path:
+        return lease.conn
+
+    conn = None
+    with _idle_lock:
+        if _idle:
+            conn = _idle.pop()
+    if conn is None:
+        conn = _connect(_db_path)
+    _local.lease = _Lease(conn, _db_path)
+    return conn
+
+
+def table_version(table):
+    return _table_versions.get(table, 0)
+
+
+def bump_table_version(*tables):
+    """Record that this process just committed a change to the given tables."""
+    for table in tables:
+        _table_versions[table] = _table_versions.get(table, 0) + 1
+
+
+def data_version(conn):
+    """SQLite's counter of commits made to the file by *other* connections."""
+    return conn.execute("PRAGMA data_version").fetchone()[0]
+
+
+def external_generation(conn=None):
+    """
+    Process-wide counter that moves whenever a connection sees another connection's commit.
+
+    Unlike data_version() it can be compared across threads, so shared caches
+    can key on it to pick up writes from month_close, api_server,
+    reading_ingest or other sessions. A connection seen for the first time
+    also moves it, since it may already have missed a commit.
+    """
+    global _external_generation
+    if conn is None:
+        conn = get_connection()
+    version = data_version(conn)
+    with _external_lock:
+        if _seen_data_versions.get(id(conn)) != version:
+            _seen_data_versions[id(conn)] = version
+            _external_generation += 1
+        return _external_generation
+
+
+def signature_sql(table, columns):
+    """
+    SELECT returning a fingerprint of a table's rows.
+
+    COUNT(*) and MAX(rowid), plus rowid-weighted totals of each column's
+    length, first character and numeric value: an insert, delete or edit, or
+    two rows swapping their values, changes it.
+    """
+    terms = ["COUNT(*)", "MAX(rowid)"]
+    for column in columns:
+        terms += [f"TOTAL(length({column}) * rowid)", f"TOTAL(unicode({column}) * rowid)",
+                  f"TOTAL(CAST({column} AS REAL) * rowid)"]
+    return f"SELECT {', '.join(terms)} FROM {table}"
+
+
+def table_signature(table, conn=None):
+    """
+    (table_version(table), signature_sql over all of its columns), comparable across threads.
+
+    The fingerprint is only re-queried on a connection after another
+    connection committed (PRAGMA data_version) or this process wrote to the
+    table, and it only changes when the table's rows did, so shared caches
+    keyed on it survive commits to other tables.
+    """
+    if conn is None:
+        conn = get_connection()
+    local_version = table_version(table)
+    version = data_version(conn)
+    with _signatures_lock:
+        memo = _signatures.get((id(conn), table))
+    if memo is not None and memo[:2] == (version, local_version):
+        return local_version, memo[2]
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    signature = conn.execute(signature_sql(table, columns)).fetchone()
+    with _signatures_lock:
+        _signatures[id(conn), table] = (version, local_version, signature)
+    return local_version, signature
+
+
+class TableIndex:
+    """
+    Base for in-memory indexes built from one table.
+
+    refresh() is cheap to call before every lookup: it only queries the table
+    signature after another connection committed (PRAGMA data_version) or
+    this process wrote to the table (bump_table_version), and reloads when
+    the signature changed or the write came from this process.
+    """
+
+    table = None
+    signature_query = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signature = None
+        self._loaded_version = None
+        self._seen = None
+
+    def refresh(self, conn=None):
+        if conn is None:
+            conn = get_connection()
+        local_version = table_version(self.table)
+        seen = (id(conn), data_version(conn), local_version)
+        if seen == self._seen:
+            return
+        with self._lock:
+            signature = conn.execute(self.signature_query).fetchone()
+            if signature != self._signature or local_version != self._loaded_version:
+                self._load(conn)
+                self._signature = signature
+                self._loaded_version = local_version
+            self._seen = seen
+
+    def invalidate(self):
+        with self._lock:
+            self._signature = None
+            self._seen = None
+
+    def _load(self, conn):
+        raise NotImplementedError
+
+
+def close_connection():
+    """Drop this thread's lease; the connection returns to the idle pool."""
+    _local.lease = None
+
+
+@contextmanager
+def transaction(conn=None):
+    """Run a block inside BEGIN IMMEDIATE ... COMMIT on the shared connection.
+
+    The write lock is taken up front, so two clerks closing bills at the
+    same time queue on busy_timeout instead of failing halfway through.
+    """
+    if conn is None:
+        conn = get_connection()
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
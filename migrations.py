@@ -0,0 +1,505 @@
+# Description: Versioned schema migrations for billing_system.db.
+# Run `python migrations.py` (or call migrate()) to create a fresh database
+# or bring an existing one up to date.
+import argparse
+import sys
+
+from db import get_connection, set_db_path, transaction
+
+# One MonthlyBillSummary row per billed reading, computed from the bill tables; the v4
+# triggers append a WHERE clause to it. A migration that changes the summary defines a
+# new select rather than editing this one, and bill_summary.rebuild() moves to it.
+MONTHLY_BILL_SUMMARY_SELECT = """
+        SELECT br.ReadingID, bc.BillID, br.FlatNo, br.BillingMonth, br.PersonID, u.Name,
+               br.PreviousReading, br.PresentReading, br.UnitsConsumed, bc.RatePerUnit, bc.VariableCharges,
+               ac.GSTID, g.GST, bc.VariableCharges * g.GST / 100,
+               ac.ElectricDutyID, ed.ElectricDuty, bc.VariableCharges * ed.ElectricDuty / 100,
+               sgd.TotalSurcharge, sgd.FuelChargeAdjustment, bc.NetPayableAmount, bc.Status
+        FROM BillingReadings br
+        JOIN BillingCharges bc ON br.ReadingID = bc.ReadingID
+        JOIN AdditionalCharges ac ON bc.AdditionalChargeID = ac.AdditionalChargeID
+        JOIN GSTRates g ON ac.GSTID = g.GSTID
+        JOIN ElectricDutyRates ed ON ac.ElectricDutyID = ed.DutyID
+        JOIN SurchargeGSTDuty sgd ON bc.SurchargeGSTDutyID = sgd.SurchargeGSTDutyID
+        JOIN Users u ON u.PersonID = br.PersonID"""
+
+
+class MigrationError(Exception):
+    """A migration cannot be applied to the data as it stands; nothing was changed."""
+
+
+# (table, key columns, row id) for each unique index migration 2 creates
+UNIQUE_KEYS = (
+    ("BillingReadings", ("FlatNo", "BillingMonth"), "ReadingID"),
+    ("BillingCharges", ("ReadingID",), "BillID"),
+    ("AdditionalCharges", ("ReadingID",), "AdditionalChargeID"),
+    ("SurchargeGSTDuty", ("ReadingID",), "SurchargeGSTDutyID"),
+)
+
+
+def _check_unique_keys(conn):
+    """Raise MigrationError listing rows that would break migration 2's unique indexes."""
+    problems = []
+    for table, columns, row_id in UNIQUE_KEYS:
+        key = ", ".join(columns)
+        duplicates = conn.execute(f"""
+            SELECT {key}, GROUP_CONCAT({row_id}, ', ') FROM {table}
+            GROUP BY {key} HAVING COUNT(*) > 1
+        """).fetchall()
+        if duplicates:
+            examples = "; ".join(f"{'/'.join(map(str, row[:-1]))} ({row_id} {row[-1]})" for row in duplicates[:5])
+            problems.append(f"{table}: {len(duplicates)} duplicate ({key}) group(s), e.g. {examples}")
+    if problems:
+        raise MigrationError("Migration 2 adds unique indexes, but the database has duplicate rows. "
+                             "Delete or merge them, then run the migrations again.\n" + "\n".join(problems))
+
+
+# Checks run inside a migration's transaction before its statements
+PRECHECKS = {2: _check_unique_keys}
+
+
+def _refresh_summary(reading_ids):
+    """Trigger body re-deriving the summary rows of the readings matched by reading_ids (an SQL IN list)."""
+    return (f"DELETE FROM MonthlyBillSummary WHERE ReadingID IN ({reading_ids});\n"
+            f"            INSERT INTO MonthlyBillSummary {MONTHLY_BILL_SUMMARY_SELECT}\n"
+            f"        WHERE br.ReadingID IN ({reading_ids});")
+
+# (version, description, statements). Never edit an applied migration; append a new one.
+MIGRATIONS = [
+    (1, "Base schema", [
+        """CREATE TABLE IF NOT EXISTS Flats (
+            FlatNo TEXT PRIMARY KEY,
+            Block TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS Users (
+            PersonID TEXT PRIMARY KEY,
+            Name TEXT NOT NULL,
+            FlatNo TEXT REFERENCES Flats(FlatNo),
+            UserType TEXT,
+            UserCategory TEXT DEFAULT 'Residential',
+            LoadSanctioned REAL,
+            Phase TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS BillingReadings (
+            ReadingID INTEGER PRIMARY KEY AUTOINCREMENT,
+            FlatNo TEXT NOT NULL REFERENCES Flats(FlatNo),
+            PersonID TEXT REFERENCES Users(PersonID),
+            BillingMonth TEXT,
+            ReadingDate TEXT,
+            PreviousReading REAL DEFAULT 0,
+            PresentReading REAL NOT NULL,
+            UnitsConsumed REAL GENERATED ALWAYS AS (ABS(PresentReading - PreviousReading)) STORED,
+            UnitsAdjusted REAL DEFAULT 0
+        )""",
+        """CREATE TABLE IF NOT EXISTS GSTRates (
+            GSTID INTEGER PRIMARY KEY AUTOINCREMENT,
+            EffectiveDate TEXT NOT NULL UNIQUE,
+            GST REAL NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS ElectricDutyRates (
+            DutyID INTEGER PRIMARY KEY AUTOINCREMENT,
+            EffectiveDate TEXT NOT NULL UNIQUE,
+            ElectricDuty REAL NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS TariffSlabs (
+            SlabID INTEGER PRIMARY KEY AUTOINCREMENT,
+            UserCategory TEXT NOT NULL,
+            MinUnits REAL NOT NULL,
+            MaxUnits REAL,
+            RatePerUnit REAL NOT NULL,
+            RateEffectiveDate TEXT NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS SurchargeType (
+            SurchargeTypeID INTEGER PRIMARY KEY,
+            TypeName TEXT NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS Surcharge (
+            SurchargeID INTEGER PRIMARY KEY AUTOINCREMENT,
+            SurchargeTypeID INTEGER NOT NULL REFERENCES SurchargeType(SurchargeTypeID),
+            RatePerUnit REAL NOT NULL,
+            UnitsFrom REAL,
+            UnitsTo REAL,
+            EffectiveDate TEXT NOT NULL,
+            UNIQUE (SurchargeTypeID, EffectiveDate, UnitsFrom, UnitsTo)
+        )""",
+        """CREATE TABLE IF NOT EXISTS AdditionalCharges (
+            AdditionalChargeID INTEGER PRIMARY KEY AUTOINCREMENT,
+            ReadingID INTEGER NOT NULL REFERENCES BillingReadings(ReadingID),
+            GSTID INTEGER REFERENCES GSTRates(GSTID),
+            ElectricDutyID INTEGER REFERENCES ElectricDutyRates(DutyID),
+            GST REAL,
+            ElectricDuty REAL
+        )""",
+        """CREATE TABLE IF NOT EXISTS SurchargeGSTDuty (
+            SurchargeGSTDutyID INTEGER PRIMARY KEY AUTOINCREMENT,
+            ReadingID INTEGER NOT NULL REFERENCES BillingReadings(ReadingID),
+            MonthSurcharge REAL DEFAULT 0,
+            AdjustedSurcharge REAL DEFAULT 0,
+            TotalSurcharge REAL DEFAULT 0,
+            GSTID INTEGER REFERENCES GSTRates(GSTID),
+            ElectricDutyID INTEGER REFERENCES ElectricDutyRates(DutyID),
+            GSTAmount REAL DEFAULT 0,
+            ElectricDutyAmount REAL DEFAULT 0,
+            FuelChargeAdjustment REAL DEFAULT 0
+        )""",
+        """CREATE TABLE IF NOT EXISTS BillingCharges (
+            BillID INTEGER PRIMARY KEY AUTOINCREMENT,
+            ReadingID INTEGER NOT NULL REFERENCES BillingReadings(ReadingID),
+            RatePerUnit REAL,
+            VariableCharges REAL,
+            AdditionalChargeID INTEGER REFERENCES AdditionalCharges(AdditionalChargeID),
+            SurchargeGSTDutyID INTEGER REFERENCES SurchargeGSTDuty(SurchargeGSTDutyID),
+            TotalAdditionalCharges REAL,
+            TotalSurcharge REAL,
+            NetPayableAmount REAL,
+            Status TEXT DEFAULT 'Due',
+            Remarks TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS ReadingSurchargeMapping (
+            MappingID INTEGER PRIMARY KEY AUTOINCREMENT,
+            ReadingID INTEGER NOT NULL REFERENCES BillingReadings(ReadingID),
+            SurchargeID INTEGER NOT NULL REFERENCES Surcharge(SurchargeID),
+            BillingMonth TEXT NOT NULL,
+            AdjustedBillingMonth TEXT NOT NULL,
+            SurchargeAmount REAL DEFAULT 0,
+            AdjustmentReason TEXT,
+            UNIQUE (ReadingID, SurchargeID, BillingMonth, AdjustedBillingMonth)
+        )""",
+        """CREATE TABLE IF NOT EXISTS ConsumptionHistory (
+            ConsumptionID INTEGER PRIMARY KEY AUTOINCREMENT,
+            PersonID TEXT REFERENCES Users(PersonID),
+            FlatNo TEXT,
+            BillingMonth TEXT,
+            UnitsConsumed REAL,
+            RecordedAt TEXT DEFAULT CURRENT_TIMESTAMP
+        )""",
+        "INSERT OR IGNORE INTO SurchargeType (SurchargeTypeID, TypeName) VALUES "
+        "(1, 'Additional PHL'), (2, 'Uniform Quarterly'), (3, 'Fuel Charge')",
+    ]),
+    (2, "Indexes and unique constraints for the hot billing queries", [
+        # One reading per flat per month: fetch_complete_bill, previous-reading lookup
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_billingreadings_flat_month ON BillingReadings (FlatNo, BillingMonth)",
+        # fetch_billing_data and month close filter the whole month
+        "CREATE INDEX IF NOT EXISTS ix_billingreadings_month ON BillingReadings (BillingMonth, FlatNo)",
+        # One charge row of each kind per reading
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_billingcharges_reading ON BillingCharges (ReadingID)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_additionalcharges_reading ON AdditionalCharges (ReadingID)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_surchargegstduty_reading ON SurchargeGSTDuty (ReadingID)",
+        "CREATE INDEX IF NOT EXISTS ix_readingsurchargemapping_reading_month ON ReadingSurchargeMapping (ReadingID, BillingMonth)",
+        "CREATE INDEX IF NOT EXISTS ix_users_flat_person ON Users (FlatNo, PersonID)",
+        "CREATE INDEX IF NOT EXISTS ix_surcharge_type_date ON Surcharge (SurchargeTypeID, EffectiveDate)",
+        "CREATE INDEX IF NOT EXISTS ix_tariffslabs_category_date ON TariffSlabs (UserCategory, RateEffectiveDate)",
+        "CREATE INDEX IF NOT EXISTS ix_consumptionhistory_person ON ConsumptionHistory (PersonID, BillingMonth)",
+        "CREATE INDEX IF NOT EXISTS ix_consumptionhistory_flat ON ConsumptionHistory (FlatNo, BillingMonth)",
+    ]),
+    (3, "FTS5 search index for the report pages", [
+        # Users has no INTEGER PRIMARY KEY (its rowids can move on VACUUM), so it is keyed by PersonID
+        "CREATE VIRTUAL TABLE IF NOT EXISTS UsersFTS USING fts5(PersonID, Name, FlatNo, UserType, UserCategory)",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS BillingReadingsFTS USING fts5(FlatNo, PersonID, BillingMonth, ReadingDate)",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS BillingChargesFTS USING fts5(FlatNo, BillingMonth, Status, Remarks)",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS ConsumptionHistoryFTS USING fts5(PersonID, FlatNo, BillingMonth)",
+
+        """CREATE TRIGGER IF NOT EXISTS trg_users_fts_insert AFTER INSERT ON Users BEGIN
+            INSERT INTO UsersFTS (PersonID, Name, FlatNo, UserType, UserCategory)
+            VALUES (NEW.PersonID, NEW.Name, NEW.FlatNo, NEW.UserType, NEW.UserCategory);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_users_fts_update
+        AFTER UPDATE OF PersonID, Name, FlatNo, UserType, UserCategory ON Users BEGIN
+            DELETE FROM UsersFTS WHERE PersonID = OLD.PersonID;
+            INSERT INTO UsersFTS (PersonID, Name, FlatNo, UserType, UserCategory)
+            VALUES (NEW.PersonID, NEW.Name, NEW.FlatNo, NEW.UserType, NEW.UserCategory);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_users_fts_delete AFTER DELETE ON Users BEGIN
+            DELETE FROM UsersFTS WHERE PersonID = OLD.PersonID;
+        END""",
+
+        """CREATE TRIGGER IF NOT EXISTS trg_billingreadings_fts_insert AFTER INSERT ON BillingReadings BEGIN
+            INSERT INTO BillingReadingsFTS (rowid, FlatNo, PersonID, BillingMonth, ReadingDate)
+            VALUES (NEW.ReadingID, NEW.FlatNo, NEW.PersonID, NEW.BillingMonth, NEW.ReadingDate);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_billingreadings_fts_update
+        AFTER UPDATE OF ReadingID, FlatNo, PersonID, BillingMonth, ReadingDate ON BillingReadings BEGIN
+            DELETE FROM BillingReadingsFTS WHERE rowid = OLD.ReadingID;
+            INSERT INTO BillingReadingsFTS (rowid, FlatNo, PersonID, BillingMonth, ReadingDate)
+            VALUES (NEW.ReadingID, NEW.FlatNo, NEW.PersonID, NEW.BillingMonth, NEW.ReadingDate);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_billingreadings_fts_delete AFTER DELETE ON BillingReadings BEGIN
+            DELETE FROM BillingReadingsFTS WHERE rowid = OLD.ReadingID;
+        END""",
+        # Bills index their reading's FlatNo / BillingMonth, so re-index them when those change
+        """CREATE TRIGGER IF NOT EXISTS trg_billingreadings_fts_charges
+        AFTER UPDATE OF FlatNo, BillingMonth ON BillingReadings BEGIN
+            DELETE FROM BillingChargesFTS
+            WHERE rowid IN (SELECT BillID FROM BillingCharges WHERE ReadingID = NEW.ReadingID);
+            INSERT INTO BillingChargesFTS (rowid, FlatNo, BillingMonth, Status, Remarks)
+            SELECT BillID, NEW.FlatNo, NEW.BillingMonth, Status, Remarks
+            FROM BillingCharges WHERE ReadingID = NEW.ReadingID;
+        END""",
+
+        """CREATE TRIGGER IF NOT EXISTS trg_billingcharges_fts_insert AFTER INSERT ON BillingCharges BEGIN
+            INSERT INTO BillingChargesFTS (rowid, FlatNo, BillingMonth, Status, Remarks)
+            VALUES (NEW.BillID,
+                    (SELECT FlatNo FROM BillingReadings WHERE ReadingID = NEW.ReadingID),
+                    (SELECT BillingMonth FROM BillingReadings WHERE ReadingID = NEW.ReadingID),
+                    NEW.Status, NEW.Remarks);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_billingcharges_fts_update
+        AFTER UPDATE OF BillID, ReadingID, Status, Remarks ON BillingCharges BEGIN
+            DELETE FROM BillingChargesFTS WHERE rowid = OLD.BillID;
+            INSERT INTO BillingChargesFTS (rowid, FlatNo, BillingMonth, Status, Remarks)
+            VALUES (NEW.BillID,
+                    (SELECT FlatNo FROM BillingReadings WHERE ReadingID = NEW.ReadingID),
+                    (SELECT BillingMonth FROM BillingReadings WHERE ReadingID = NEW.ReadingID),
+                    NEW.Status, NEW.Remarks);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_billingcharges_fts_delete AFTER DELETE ON BillingCharges BEGIN
+            DELETE FROM BillingChargesFTS WHERE rowid = OLD.BillID;
+        END""",
+
+        """CREATE TRIGGER IF NOT EXISTS trg_consumptionhistory_fts_insert AFTER INSERT ON ConsumptionHistory BEGIN
+            INSERT INTO ConsumptionHistoryFTS (rowid, PersonID, FlatNo, BillingMonth)
+            VALUES (NEW.ConsumptionID, NEW.PersonID, NEW.FlatNo, NEW.BillingMonth);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_consumptionhistory_fts_update
+        AFTER UPDATE OF ConsumptionID, PersonID, FlatNo, BillingMonth ON ConsumptionHistory BEGIN
+            DELETE FROM ConsumptionHistoryFTS WHERE rowid = OLD.ConsumptionID;
+            INSERT INTO ConsumptionHistoryFTS (rowid, PersonID, FlatNo, BillingMonth)
+            VALUES (NEW.ConsumptionID, NEW.PersonID, NEW.FlatNo, NEW.BillingMonth);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_consumptionhistory_fts_delete AFTER DELETE ON ConsumptionHistory BEGIN
+            DELETE FROM ConsumptionHistoryFTS WHERE rowid = OLD.ConsumptionID;
+        END""",
+
+        # Backfill rows written before this migration
+        "INSERT INTO UsersFTS (PersonID, Name, FlatNo, UserType, UserCategory) "
+        "SELECT PersonID, Name, FlatNo, UserType, UserCategory FROM Users",
+        "INSERT INTO BillingReadingsFTS (rowid, FlatNo, PersonID, BillingMonth, ReadingDate) "
+        "SELECT ReadingID, FlatNo, PersonID, BillingMonth, ReadingDate FROM BillingReadings",
+        "INSERT INTO BillingChargesFTS (rowid, FlatNo, BillingMonth, Status, Remarks) "
+        "SELECT bc.BillID, br.FlatNo, br.BillingMonth, bc.Status, bc.Remarks "
+        "FROM BillingCharges bc LEFT JOIN BillingReadings br ON br.ReadingID = bc.ReadingID",
+        "INSERT INTO ConsumptionHistoryFTS (rowid, PersonID, FlatNo, BillingMonth) "
+        "SELECT ConsumptionID, PersonID, FlatNo, BillingMonth FROM ConsumptionHistory",
+    ]),
+    (4, "MonthlyBillSummary: printable bill rows kept current by triggers", [
+        """CREATE TABLE IF NOT EXISTS MonthlyBillSummary (
+            ReadingID INTEGER PRIMARY KEY,
+            BillID INTEGER NOT NULL,
+            FlatNo TEXT NOT NULL,
+            BillingMonth TEXT NOT NULL,
+            PersonID TEXT,
+            Name TEXT,
+            PreviousReading REAL,
+            PresentReading REAL,
+            UnitsConsumed REAL,
+            RatePerUnit REAL,
+            VariableCharges REAL,
+            GSTID INTEGER,
+            GST REAL,
+            GSTAmount REAL,
+            ElectricDutyID INTEGER,
+            ElectricDuty REAL,
+            ElectricDutyAmount REAL,
+            TotalSurcharge REAL,
+            FuelChargeAdjustment REAL,
+            NetPayableAmount REAL,
+            Status TEXT
+        )""",
+        # fetch_billing_data reads a month in flat order straight off this index
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_monthlybillsummary_month_flat ON MonthlyBillSummary (BillingMonth, FlatNo)",
+        "CREATE INDEX IF NOT EXISTS ix_monthlybillsummary_person ON MonthlyBillSummary (PersonID)",
+
+        # A bill's row appears when its BillingCharges row is written (after its
+        # AdditionalCharges / SurchargeGSTDuty rows) and follows every later change
+        f"""CREATE TRIGGER IF NOT EXISTS trg_billingcharges_summary_insert AFTER INSERT ON BillingCharges BEGIN
+            {_refresh_summary("NEW.ReadingID")}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_billingcharges_summary_update AFTER UPDATE ON BillingCharges BEGIN
+            {_refresh_summary("OLD.ReadingID, NEW.ReadingID")}
+        END""",
+        "CREATE TRIGGER IF NOT EXISTS trg_billingcharges_summary_delete AFTER DELETE ON BillingCharges BEGIN "
+        "DELETE FROM MonthlyBillSummary WHERE ReadingID = OLD.ReadingID; END",
+
+        f"""CREATE TRIGGER IF NOT EXISTS trg_billingreadings_summary_update
+        AFTER UPDATE OF ReadingID, FlatNo, PersonID, BillingMonth, PreviousReading, PresentReading
+        ON BillingReadings BEGIN
+            {_refresh_summary("OLD.ReadingID, NEW.ReadingID")}
+        END""",
+        "CREATE TRIGGER IF NOT EXISTS trg_billingreadings_summary_delete AFTER DELETE ON BillingReadings BEGIN "
+        "DELETE FROM MonthlyBillSummary WHERE ReadingID = OLD.ReadingID; END",
+
+        # insert_bill's no-op upserts only set ReadingID, so they do not fire these
+        f"""CREATE TRIGGER IF NOT EXISTS trg_additionalcharges_summary_update
+        AFTER UPDATE OF GSTID, ElectricDutyID ON AdditionalCharges BEGIN
+            {_refresh_summary("OLD.ReadingID, NEW.ReadingID")}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_additionalcharges_summary_delete AFTER DELETE ON AdditionalCharges BEGIN
+            {_refresh_summary("OLD.ReadingID")}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_surchargegstduty_summary_update
+        AFTER UPDATE OF TotalSurcharge, FuelChargeAdjustment ON SurchargeGSTDuty BEGIN
+            {_refresh_summary("OLD.ReadingID, NEW.ReadingID")}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_surchargegstduty_summary_delete AFTER DELETE ON SurchargeGSTDuty BEGIN
+            {_refresh_summary("OLD.ReadingID")}
+        END""",
+
+        """CREATE TRIGGER IF NOT EXISTS trg_gstrates_summary_update AFTER UPDATE OF GST ON GSTRates BEGIN
+            UPDATE MonthlyBillSummary SET GST = NEW.GST, GSTAmount = VariableCharges * NEW.GST / 100
+            WHERE GSTID = OLD.GSTID;
+        END""",
+        "CREATE TRIGGER IF NOT EXISTS trg_gstrates_summary_delete AFTER DELETE ON GSTRates BEGIN "
+        "DELETE FROM MonthlyBillSummary WHERE GSTID = OLD.GSTID; END",
+        """CREATE TRIGGER IF NOT EXISTS trg_electricdutyrates_summary_update
+        AFTER UPDATE OF ElectricDuty ON ElectricDutyRates BEGIN
+            UPDATE MonthlyBillSummary
+            SET ElectricDuty = NEW.ElectricDuty, ElectricDutyAmount = VariableCharges * NEW.ElectricDuty / 100
+            WHERE ElectricDutyID = OLD.DutyID;
+        END""",
+        "CREATE TRIGGER IF NOT EXISTS trg_electricdutyrates_summary_delete AFTER DELETE ON ElectricDutyRates BEGIN "
+        "DELETE FROM MonthlyBillSummary WHERE ElectricDutyID = OLD.DutyID; END",
+
+        """CREATE TRIGGER IF NOT EXISTS trg_users_summary_rename
+        AFTER UPDATE OF Name ON Users WHEN NEW.PersonID = OLD.PersonID BEGIN
+            UPDATE MonthlyBillSummary SET Name = NEW.Name WHERE PersonID = NEW.PersonID;
+        END""",
+        # Rare; re-joins the readings of both IDs (BillingReadings has no PersonID index)
+        f"""CREATE TRIGGER IF NOT EXISTS trg_users_summary_rekey
+        AFTER UPDATE OF PersonID ON Users WHEN NEW.PersonID <> OLD.PersonID BEGIN
+            DELETE FROM MonthlyBillSummary WHERE PersonID = OLD.PersonID;
+            {_refresh_summary("SELECT ReadingID FROM BillingReadings WHERE PersonID IN (OLD.PersonID, NEW.PersonID)")}
+        END""",
+        "CREATE TRIGGER IF NOT EXISTS trg_users_summary_delete AFTER DELETE ON Users BEGIN "
+        "DELETE FROM MonthlyBillSummary WHERE PersonID = OLD.PersonID; END",
+
+        # Backfill bills written before this migration
+        f"INSERT INTO MonthlyBillSummary {MONTHLY_BILL_SUMMARY_SELECT}",
+    ]),
+    (5, "TariffSlabs.PricingMode: flat or progressive slab pricing per schedule", [
+        "ALTER TABLE TariffSlabs ADD COLUMN PricingMode TEXT NOT NULL DEFAULT 'flat' "
+        "CHECK (PricingMode IN ('flat', 'progressive'))",
+    ]),
+    (6, "Reading ingestion: spool checkpoints and rejected lines", [
+        # Byte position just past the last committed line of each spool file
+        """CREATE TABLE IF NOT EXISTS IngestOffsets (
+            Source TEXT PRIMARY KEY,
+            FileID TEXT NOT NULL,
+            Position INTEGER NOT NULL,
+            UpdatedAt TEXT NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS IngestRejects (
+            RejectID INTEGER PRIMARY KEY AUTOINCREMENT,
+            Source TEXT NOT NULL,
+            Position INTEGER NOT NULL,
+            Line TEXT NOT NULL,
+            Reason TEXT NOT NULL,
+            RejectedAt TEXT NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_ingestrejects_source ON IngestRejects (Source, Position)",
+    ]),
+    (7, "Sort indexes for keyset-paged report tables", [
+        # queries.TABLES sortable columns: each index returns (column, key) in order, so a page
+        # is a range scan. Integer-keyed tables get the rowid key implicitly.
+        "CREATE INDEX IF NOT EXISTS ix_users_name_sort ON Users (Name, PersonID)",
+        "CREATE INDEX IF NOT EXISTS ix_users_usertype_sort ON Users (UserType, PersonID)",
+        "CREATE INDEX IF NOT EXISTS ix_users_usercategory_sort ON Users (UserCategory, PersonID)",
+        "CREATE INDEX IF NOT EXISTS ix_billingreadings_flat_sort ON BillingReadings (FlatNo)",
+        "CREATE INDEX IF NOT EXISTS ix_billingreadings_person_sort ON BillingReadings (PersonID)",
+        "CREATE INDEX IF NOT EXISTS ix_billingreadings_month_sort ON BillingReadings (BillingMonth)",
+        "CREATE INDEX IF NOT EXISTS ix_billingreadings_readingdate_sort ON BillingReadings (ReadingDate)",
+        "CREATE INDEX IF NOT EXISTS ix_billingreadings_units_sort ON BillingReadings (UnitsConsumed)",
+        "CREATE INDEX IF NOT EXISTS ix_billingcharges_variable_sort ON BillingCharges (VariableCharges)",
+        "CREATE INDEX IF NOT EXISTS ix_billingcharges_surcharge_sort ON BillingCharges (TotalSurcharge)",
+        "CREATE INDEX IF NOT EXISTS ix_billingcharges_net_sort ON BillingCharges (NetPayableAmount)",
+        "CREATE INDEX IF NOT EXISTS ix_billingcharges_status_sort ON BillingCharges (Status)",
+        "CREATE INDEX IF NOT EXISTS ix_consumptionhistory_person_sort ON ConsumptionHistory (PersonID)",
+        "CREATE INDEX IF NOT EXISTS ix_consumptionhistory_flat_sort ON ConsumptionHistory (FlatNo)",
+        "CREATE INDEX IF NOT EXISTS ix_consumptionhistory_month_sort ON ConsumptionHistory (BillingMonth)",
+        "CREATE INDEX IF NOT EXISTS ix_consumptionhistory_units_sort ON ConsumptionHistory (UnitsConsumed)",
+    ]),
+    (8, "MonthlyBillSummary: pick up bills whose user is added after the bill", [
+        # A reading billed before its PersonID existed in Users (or after the user was deleted
+        # and added again) has no summary row until the user is inserted; indexed since v7
+        f"""CREATE TRIGGER IF NOT EXISTS trg_users_summary_insert AFTER INSERT ON Users BEGIN
+            {_refresh_summary("SELECT ReadingID FROM BillingReadings WHERE PersonID = NEW.PersonID")}
+        END""",
+        # Bills that went missing before this trigger existed
+        f"INSERT INTO MonthlyBillSummary {MONTHLY_BILL_SUMMARY_SELECT}\n"
+        "        WHERE br.ReadingID NOT IN (SELECT ReadingID FROM MonthlyBillSummary)",
+    ]),
+]
+
+
+def current_version(conn=None):
+    if conn is None:
+        conn = get_connection()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS SchemaMigrations (
+            Version INTEGER PRIMARY KEY,
+            Description TEXT NOT NULL,
+            AppliedAt TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+    return conn.execute("SELECT COALESCE(MAX(Version), 0) FROM SchemaMigrations").fetchone()[0]
+
+
+def migrate(conn=None, target=None):
+    """
+    Apply every pending migration, each in its own transaction, then ANALYZE.
+
+    Args:
+        target (int, optional): Stop after this version (default: latest).
+
+    Returns:
+        list: Versions applied by this call.
+
+    Raises:
+        MigrationError: A migration's precheck failed; it and later ones are not applied.
+    """
+    if conn is None:
+        conn = get_connection()
+    version = current_version(conn)
+    applied = []
+
+    for migration_version, description, statements in MIGRATIONS:
+        if migration_version <= version or (target is not None and migration_version > target):
+            continue
+        with transaction(conn):
+            if migration_version in PRECHECKS:
+                PRECHECKS[migration_version](conn)
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute("INSERT INTO SchemaMigrations (Version, Description) VALUES (?, ?)",
+                         (migration_version, description))
+            conn.execute(f"PRAGMA user_version = {migration_version}")
+        applied.append(migration_version)
+
+    if applied:
+        # Refresh planner statistics so the new indexes are picked up
+        conn.execute("ANALYZE")
+        conn.commit()
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create or upgrade the billing database schema.")
+    parser.add_argument("--db", help="Database file (default: BILLING_DB_PATH or billing_system.db)")
+    parser.add_argument("--target", type=int, help="Migrate up to this version only")
+    args = parser.parse_args()
+
+    if args.db:
+        set_db_path(args.db)
+    try:
+        applied = migrate(target=args.target)
+    except MigrationError as e:
+        print(e)
+        return 1
+    if applied:
+        print(f"Applied migrations: {', '.join(map(str, applied))}")
+    print(f"Schema version: {current_version()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
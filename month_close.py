@@ -0,0 +1,175 @@
+# Description: Headless month-close for cron: price and bill every reading of a
+# month, then write the bulk bill PDF and CSV. Does not import Streamlit.
+#
+#   python month_close.py 2025-03 --workers 4 --out-dir bills/
+#   python month_close.py 2025-03 --resume        # after a crash
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from billing_engine import (BILLING_DATA_QUERY, CLOSE_BATCH_SIZE, close_month, close_month_in_batches,
+                            iter_billing_data)
+from db import get_connection, set_db_path
+from migrations import migrate
+
+STAGES = ("charges", "pdf", "csv")
+
+
+def _month(value):
+    try:
+        datetime.strptime(value, "%Y-%m")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value!r} is not a YYYY-MM month")
+    return value
+
+
+def load_checkpoint(path, billing_month):
+    """Saved progress for billing_month, or a fresh checkpoint."""
+    fresh = {"month": billing_month, "batches_committed": 0, "bills_written": 0, "done": []}
+    if path is None or not os.path.exists(path):
+        return fresh
+    with open(path) as f:
+        checkpoint = json.load(f)
+    return checkpoint if checkpoint.get("month") == billing_month else fresh
+
+
+def save_checkpoint(path, checkpoint):
+    """Write the checkpoint atomically so a crash never leaves it half-written."""
+    checkpoint["updated_at"] = datetime.now().isoformat(timespec="seconds")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _write_atomically(path, write, **open_kwargs):
+    """Run write(file) on path + ".part" and move it into place only once complete."""
+    part_path = f"{path}.part"
+    with open(part_path, **open_kwargs) as f:
+        result = write(f)
+    os.replace(part_path, path)
+    return result
+
+
+def write_charges(billing_month, checkpoint, checkpoint_path, batch_size, gst_rate, electric_duty, conn):
+    for bills in close_month_in_batches(billing_month, batch_size, gst_rate, electric_duty, conn):
+        checkpoint["batches_committed"] += 1
+        checkpoint["bills_written"] += len(bills)
+        save_checkpoint(checkpoint_path, checkpoint)
+        print(f"  batch {checkpoint['batches_committed']}: {len(bills)} bills committed "
+              f"({checkpoint['bills_written']} total)")
+
+
+def write_pdf(billing_month, path, workers, conn):
+    # Imported here so a charges-only run never loads reportlab
+    from bill_pdf import STREAM_BATCH_SIZE, default_workers, write_bulk_bills
+
+    if workers is None:
+        workers = default_workers()
+
+    return _write_atomically(path, lambda f: write_bulk_bills(
+        iter_billing_data(billing_month, STREAM_BATCH_SIZE, conn), billing_month, f, workers), mode="wb")
+
+
+def write_csv(billing_month, path, conn):
+    def write(f):
+        cursor = conn.execute(BILLING_DATA_QUERY, (billing_month,))
+        writer = csv.writer(f)
+        writer.writerow([column[0] for column in cursor.description])
+        rows = 0
+        while True:
+            batch = cursor.fetchmany(1000)
+            if not batch:
+                break
+            writer.writerows(batch)
+            rows += len(batch)
+        return rows
+
+    return _write_atomically(path, write, mode="w", newline="", encoding="utf-8")
+
+
+def run(args):
+    if args.db:
+        set_db_path(args.db)
+    conn = get_connection()
+    migrate(conn)
+
+    if args.dry_run:
+        bills = close_month(args.month, args.gst_rate, args.electric_duty, dry_run=True, conn=conn)
+        print(f"Dry run for {args.month}: {len(bills)} unbilled readings, "
+              f"net payable {bills['NetPayableAmount'].sum() if len(bills) else 0:,.2f}. Nothing written.")
+        return 0
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    checkpoint_path = args.checkpoint or os.path.join(args.out_dir, f".month_close_{args.month}.json")
+    if args.resume:
+        checkpoint = load_checkpoint(checkpoint_path, args.month)
+        if checkpoint["done"] or checkpoint["batches_committed"]:
+            print(f"Resuming {args.month}: {checkpoint['batches_committed']} batches committed, "
+                  f"done: {', '.join(checkpoint['done']) or 'none'}")
+    else:
+        # Charges already committed are still skipped (billed readings are never reloaded);
+        # a fresh run only re-renders the PDF and CSV
+        checkpoint = load_checkpoint(None, args.month)
+
+    started = time.perf_counter()
+    pdf_path = os.path.join(args.out_dir, f"bills_{args.month}.pdf")
+    csv_path = os.path.join(args.out_dir, f"bills_{args.month}.csv")
+
+    for stage in STAGES:
+        if stage in checkpoint["done"]:
+            print(f"{stage}: already done, skipping")
+            continue
+        if stage == "pdf" and args.skip_pdf:
+            continue
+        stage_started = time.perf_counter()
+        if stage == "charges":
+            print(f"charges: pricing unbilled readings of {args.month} in batches of {args.batch_size}")
+            write_charges(args.month, checkpoint, checkpoint_path, args.batch_size,
+                          args.gst_rate, args.electric_duty, conn)
+            detail = f"{checkpoint['bills_written']} bills written"
+        elif stage == "pdf":
+            pages = write_pdf(args.month, pdf_path, args.workers, conn)
+            detail = f"{pages} pages -> {pdf_path}"
+        else:
+            rows = write_csv(args.month, csv_path, conn)
+            detail = f"{rows} rows -> {csv_path}"
+        checkpoint["done"].append(stage)
+        save_checkpoint(checkpoint_path, checkpoint)
+        print(f"{stage}: {detail} ({time.perf_counter() - stage_started:.1f}s)")
+
+    print(f"Month {args.month} closed in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Close a billing month: write charges, bulk PDF and CSV.")
+    parser.add_argument("month", type=_month, help="Billing month, YYYY-MM")
+    parser.add_argument("--db", help="Database file (default: BILLING_DB_PATH or billing_system.db)")
+    parser.add_argument("--out-dir", default=".", help="Directory for the PDF, CSV and checkpoint (default: .)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="PDF render processes (default: BILLING_PDF_WORKERS or one per CPU)")
+    parser.add_argument("--batch-size", type=int, default=CLOSE_BATCH_SIZE,
+                        help=f"Readings committed per transaction (default: {CLOSE_BATCH_SIZE})")
+    parser.add_argument("--gst-rate", type=float, help="GST %% to apply (default: rate effective for the month)")
+    parser.add_argument("--electric-duty", type=float, help="Electric duty %% (default: rate effective for the month)")
+    parser.add_argument("--dry-run", action="store_true", help="Price the month and report; write nothing")
+    parser.add_argument("--resume", action="store_true", help="Skip stages the checkpoint marks as done")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: OUT_DIR/.month_close_MONTH.json)")
+    parser.add_argument("--skip-pdf", action="store_true", help="Do not render the bulk PDF")
+    args = parser.parse_args(argv)
+
+    try:
+        return run(args)
+    except sqlite3.Error as e:
+        print(f"Database error: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+# Description: Bill pricing (slab, GST/duty and surcharge rates) and the single-bill write path.
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+import streamlit as st
+
+from billing_engine import compute_charges, get_date
+from db import bump_table_version, get_connection, transaction
+from records import (fetch_complete_bill, replace_surcharge_mappings, update_additional_charges, update_billing_charges,
+                     update_billing_readings, update_surcharge_gst_duty)
+from surcharges import surcharge_resolver
+from tariffs import tariff_slabs
+
+
+# Get the previous month from the current billing month    
+def get_previous_month(billing_month):
+    year, month = map(int, billing_month.split('-'))
+    previous_month = (datetime(year, month, 1) - timedelta(days=1)).strftime('%Y-%m')
+    return previous_month
+
+
+def calculate_units_consumed(previous_reading, present_reading):
+    #"""Calculate units consumed, ensuring it's non-negative."""
+    return max(0, abs(present_reading - previous_reading))
+
+
+def fetch_rate_per_unit(cursor, units_consumed, user_category, as_of=None):
+    # Served from the in-memory slab index; it reloads itself only when TariffSlabs changes.
+    # For a progressive schedule this is the average rate over all units.
+    return tariff_slabs.rate(units_consumed, user_category, as_of, conn=cursor.connection)
+
+
+def fetch_variable_charges(cursor, units_consumed, user_category, as_of=None):
+    # (variable charges, rate per unit), flat or progressive as the category's schedule says;
+    # the same engine the month close prices with
+    return tariff_slabs.price(units_consumed, user_category, as_of, conn=cursor.connection)
+
+
+def fetch_gst_electric_duty_ids(cursor, gst_rate, electric_duty):
+    query = """
+        SELECT GSTID FROM GSTRates WHERE GST = ?
+    """
+    cursor.execute(query, (gst_rate,))
+    gst_id = cursor.fetchone()
+    gst_id = gst_id[0] if gst_id else None  # Extract value if found
+
+    query = """
+        SELECT DutyID FROM ElectricDutyRates  WHERE ElectricDuty = ?
+    """
+    cursor.execute(query, (electric_duty,))
+    electric_duty_id = cursor.fetchone()
+    electric_duty_id = electric_duty_id[0] if electric_duty_id else None  # Extract value if found
+
+    return gst_id, electric_duty_id
+
+
+def fetch_surcharge_rate(cursor,surcharge_type_id, units_consumed, effective_date=None):
+    """
+    Fetch the SurchargeID and RatePerUnit that apply to the given units.
+
+    Served from the in-memory Surcharge index; without an effective date the
+    latest schedule effective on or before today is used.
+
+    Returns:
+        tuple: (SurchargeID, RatePerUnit), or None if no band matches.
+    """
+    conn = cursor.connection if cursor is not None else None
+    return surcharge_resolver.resolve(surcharge_type_id, units_consumed, effective_date, conn=conn)
+
+
+def insert_bill(person_id, reading_id, flat_no, user_category, name, month, previous_reading, present_reading, 
+                units_consumed, electric_duty, gst_rate, unit_adjusted, total_monthly_surcharge, total_adjusted_surcharge,
+                surcharge_mappings=None):
+    """
+    Write the three charge rows of one reading in a single BEGIN IMMEDIATE transaction.
+
+    Every insert is an UPSERT on the table's unique ReadingID index, so a
+    retry (or a second clerk on the same reading) reuses the existing rows
+    instead of duplicating them. surcharge_mappings, if given, become the
+    reading's surcharge rows in the same transaction (see
+    replace_surcharge_mappings); an already billed reading keeps its own.
+    The PDF is rendered after the commit.
+
+    Returns:
+        int: BillID of the new bill, or None if the reading was already billed or the write failed.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        # Everything that only reads happens before the write lock is taken
+        reading_date = get_date(month)
+        variable_charges, rate_per_unit = fetch_variable_charges(cursor, units_consumed, user_category, reading_date)
+
+        # Calculate Variable Charges, GST, Electric Duty and Surcharges
+        charges = compute_charges(units_consumed, rate_per_unit, gst_rate, electric_duty,
+                                  total_monthly_surcharge, total_adjusted_surcharge, variable_charges)
+        variable_charges = charges["VariableCharges"]
+        gst_amount = charges["GST"]
+        electric_duty_amount = charges["ElectricDuty"]
+        computed_surcharge = charges["ComputedSurcharge"]
+        gst_on_surcharge = charges["GSTOnSurcharge"]
+        electric_duty_on_surcharge = charges["ElectricDutyOnSurcharge"]
+        final_total_surcharge = charges["TotalSurcharge"]
+        total_additional_charges = charges["TotalAdditionalCharges"]
+        net_payable_amount = charges["NetPayableAmount"]
+
+        # Fetch GST & Electric Duty IDs
+        gst_id, electric_duty_id = fetch_gst_electric_duty_ids(cursor, gst_rate, electric_duty)
+
+        with transaction(conn):
+            # The no-op DO UPDATE makes RETURNING hand back the existing ID on conflict
+            additional_charge_id = conn.execute("""
+                INSERT INTO AdditionalCharges (ReadingID, GSTID, ElectricDutyID, GST, ElectricDuty)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (ReadingID) DO UPDATE SET ReadingID = excluded.ReadingID
+                RETURNING AdditionalChargeID
+            """, (reading_id, gst_id, electric_duty_id, gst_amount, electric_duty_amount)).fetchone()[0]
+
+            surcharge_gst_duty_id = conn.execute("""
+                INSERT INTO SurchargeGSTDuty (ReadingID, MonthSurcharge, AdjustedSurcharge, TotalSurcharge,
+                                              GSTID, ElectricDutyID, GSTAmount, ElectricDutyAmount)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (ReadingID) DO UPDATE SET ReadingID = excluded.ReadingID
+                RETURNING SurchargeGSTDutyID
+            """, (reading_id, total_monthly_surcharge, total_adjusted_surcharge, computed_surcharge,
+                  gst_id, electric_duty_id, gst_on_surcharge, electric_duty_on_surcharge)).fetchone()[0]
+
+            bill = conn.execute("""
+                INSERT INTO BillingCharges (ReadingID, RatePerUnit, VariableCharges, AdditionalChargeID, SurchargeGSTDutyID, 
+                                           TotalAdditionalCharges, TotalSurcharge, NetPayableAmount, Status, Remarks)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (ReadingID) DO NOTHING
+                RETURNING BillID
+            """, (reading_id, rate_per_unit, variable_charges, additional_charge_id, surcharge_gst_duty_id, 
+                  total_additional_charges, final_total_surcharge, net_payable_amount, 'Due', 'No remarks')).fetchone()
+
+            if bill is not None and surcharge_mappings is not None:
+                replace_surcharge_mappings(cursor, reading_id, month, surcharge_mappings)
+
+    except sqlite3.IntegrityError as e:
+        st.error(f"❌ Database Error: {e}")
+        return None
+
+    except Exception as e:
+        st.error(f"⚠️ Unexpected Error: {e}")
+        return None
+
+    bump_table_version("AdditionalCharges", "SurchargeGSTDuty", "BillingCharges", "ReadingSurchargeMapping")
+    if bill is None:
+        st.warning(f"⚠️ Reading ID {reading_id} is already billed. Nothing was changed; use Generate Bill to reprint it.")
+        return None
+    st.success("✅ Billing information added successfully!")
+
+    # 📄 Generate PDF Bill (outside the transaction); reportlab is only loaded once a bill is printed
+    try:
+        from bill_pdf import generate_pdf
+        pdf_path = generate_pdf(flat_no, person_id, name, month, reading_date, previous_reading,
+                                present_reading, units_consumed, electric_duty_amount, gst_amount, 
+                                computed_surcharge, variable_charges, total_additional_charges, 
+                                net_payable_amount, rate_per_unit=rate_per_unit)
+    except Exception as e:
+        st.error(f"❌ Error generating the PDF: {e}")
+        return bill[0]
+
+    if os.path.exists(pdf_path):
+        with open(pdf_path, "rb") as f:
+            st.download_button(
+                "📥 Download Bill PDF",
+                f,
+                file_name=os.path.basename(pdf_path),
+                mime="application/pdf"
+            )
+    else:
+        st.error("❌ Error generating the PDF!")
+    return bill[0]
+
+
+def update_bill(flat_no, month, present_reading=None, electric_duty=None, gst=None,unit_adjusted=None,total_montly_surcharge=None,total_adjusted_surcharge=None,
+                surcharge_mappings=None):
+    """
+    Re-price one bill with compute_charges(), the arithmetic insert_bill and close_month use.
+
+    The reading, its AdditionalCharges, SurchargeGSTDuty and BillingCharges
+    rows and, if given, its surcharge_mappings (see replace_surcharge_mappings)
+    are rewritten in one BEGIN IMMEDIATE transaction.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        bill_data = fetch_complete_bill(flat_no, month)
+        if not bill_data:
+            st.error(f"❌ No bill found for Flat {flat_no} in {month}")
+            return
+
+        (
+        reading_id, previous_reading, old_present_reading, units_consumed,old_unit_adjusted,
+        bill_id, old_rate_per_unit, variable_charges, old_electric_duty, old_gst, 
+        old_total_monthly_surcharge,old_total_adjusted_surcharge
+        ) = bill_data
+
+        units_consumed = calculate_units_consumed(previous_reading,present_reading)
+        # Re-price the new units with the slabs in force for the month, like insert_bill
+        category = cursor.execute("""
+            SELECT u.UserCategory FROM BillingReadings br
+            LEFT JOIN Users u ON u.PersonID = br.PersonID
+            WHERE br.ReadingID = ?
+        """, (reading_id,)).fetchone()
+        if category and category[0] is not None:
+            variable_charges, rate_per_unit = fetch_variable_charges(cursor, units_consumed, category[0], get_date(month))
+        else:
+            # No user to take a category from; keep the billed rate (charged flat by compute_charges)
+            rate_per_unit = old_rate_per_unit
+            variable_charges = None
+
+        charges = compute_charges(units_consumed, rate_per_unit, gst, electric_duty,
+                                  total_montly_surcharge, total_adjusted_surcharge, variable_charges)
+        gst_id, electric_duty_id = fetch_gst_electric_duty_ids(cursor, gst, electric_duty)
+
+        with transaction(conn):
+            update_billing_readings(cursor, flat_no, month, present_reading, previous_reading)
+            update_additional_charges(cursor, reading_id, gst_id, electric_duty_id,
+                                      charges["GST"], charges["ElectricDuty"])
+            update_surcharge_gst_duty(cursor, reading_id, total_montly_surcharge, total_adjusted_surcharge,
+                                      charges["ComputedSurcharge"], gst_id, electric_duty_id,
+                                      charges["GSTOnSurcharge"], charges["ElectricDutyOnSurcharge"])
+            update_billing_charges(cursor, bill_id, reading_id, rate_per_unit, charges["VariableCharges"],
+                                   charges["TotalAdditionalCharges"], charges["TotalSurcharge"],
+                                   charges["NetPayableAmount"])
+            if surcharge_mappings is not None:
+                replace_surcharge_mappings(cursor, reading_id, month, surcharge_mappings)
+
+        bump_table_version("BillingReadings", "AdditionalCharges", "SurchargeGSTDuty", "BillingCharges",
+                           "ReadingSurchargeMapping")
+        st.success(f"✅ Bill updated successfully for Flat {flat_no} ({month})!")
+    except Exception as e:
+        st.error(f"❌ Error updating bill: {e}")
@@ -0,0 +1,310 @@
+# Description: Server-side filtered, keyset-paginated reads for the report pages.
+# Filters, free-text search and sorting run in SQLite; only one page of rows
+# is ever materialized in pandas.
+import re
+from collections import namedtuple
+
+import pandas as pd
+
+from db import get_connection
+
+DEFAULT_PAGE_SIZE = 50
+
+# Pseudo sort column: FTS5 bm25 rank of the search term (best match first)
+RELEVANCE = "Relevance"
+
+
+class TableSpec:
+    """
+    How a report table is read.
+
+    Args:
+        source (str): FROM clause (table or join).
+        key (str): Unique column name used as the keyset tie-breaker.
+        columns (dict): Output column name -> SQL expression; also the
+            whitelist for filters and sorting.
+        fts (str, optional): FTS5 table (migration 3) backing the free-text search.
+        fts_key (str): FTS5 column holding the row's key (rowid for integer keys).
+        sortable (list, optional): Columns offered for sorting (default: all).
+            On the large tables these are the ones with a (column, key)
+            index (migration 7), so a page is an index range scan.
+    """
+
+    def __init__(self, source, key, columns, fts=None, fts_key="rowid", sortable=None):
+        self.source = source
+        self.key = key
+        self.columns = columns
+        self.fts = fts
+        self.fts_key = fts_key
+        self.sortable = list(sortable or columns)
+
+
+def _plain(table, key, names, **kwargs):
+    return TableSpec(table, key, {name: name for name in names}, **kwargs)
+
+
+TABLES = {
+    "Users": _plain("Users", "PersonID", [
+        "PersonID", "Name", "FlatNo", "UserType", "UserCategory", "LoadSanctioned", "Phase",
+    ], fts="UsersFTS", fts_key="PersonID",
+        sortable=["PersonID", "Name", "FlatNo", "UserType", "UserCategory"]),
+    "BillingReadings": _plain("BillingReadings", "ReadingID", [
+        "ReadingID", "FlatNo", "PersonID", "BillingMonth", "ReadingDate",
+        "PreviousReading", "PresentReading", "UnitsConsumed", "UnitsAdjusted",
+    ], fts="BillingReadingsFTS",
+        sortable=["ReadingID", "FlatNo", "PersonID", "BillingMonth", "ReadingDate", "UnitsConsumed"]),
+    # BillingCharges has no FlatNo/BillingMonth of its own; take them from the reading
+    "BillingCharges": TableSpec(
+        "BillingCharges bc JOIN BillingReadings br ON br.ReadingID = bc.ReadingID",
+        "BillID",
+        {
+            "BillID": "bc.BillID",
+            "ReadingID": "bc.ReadingID",
+            "FlatNo": "br.FlatNo",
+            "BillingMonth": "br.BillingMonth",
+            "RatePerUnit": "bc.RatePerUnit",
+            "VariableCharges": "bc.VariableCharges",
+            "AdditionalChargeID": "bc.AdditionalChargeID",
+            "SurchargeGSTDutyID": "bc.SurchargeGSTDutyID",
+            "TotalAdditionalCharges": "bc.TotalAdditionalCharges",
+            "TotalSurcharge": "bc.TotalSurcharge",
+            "NetPayableAmount": "bc.NetPayableAmount",
+            "Status": "bc.Status",
+            "Remarks": "bc.Remarks",
+        },
+        fts="BillingChargesFTS",
+        sortable=["BillID", "ReadingID", "VariableCharges", "TotalSurcharge", "NetPayableAmount", "Status"],
+    ),
+    "ConsumptionHistory": _plain("ConsumptionHistory", "ConsumptionID", [
+        "ConsumptionID", "PersonID", "FlatNo", "BillingMonth", "UnitsConsumed", "RecordedAt",
+    ], fts="ConsumptionHistoryFTS",
+        sortable=["ConsumptionID", "PersonID", "FlatNo", "BillingMonth", "UnitsConsumed"]),
+    # The rate tables hold a few dozen rows; every column sorts without an index
+    "TariffSlabs": _plain("TariffSlabs", "SlabID", [
+        "SlabID", "UserCategory", "MinUnits", "MaxUnits", "RatePerUnit", "RateEffectiveDate", "PricingMode",
+    ]),
+    "GSTRates": _plain("GSTRates", "GSTID", ["GSTID", "EffectiveDate", "GST"]),
+    "ElectricDutyRates": _plain("ElectricDutyRates", "DutyID", ["DutyID", "EffectiveDate", "ElectricDuty"]),
+}
+
+# rows: DataFrame of the current page; total: rows matching the filters;
+# cursor: pass as `after` to get the next page (None on the last page)
+Page = namedtuple("Page", ["rows", "total", "cursor"])
+
+
+def _like_pattern(text):
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def match_expression(term):
+    """
+    FTS5 MATCH expression for a user-typed search term.
+
+    Every whitespace-separated word must match, the last token of each as a
+    prefix; punctuation splits tokens the same way the index does, so
+    "2025-0" matches the month 2025-01 and "A1" matches flat A101.
+    Returns None when the term has nothing searchable.
+    """
+    phrases = []
+    for word in (term or "").split():
+        tokens = re.findall(r"\w+", word)
+        if tokens:
+            phrases.append(f'"{" ".join(tokens)}"*')
+    return " AND ".join(phrases) or None
+
+
+def search_ids(table, term, limit=None, conn=None):
+    """
+    Keys of the rows matching a search term, best match first.
+
+    Args:
+        table (str): Key of TABLES with an FTS index.
+        term (str): Words as typed by the user.
+        limit (int, optional): Return at most this many keys.
+
+    Returns:
+        list: Table keys (ReadingID, BillID, PersonID, ...) ordered by bm25 rank.
+    """
+    spec = TABLES[table]
+    expression = match_expression(term)
+    if spec.fts is None or expression is None:
+        return []
+    if conn is None:
+        conn = get_connection()
+    sql = f"SELECT {spec.fts_key} FROM {spec.fts} WHERE {spec.fts} MATCH ? ORDER BY rank"
+    params = [expression]
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return [row[0] for row in conn.execute(sql, params)]
+
+
+def _source(spec, search):
+    """FROM clause and its params; joins the ranked FTS hits when the table has an index."""
+    expression = match_expression(search) if spec.fts else None
+    if expression is None:
+        return spec.source, [], False
+    hits = (f"JOIN (SELECT {spec.fts_key} AS _hit_key, rank AS _hit_rank FROM {spec.fts} "
+            f"WHERE {spec.fts} MATCH ?) hits ON hits._hit_key = {spec.columns[spec.key]}")
+    return f"{spec.source} {hits}", [expression], True
+
+
+def _where(spec, filters, contains, search):
+    clauses, params = [], []
+    for name, value in (filters or {}).items():
+        if value in (None, ""):
+            continue
+        clauses.append(f"{spec.columns[name]} = ?")
+        params.append(value)
+    for name, text in (contains or {}).items():
+        if not text:
+            continue
+        clauses.append(f"{spec.columns[name]} LIKE ? ESCAPE '\\'")
+        params.append(_like_pattern(text))
+    if search and spec.fts is None:
+        # Small rate tables have no FTS index; scan them
+        pattern = _like_pattern(search)
+        clauses.append("(" + " OR ".join(
+            f"CAST({expr} AS TEXT) LIKE ? ESCAPE '\\'" for expr in spec.columns.values()
+        ) + ")")
+        params.extend([pattern] * len(spec.columns))
+    return clauses, params
+
+
+def query_page(table, filters=None, contains=None, search=None, sort_by=None, descending=False,
+               after=None, page_size=DEFAULT_PAGE_SIZE, conn=None):
+    """
+    One page of a report table, filtered and sorted in SQL.
+
+    Args:
+        table (str): Key of TABLES.
+        filters (dict, optional): Column -> value for exact matches (empty values ignored).
+        contains (dict, optional): Column -> substring, case-insensitive.
+        search (str, optional): Free-text term; FTS5 prefix match on indexed
+            tables, substring match against every column otherwise.
+        sort_by (str, optional): Column to sort on (default: the table key), or
+            RELEVANCE to rank by the search term.
+        descending (bool): Sort direction.
+        after (tuple, optional): Page.cursor of the previous page.
+        page_size (int): Rows per page.
+
+    Returns:
+        Page: (rows, total, cursor).
+    """
+    spec = TABLES[table]
+    if conn is None:
+        conn = get_connection()
+    _check_columns(table, spec, filters, contains, sort_by)
+
+    source, source_params, sort_expr = _source_and_sort(spec, search, sort_by)
+    clauses, params = _where(spec, filters, contains, search)
+    params = source_params + params
+    where_sql = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    total = conn.execute(f"SELECT COUNT(*) FROM {source} {where_sql}", params).fetchone()[0]
+
+    key_expr = spec.columns[spec.key]
+    select_list = ", ".join(f"{expr} AS {name}" for name, expr in spec.columns.items())
+    # Each segment is one index range in sort order; later ones only run if the page is not full yet
+    frames, wanted = [], page_size + 1
+    for segment_clauses, segment_params in _after(sort_expr, key_expr, after, descending):
+        page_clauses = clauses + segment_clauses
+        page_where = f"WHERE {' AND '.join(page_clauses)}" if page_clauses else ""
+        frame = pd.read_sql_query(
+            f"""
+            SELECT {select_list}, {sort_expr} AS _sort_value, {key_expr} AS _key_value
+            FROM {source}
+            {page_where}
+            ORDER BY {_order_by(sort_expr, key_expr, descending)}
+            LIMIT ?
+            """,
+            conn,
+            params=params + segment_params + [wanted],
+        )
+        frames.append(frame)
+        wanted -= len(frame)
+        if wanted <= 0:
+            break
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+    cursor = None
+    if len(df) > page_size:
+        df = df.iloc[:page_size]
+        last = df.iloc[-1]
+        cursor = (_python_value(last["_sort_value"]), _python_value(last["_key_value"]))
+    rows = df.drop(columns=["_sort_value", "_key_value"]).reset_index(drop=True)
+    return Page(rows, total, cursor)
+
+
+def query_all(table, filters=None, contains=None, search=None, sort_by=None, descending=False, conn=None):
+    """Every row matching the filters, for CSV export."""
+    spec = TABLES[table]
+    if conn is None:
+        conn = get_connection()
+    _check_columns(table, spec, filters, contains, sort_by)
+    source, source_params, sort_expr = _source_and_sort(spec, search, sort_by)
+    clauses, params = _where(spec, filters, contains, search)
+    where_sql = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    select_list = ", ".join(f"{expr} AS {name}" for name, expr in spec.columns.items())
+    return pd.read_sql_query(
+        f"SELECT {select_list} FROM {source} {where_sql} "
+        f"ORDER BY {_order_by(sort_expr, spec.columns[spec.key], descending)}",
+        conn,
+        params=source_params + params,
+    )
+
+
+def _check_columns(table, spec, filters, contains, sort_by):
+    names = list(filters or {}) + list(contains or {})
+    if sort_by and sort_by != RELEVANCE:
+        names.append(sort_by)
+    for name in names:
+        if name not in spec.columns:
+            raise ValueError(f"Unknown column {name!r} for {table}")
+    if sort_by and sort_by != RELEVANCE and sort_by not in spec.sortable:
+        raise ValueError(f"{table} cannot be sorted by {sort_by!r}")
+
+
+def _source_and_sort(spec, search, sort_by):
+    """(FROM clause, its params, sort expression); RELEVANCE falls back to the key without a search."""
+    source, source_params, ranked = _source(spec, search)
+    if sort_by == RELEVANCE and ranked:
+        return source, source_params, "hits._hit_rank"
+    column = spec.key if sort_by in (None, RELEVANCE) else sort_by
+    return source, source_params, spec.columns[column]
+
+
+def _order_by(sort_expr, key_expr, descending):
+    # The raw columns, so a (column, key) index can return the rows already in order
+    direction = "DESC" if descending else "ASC"
+    if sort_expr == key_expr:
+        return f"{key_expr} {direction}"
+    return f"{sort_expr} {direction}, {key_expr} {direction}"
+
+
+def _after(sort_expr, key_expr, cursor, descending):
+    """
+    Keyset predicates for the rows after cursor (sort value, key), as ([clauses], params) segments in sort order.
+
+    SQLite sorts NULLs first ascending and last descending, and a row-value
+    comparison never matches a NULL, so the NULL rows get a segment of their
+    own instead of an OR that would turn the index range into a scan.
+    """
+    if cursor is None:
+        return [([], [])]
+    value, key = cursor
+    op = "<" if descending else ">"
+    if sort_expr == key_expr:
+        return [([f"{key_expr} {op} ?"], [key])]
+    if value is None:
+        null_rest = ([f"{sort_expr} IS NULL", f"{key_expr} {op} ?"], [key])
+        return [null_rest] if descending else [null_rest, ([f"{sort_expr} IS NOT NULL"], [])]
+    past = ([f"({sort_expr}, {key_expr}) {op} (?, ?)"], [value, key])
+    return [past, ([f"{sort_expr} IS NULL"], [])] if descending else [past]
+
+
+def _python_value(value):
+    # numpy scalars are not valid sqlite3 parameters; pandas reads a NULL as NaN
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, "item") else value
@@ -0,0 +1,124 @@
+# Description: GST, electric duty, surcharge and tariff rate schedules (cached reads and upserts).
+from datetime import datetime
+
+import pandas as pd
+
+from db import bump_table_version, get_connection
+from ref_cache import reference_cache
+from tariffs import PRICING_MODES
+
+
+# ✅ Fetch GST Rates
+def get_gst_rates():
+    def load():
+        conn = get_connection()
+        return pd.read_sql_query("SELECT * FROM GSTRates ORDER BY EffectiveDate DESC", conn)
+    return reference_cache.get("gst_rates", ("GSTRates",), load)
+
+
+# ✅ Fetch Electric Duty Rates
+def get_electric_duty_rates():
+    def load():
+        conn = get_connection()
+        return pd.read_sql_query("SELECT * FROM ElectricDutyRates ORDER BY EffectiveDate DESC", conn)
+    return reference_cache.get("electric_duty_rates", ("ElectricDutyRates",), load)
+
+
+# ✅ Fetch Surcharge Rates
+def get_surcharge_rates():
+    return reference_cache.get("surcharge_rates", ("Surcharge", "SurchargeType"), _read_surcharge_rates)
+
+
+# ✅ Fetch Tariff Slabs
+def get_tariff_slabs():
+    def load():
+        conn = get_connection()
+        return pd.read_sql_query("""
+            SELECT * FROM TariffSlabs ORDER BY UserCategory, RateEffectiveDate DESC, MinUnits
+        """, conn)
+    return reference_cache.get("tariff_slabs", ("TariffSlabs",), load)
+
+
+def _read_surcharge_rates():
+    conn = get_connection()
+    query = """
+        SELECT 
+            Surcharge.SurchargeID,
+            SurchargeType.SurchargeTypeID,
+            Surcharge.RatePerUnit,
+            Surcharge.UnitsFrom,
+            Surcharge.UnitsTo,
+            Surcharge.EffectiveDate
+        FROM Surcharge
+        JOIN SurchargeType ON Surcharge.SurchargeTypeID = SurchargeType.SurchargeTypeID
+        ORDER BY Surcharge.EffectiveDate DESC
+    """
+    df = pd.read_sql_query(query, conn)
+    return df
+
+
+# ✅ Insert or Update GST Rate
+def upsert_gst_rate(value, effective_date):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO GSTRates (EffectiveDate, GST)
+        VALUES (?, ?)
+        ON CONFLICT(EffectiveDate) DO UPDATE SET GST = excluded.GST;
+    """, (effective_date, value))
+    conn.commit()
+    bump_table_version("GSTRates")
+
+
+# ✅ Insert or Update Electric Duty Rate
+def upsert_electric_duty_rate(value, effective_date):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO ElectricDutyRates (EffectiveDate, ElectricDuty)
+        VALUES (?, ?)
+        ON CONFLICT(EffectiveDate) DO UPDATE SET ElectricDuty = excluded.ElectricDuty;
+    """, (effective_date, value))
+    conn.commit()
+    bump_table_version("ElectricDutyRates")
+
+
+# ✅ Insert or Update Surcharge Rate
+def upsert_surcharge_rate(surcharge_type_id, rate_per_unit, units_from=None, units_to=None, effective_date=None):
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    # Default to today's date if not provided
+    if effective_date is None:
+        effective_date = datetime.today().strftime("%m/%d/%Y")
+
+    cursor.execute("""
+        INSERT INTO Surcharge (SurchargeTypeID, RatePerUnit, UnitsFrom, UnitsTo, EffectiveDate)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(SurchargeTypeID, EffectiveDate, UnitsFrom, UnitsTo) 
+        DO UPDATE SET RatePerUnit = excluded.RatePerUnit;
+    """, (surcharge_type_id, rate_per_unit, units_from, units_to, effective_date))
+
+    conn.commit()
+    bump_table_version("Surcharge")
+
+
+# ✅ Switch a tariff schedule between flat and progressive pricing
+def set_tariff_pricing_mode(user_category, effective_date, mode):
+    """
+    Set the PricingMode of every slab of one (UserCategory, RateEffectiveDate) schedule.
+
+    Returns:
+        int: Slabs updated.
+    """
+    if mode not in PRICING_MODES:
+        raise ValueError(f"PricingMode must be one of {', '.join(PRICING_MODES)}, not {mode!r}")
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE TariffSlabs SET PricingMode = ?
+        WHERE UserCategory = ? AND RateEffectiveDate = ?
+    """, (mode, user_category, effective_date))
+    conn.commit()
+    bump_table_version("TariffSlabs")
+    return cursor.rowcount
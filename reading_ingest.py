@@ -0,0 +1,507 @@
+# Description: Streaming meter-reading ingestion daemon. Does not import Streamlit.
+#
+#   python reading_ingest.py spool/readings.jsonl                          # tail a spool file
+#   python reading_ingest.py spool/readings.jsonl --listen 127.0.0.1:9009 --metrics-port 9100
+#   python reading_ingest.py spool/readings.jsonl --once                   # ingest what is there, exit
+#
+# Devices append one JSON object per line (FlatNo, BillingMonth, PresentReading,
+# optionally PersonID and ReadingDate) to the spool, or send them to --listen,
+# which appends them to the spool. Lines are grouped into micro-batches
+# of --batch-size lines or --max-wait seconds, whichever comes first. Each
+# batch goes through readings.import_readings: one lookup query resolves the
+# previous readings of its flats, and one BEGIN IMMEDIATE transaction inserts
+# the readings, records rejected lines in IngestRejects and moves the spool's
+# checkpoint in IngestOffsets. A restart resumes at the checkpoint, so no line
+# is lost or applied twice.
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+import sql_trace
+from db import get_connection, set_db_path, transaction
+from migrations import migrate
+from readings import OPTIONAL_COLUMNS, REQUIRED_COLUMNS, import_readings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+# Seconds the first line of a batch waits for the batch to fill
+DEFAULT_MAX_WAIT = 1.0
+# Seconds between spool polls when there is nothing new
+POLL_INTERVAL = 0.05
+# Batches read ahead of the writer; when full the spool is not read further
+DEFAULT_MAX_PENDING_BATCHES = 4
+# Uncommitted spool bytes at which --listen stops reading from devices
+DEFAULT_MAX_LAG_BYTES = 64 * 1024 * 1024
+# Longest accepted line
+MAX_LINE_BYTES = 64 * 1024
+# Seconds before retrying a batch whose transaction failed (e.g. the database stayed locked)
+RETRY_DELAY = 1.0
+# Window for the readings/s gauge
+THROUGHPUT_WINDOW = 60.0
+
+SpoolBatch = namedtuple("SpoolBatch", [
+    "file_id",     # Device/inode of the spool file the lines were read from
+    "lines",       # [(Position, raw line bytes), ...] in spool order
+    "end",         # Position just past the last line; the checkpoint after this batch
+    "first_seen",  # time.monotonic() when the first line was read
+])
+
+BatchResult = namedtuple("BatchResult", [
+    "inserted",  # Readings inserted
+    "rejected",  # Lines recorded in IngestRejects
+    "seconds",   # Time spent in the transaction
+])
+
+
+def _file_id(stat):
+    return f"{stat.st_dev}:{stat.st_ino}"
+
+
+def load_checkpoint(source, conn=None):
+    """(FileID, Position) committed for a spool, or (None, 0) if it was never ingested."""
+    row = (conn or get_connection()).execute(
+        "SELECT FileID, Position FROM IngestOffsets WHERE Source = ?", (source,)).fetchone()
+    return (row[0], row[1]) if row else (None, 0)
+
+
+@sql_trace.traced("ingest: batch")
+def commit_batch(source, batch, conn=None):
+    """
+    Insert a batch's readings and advance the spool checkpoint in one transaction.
+
+    Lines that are not JSON objects, and readings import_readings rejects, go
+    to IngestRejects with their spool position and reason.
+
+    Returns:
+        BatchResult
+    """
+    if conn is None:
+        conn = get_connection()
+    started = time.perf_counter()
+    rows, positions, rejects = [], [], []
+    for position, raw in batch.lines:
+        try:
+            reading = json.loads(raw)
+        except ValueError:
+            rejects.append((position, raw, "Invalid JSON"))
+            continue
+        if not isinstance(reading, dict):
+            rejects.append((position, raw, "Not a JSON object"))
+            continue
+        rows.append(reading)
+        positions.append((position, raw))
+
+    def checkpoint(conn, result=None):
+        if result is not None:
+            # import_readings numbers rows like CSV lines (header is line 1)
+            rejects.extend(positions[line - 2] + (reason,)
+                           for line, reason in zip(result.rejected["Line"], result.rejected["Reason"]))
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        conn.executemany("""
+            INSERT INTO IngestRejects (Source, Position, Line, Reason, RejectedAt) VALUES (?, ?, ?, ?, ?)
+        """, [(source, position, raw.decode("utf-8", "replace").rstrip("\r\n"), reason, now)
+              for position, raw, reason in rejects])
+        conn.execute("""
+            INSERT INTO IngestOffsets (Source, FileID, Position, UpdatedAt) VALUES (?, ?, ?, ?)
+            ON CONFLICT (Source) DO UPDATE
+                SET FileID = excluded.FileID, Position = excluded.Position, UpdatedAt = excluded.UpdatedAt
+        """, (source, batch.file_id, batch.end, now))
+
+    inserted = 0
+    if rows:
+        result = import_readings(pd.DataFrame(rows, columns=list(REQUIRED_COLUMNS + OPTIONAL_COLUMNS)),
+                                 conn=conn, before_commit=checkpoint)
+        inserted = len(result.inserted)
+    else:
+        with transaction(conn):
+            checkpoint(conn)
+    return BatchResult(inserted, len(rejects), time.perf_counter() - started)
+
+
+class SpoolReader:
+    """
+    Complete lines of an append-only spool file, from a position onwards.
+
+    A trailing line without its newline is left for the next read. If the
+    file is truncated reading restarts at 0; follow_rotation() moves to a new
+    file created in its place.
+    """
+
+    def __init__(self, path, file_id=None, position=0):
+        self.path = path
+        self._file = None
+        self.file_id = None
+        self.position = 0
+        self._resume = (file_id, position)
+
+    def _open(self):
+        try:
+            self._file = open(self.path, "rb")
+        except FileNotFoundError:
+            return False
+        self.file_id = _file_id(os.fstat(self._file.fileno()))
+        file_id, position = self._resume
+        # A checkpoint only applies to the file it was taken on
+        self.position = position if file_id == self.file_id else 0
+        self._resume = (None, 0)
+        return True
+
+    def read_lines(self, max_lines):
+        """Up to max_lines (Position, raw line) tuples; [] when nothing complete is available."""
+        if self._file is None and not self._open():
+            return []
+        size = os.fstat(self._file.fileno()).st_size
+        if size < self.position:
+            logger.warning("%s was truncated to %d bytes; reading from the start", self.path, size)
+            self.position = 0
+
+        self._file.seek(self.position)
+        lines = []
+        while len(lines) < max_lines:
+            raw = self._file.readline(MAX_LINE_BYTES + 1)
+            if not raw.endswith(b"\n"):
+                if len(raw) > MAX_LINE_BYTES:
+                    # Keep it, newline or not, so an oversized line cannot stall the spool
+                    lines.append((self.position, raw))
+                    self.position += len(raw)
+                    continue
+                break
+            if raw.strip():
+                lines.append((self.position, raw))
+            self.position += len(raw)
+        return lines
+
+    def follow_rotation(self):
+        """Switch to a file that replaced the spool path; call only once the current one is exhausted."""
+        if self._file is None:
+            return
+        try:
+            current = _file_id(os.stat(self.path))
+        except FileNotFoundError:
+            return
+        if current != self.file_id:
+            logger.info("%s was replaced; reading the new file", self.path)
+            self._file.close()
+            self._file = None
+            self._open()
+
+    def size(self):
+        return os.fstat(self._file.fileno()).st_size if self._file is not None else 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class IngestMetrics:
+    """Counters and gauges of one daemon, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.batches = 0
+        self.inserted = 0
+        self.rejected = 0
+        self.commit_seconds = 0.0
+        self.committed_position = 0
+        self.spool_size = 0
+        self.oldest_pending = None
+        self.pending_batches = 0
+        self.backpressure_pauses = 0
+        self._recent = deque()
+
+    def record_batch(self, batch, result):
+        self.batches += 1
+        self.inserted += result.inserted
+        self.rejected += result.rejected
+        self.commit_seconds += result.seconds
+        self.committed_position = batch.end
+        now = time.monotonic()
+        self._recent.append((now, len(batch.lines)))
+        while self._recent and self._recent[0][0] < now - THROUGHPUT_WINDOW:
+            self._recent.popleft()
+
+    def throughput(self):
+        """Lines committed per second over the last THROUGHPUT_WINDOW seconds."""
+        window = min(THROUGHPUT_WINDOW, time.monotonic() - self.started) or 1.0
+        return sum(lines for _, lines in self._recent) / window
+
+    def lag_bytes(self):
+        return max(self.spool_size - self.committed_position, 0)
+
+    def lag_seconds(self):
+        """Age of the oldest line read but not yet committed."""
+        return time.monotonic() - self.oldest_pending if self.oldest_pending is not None else 0.0
+
+    def summary(self):
+        return (f"{self.inserted} inserted, {self.rejected} rejected in {self.batches} batches; "
+                f"{self.throughput():.0f} lines/s, lag {self.lag_bytes()} bytes / {self.lag_seconds():.1f} s")
+
+    def render(self):
+        metrics = [
+            ("ingest_batches_total", "counter", "Batches committed", self.batches),
+            ("ingest_readings_inserted_total", "counter", "Readings inserted", self.inserted),
+            ("ingest_lines_rejected_total", "counter", "Lines recorded in IngestRejects", self.rejected),
+            ("ingest_commit_seconds_total", "counter", "Time spent committing batches", self.commit_seconds),
+            ("ingest_backpressure_pauses_total", "counter", "Times --listen stopped reading devices",
+             self.backpressure_pauses),
+            ("ingest_throughput_lines_per_second", "gauge", f"Lines committed per second over {THROUGHPUT_WINDOW:.0f} s",
+             self.throughput()),
+            ("ingest_lag_bytes", "gauge", "Spool bytes not yet committed", self.lag_bytes()),
+            ("ingest_lag_seconds", "gauge", "Age of the oldest uncommitted line read", self.lag_seconds()),
+            ("ingest_pending_batches", "gauge", "Batches waiting for the writer", self.pending_batches),
+            ("ingest_committed_position_bytes", "gauge", "Spool checkpoint", self.committed_position),
+        ]
+        return "".join(f"# HELP {name} {help_text}\n# TYPE {name} {kind}\n{name} {value}\n"
+                       for name, kind, help_text, value in metrics)
+
+
+class Ingestor:
+    """
+    Spool tailer and single writer, connected by a bounded queue of batches.
+
+    When the writer falls behind the queue fills, the tailer stops reading
+    the spool, and lag_bytes grows until --listen stops reading devices.
+    """
+
+    def __init__(self, spool_path, batch_size=DEFAULT_BATCH_SIZE, max_wait=DEFAULT_MAX_WAIT,
+                 max_pending_batches=DEFAULT_MAX_PENDING_BATCHES, max_lag_bytes=DEFAULT_MAX_LAG_BYTES):
+        self.source = os.path.abspath(spool_path)
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.max_lag_bytes = max_lag_bytes
+        self.metrics = IngestMetrics()
+        self._batches = asyncio.Queue(maxsize=max_pending_batches)
+        # One writer thread: batches commit in spool order
+        self._writer_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-writer")
+        self._reader_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-reader")
+        self._room = asyncio.Event()
+        self._room.set()
+        # first_seen of every batch being filled, queued or written, oldest first
+        self._unfinished = deque()
+        self._reader = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        file_id, position = await loop.run_in_executor(self._writer_pool, load_checkpoint, self.source)
+        self._reader = SpoolReader(self.source, file_id, position)
+        self.metrics.committed_position = position
+
+    def close(self):
+        self._writer_pool.shutdown(wait=True)
+        self._reader_pool.shutdown(wait=True)
+        if self._reader is not None:
+            self._reader.close()
+
+    def _update_lag(self):
+        self.metrics.spool_size = self._reader.size()
+        self.metrics.pending_batches = self._batches.qsize()
+        self._check_room()
+
+    def appended(self, size):
+        """Account for bytes a producer just appended, so backpressure does not wait for the next poll."""
+        self.metrics.spool_size += size
+        self._check_room()
+
+    def _check_room(self):
+        if self.metrics.lag_bytes() > self.max_lag_bytes:
+            self._room.clear()
+        else:
+            self._room.set()
+
+    async def wait_for_room(self):
+        """Block producers while the spool is more than max_lag_bytes ahead of the checkpoint."""
+        if not self._room.is_set():
+            self.metrics.backpressure_pauses += 1
+            await self._room.wait()
+
+    async def tail(self, once=False):
+        """Read the spool into batches; with once, stop at the end of the spool."""
+        loop = asyncio.get_running_loop()
+        pending, first_seen = [], None
+        while True:
+            lines = await loop.run_in_executor(self._reader_pool, self._reader.read_lines,
+                                               self.batch_size - len(pending))
+            now = time.monotonic()
+            if lines and not pending:
+                first_seen = now
+                self._unfinished.append(now)
+                self.metrics.oldest_pending = self._unfinished[0]
+            pending += lines
+            self._update_lag()
+
+            drained = not lines
+            if pending and (len(pending) >= self.batch_size or now - first_seen >= self.max_wait
+                            or (once and drained)):
+                batch = SpoolBatch(self._reader.file_id, pending, self._reader.position, first_seen)
+                pending = []
+                # Waits here while the writer is max_pending_batches behind
+                await self._batches.put(batch)
+            elif drained:
+                if once:
+                    await self._batches.put(None)
+                    return
+                if not pending:
+                    # Between batches, so a batch never spans two files
+                    await loop.run_in_executor(self._reader_pool, self._reader.follow_rotation)
+                await asyncio.sleep(POLL_INTERVAL)
+
+    async def write(self):
+        """Commit batches in order until tail(once=True) signals the end."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._batches.get()
+            if batch is None:
+                return
+            while True:
+                try:
+                    result = await loop.run_in_executor(self._writer_pool, commit_batch, self.source, batch)
+                    break
+                except sqlite3.OperationalError as e:
+                    logger.warning("Batch up to %d failed (%s); retrying", batch.end, e)
+                    await asyncio.sleep(RETRY_DELAY)
+            self.metrics.record_batch(batch, result)
+            self._unfinished.popleft()
+            self.metrics.oldest_pending = self._unfinished[0] if self._unfinished else None
+            self._update_lag()
+            logger.info("Committed %d lines up to %d (%d inserted, %d rejected) in %.1f ms",
+                        len(batch.lines), batch.end, result.inserted, result.rejected, result.seconds * 1000)
+
+    async def run(self, once=False):
+        await asyncio.gather(self.tail(once), self.write())
+
+
+async def serve_listener(ingestor, address):
+    """
+    Accept JSON lines on a TCP "HOST:PORT" or a Unix socket path and append them to the spool.
+
+    Devices are read only while the ingestor has room, so a writer that
+    falls behind slows them through TCP flow control instead of growing the
+    spool without bound. An unterminated last line is dropped.
+    """
+    spool = open(ingestor.source, "ab")
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                await ingestor.wait_for_room()
+                try:
+                    line = await reader.readuntil(b"\n")
+                except asyncio.IncompleteReadError:
+                    break
+                except asyncio.LimitOverrunError:
+                    logger.warning("Dropping a connection that sent a line over %d bytes", MAX_LINE_BYTES)
+                    break
+                if line.strip():
+                    spool.write(line)
+                    spool.flush()
+                    ingestor.appended(len(line))
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    if ":" in address and "/" not in address:
+        host, port = address.rsplit(":", 1)
+        server = await asyncio.start_server(handle, host, int(port), limit=MAX_LINE_BYTES)
+    else:
+        server = await asyncio.start_unix_server(handle, address, limit=MAX_LINE_BYTES)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        spool.close()
+
+
+async def serve_metrics(metrics, port, host="127.0.0.1"):
+    """Answer every HTTP request on host:port with metrics.render()."""
+
+    async def handle(reader, writer):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = metrics.render().encode()
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         b"Content-Length: " + str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+async def report(metrics, interval):
+    while True:
+        await asyncio.sleep(interval)
+        print(metrics.summary(), flush=True)
+
+
+async def run(args):
+    ingestor = Ingestor(args.spool, args.batch_size, args.max_wait, args.max_pending_batches, args.max_lag_bytes)
+    await ingestor.start()
+    print(f"Ingesting {ingestor.source} from byte {ingestor.metrics.committed_position}", flush=True)
+    tasks = []
+    if not args.once:
+        if args.listen:
+            tasks.append(asyncio.create_task(serve_listener(ingestor, args.listen)))
+        if args.metrics_port:
+            tasks.append(asyncio.create_task(serve_metrics(ingestor.metrics, args.metrics_port)))
+        if args.report_every:
+            tasks.append(asyncio.create_task(report(ingestor.metrics, args.report_every)))
+    try:
+        await ingestor.run(once=args.once)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        ingestor.close()
+        print(ingestor.metrics.summary(), flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest a spool of JSON-line meter readings in micro-batches.")
+    parser.add_argument("spool", help="Spool file, one JSON reading per line (created by --listen if missing)")
+    parser.add_argument("--db", help="Database file (default: BILLING_DB_PATH or billing_system.db)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"Most lines per transaction (default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--max-wait", type=float, default=DEFAULT_MAX_WAIT,
+                        help=f"Seconds a line waits for its batch to fill (default: {DEFAULT_MAX_WAIT})")
+    parser.add_argument("--max-pending-batches", type=int, default=DEFAULT_MAX_PENDING_BATCHES,
+                        help=f"Batches read ahead of the writer (default: {DEFAULT_MAX_PENDING_BATCHES})")
+    parser.add_argument("--max-lag-bytes", type=int, default=DEFAULT_MAX_LAG_BYTES,
+                        help="Uncommitted spool bytes at which --listen stops reading devices "
+                             f"(default: {DEFAULT_MAX_LAG_BYTES})")
+    parser.add_argument("--listen", help='Also accept lines on "HOST:PORT" or a Unix socket path')
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on 127.0.0.1:PORT")
+    parser.add_argument("--report-every", type=float, default=10.0,
+                        help="Print throughput and lag every N seconds, 0 to disable (default: 10)")
+    parser.add_argument("--once", action="store_true", help="Ingest the spool up to its current end and exit")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=os.environ.get("BILLING_LOG_LEVEL", "WARNING").upper(),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if args.db:
+        set_db_path(args.db)
+    migrate()
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
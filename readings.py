@@ -0,0 +1,185 @@
+# Description: Bulk meter-reading import.
+# A whole CSV is validated with vectorized checks against three lookups
+# (flats, the supplied PersonIDs and existing readings) and inserted inside a single
+# BEGIN IMMEDIATE transaction: one executemany into a temp staging table,
+# then one INSERT ... SELECT so the FTS5 sync trigger flushes once.
+import json
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from db import bump_table_version, get_connection, transaction
+
+REQUIRED_COLUMNS = ("FlatNo", "BillingMonth", "PresentReading")
+OPTIONAL_COLUMNS = ("PersonID", "ReadingDate")
+
+# inserted: accepted rows with PreviousReading / PersonID filled in;
+# rejected: offending input rows with the CSV line number and a Reason
+ImportResult = namedtuple("ImportResult", ["inserted", "rejected"])
+
+
+def _month_number(months):
+    """'YYYY-MM' -> year * 12 + month (NaN where unparseable), for ordering months numerically."""
+    months = months.fillna("").astype(str)
+    valid = months.str.fullmatch(r"\d{4}-(0[1-9]|1[0-2])")
+    number = (pd.to_numeric(months.str.slice(0, 4), errors="coerce") * 12
+              + pd.to_numeric(months.str.slice(5, 7), errors="coerce"))
+    return number.where(valid.fillna(False).astype(bool))
+
+
+def _read(source):
+    if isinstance(source, pd.DataFrame):
+        df = source.copy()
+    else:
+        df = pd.read_csv(source, dtype=str, keep_default_na=False)
+    df.columns = [str(column).strip() for column in df.columns]
+    missing = [column for column in REQUIRED_COLUMNS if column not in df.columns]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}")
+    for column in OPTIONAL_COLUMNS:
+        if column not in df.columns:
+            df[column] = ""
+
+    df = df[list(REQUIRED_COLUMNS + OPTIONAL_COLUMNS)].reset_index(drop=True)
+    for column in ("FlatNo", "BillingMonth", "PersonID", "ReadingDate"):
+        df[column] = df[column].fillna("").astype(str).str.strip()
+    df["PresentReading"] = pd.to_numeric(df["PresentReading"], errors="coerce")
+    # Header is line 1
+    df.insert(0, "Line", np.arange(len(df)) + 2)
+    return df
+
+
+def _lookup(conn, flats, person_ids, max_month):
+    """Flat -> default PersonID, supplied PersonID -> its flat, and every existing
+    reading of those flats up to max_month."""
+    flats_json = json.dumps(flats)
+    flat_users = pd.read_sql_query("""
+        SELECT f.FlatNo,
+               (SELECT u.PersonID FROM Users u WHERE u.FlatNo = f.FlatNo ORDER BY u.PersonID LIMIT 1) AS DefaultPersonID
+        FROM Flats f
+        WHERE f.FlatNo IN (SELECT value FROM json_each(?))
+    """, conn, params=(flats_json,))
+    users = pd.read_sql_query("""
+        SELECT PersonID, FlatNo AS UserFlatNo
+        FROM Users
+        WHERE PersonID IN (SELECT value FROM json_each(?))
+    """, conn, params=(json.dumps(person_ids),))
+    existing = pd.read_sql_query("""
+        SELECT FlatNo, BillingMonth, PresentReading
+        FROM BillingReadings
+        WHERE FlatNo IN (SELECT value FROM json_each(?)) AND BillingMonth <= ?
+    """, conn, params=(flats_json, max_month))
+    return flat_users, users, existing
+
+
+def _reject(mask, reason, reasons):
+    """Record reason for rows in mask that have not been rejected already."""
+    reasons[mask & reasons.isna()] = reason
+
+
+def import_readings(source, dry_run=False, conn=None, before_commit=None):
+    """
+    Validate and insert a batch of meter readings.
+
+    The previous reading of each row is the latest earlier reading of the
+    flat, taken from the database or from an earlier month in the same file.
+
+    Args:
+        source: CSV path / file object, or a DataFrame, with FlatNo,
+            BillingMonth ("YYYY-MM") and PresentReading columns; PersonID
+            and ReadingDate are optional.
+        dry_run (bool): Validate only, write nothing.
+        before_commit (callable, optional): Called as before_commit(conn, result)
+            inside the transaction after the insert, so whatever it writes
+            (e.g. a stream offset) commits or rolls back with the readings.
+            Not called on a dry run.
+
+    Returns:
+        ImportResult: (inserted, rejected) DataFrames.
+    """
+    if conn is None:
+        conn = get_connection()
+    df = _read(source)
+    reasons = pd.Series(np.nan, index=df.index, dtype=object)
+
+    month_number = _month_number(df["BillingMonth"])
+    _reject(df["FlatNo"] == "", "Missing FlatNo", reasons)
+    _reject(month_number.isna(), "BillingMonth must be YYYY-MM", reasons)
+    _reject(df["PresentReading"].isna(), "PresentReading is not a number", reasons)
+    _reject(df["PresentReading"] < 0, "PresentReading is negative", reasons)
+    _reject(df.duplicated(["FlatNo", "BillingMonth"], keep="first"),
+            "Duplicate FlatNo/BillingMonth in file", reasons)
+
+    with transaction(conn):
+        candidates = df[reasons.isna()]
+        flats = sorted(candidates["FlatNo"].unique().tolist())
+        person_ids = sorted(set(candidates["PersonID"].unique().tolist()) - {""})
+        max_month = candidates["BillingMonth"].max() if len(candidates) else ""
+        flat_users, users, existing = _lookup(conn, flats, person_ids, max_month)
+
+        df["DefaultPersonID"] = df["FlatNo"].map(flat_users.set_index("FlatNo")["DefaultPersonID"])
+        _reject(~df["FlatNo"].isin(flat_users["FlatNo"]), "Unknown FlatNo", reasons)
+        supplied = df["PersonID"] != ""
+        user_flat = df["PersonID"].map(users.set_index("PersonID")["UserFlatNo"])
+        _reject(supplied & ~df["PersonID"].isin(users["PersonID"]), "Unknown PersonID", reasons)
+        _reject(supplied & (user_flat != df["FlatNo"]), "PersonID does not belong to this FlatNo", reasons)
+
+        already = df[["FlatNo", "BillingMonth"]].merge(
+            existing[["FlatNo", "BillingMonth"]].drop_duplicates().assign(Exists=True),
+            on=["FlatNo", "BillingMonth"], how="left",
+        )["Exists"].notna().to_numpy()
+        _reject(pd.Series(already, index=df.index), "Reading already exists for this flat and month", reasons)
+
+        # Previous reading: latest earlier month per flat across the database and the accepted rows
+        accepted = df[reasons.isna()].assign(MonthNumber=month_number[reasons.isna()])
+        history = pd.concat([
+            existing.assign(MonthNumber=_month_number(existing["BillingMonth"])),
+            accepted[["FlatNo", "BillingMonth", "PresentReading", "MonthNumber"]],
+        ], ignore_index=True).dropna(subset=["MonthNumber"])
+        # merge_asof needs identical key dtypes; pandas string vs sqlite object columns differ
+        previous = pd.merge_asof(
+            accepted[["Line", "FlatNo", "MonthNumber"]].astype({"FlatNo": object}).sort_values("MonthNumber"),
+            history.rename(columns={"PresentReading": "PreviousReading"})[["FlatNo", "MonthNumber", "PreviousReading"]]
+                   .astype({"FlatNo": object}).sort_values("MonthNumber"),
+            on="MonthNumber", by="FlatNo", allow_exact_matches=False, direction="backward",
+        ).set_index("Line")["PreviousReading"]
+        df["PreviousReading"] = df["Line"].map(previous).fillna(0.0)
+
+        _reject(df["PresentReading"] < df["PreviousReading"], "PresentReading is below the previous reading", reasons)
+
+        ok = reasons.isna()
+        inserted = df[ok].copy()
+        inserted["PersonID"] = inserted["PersonID"].where(inserted["PersonID"] != "", inserted["DefaultPersonID"])
+        inserted["ReadingDate"] = inserted["ReadingDate"].where(inserted["ReadingDate"] != "",
+                                                                datetime.today().strftime("%Y-%m-%d"))
+        inserted = inserted[["Line", "FlatNo", "PersonID", "BillingMonth", "ReadingDate",
+                             "PreviousReading", "PresentReading"]].reset_index(drop=True)
+
+        if not dry_run and not inserted.empty:
+            rows = inserted[["FlatNo", "PersonID", "BillingMonth", "ReadingDate", "PreviousReading", "PresentReading"]]
+            rows = rows.astype(object).where(rows.notna(), None)
+            conn.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS ReadingImport (
+                    FlatNo, PersonID, BillingMonth, ReadingDate, PreviousReading, PresentReading
+                )
+            """)
+            conn.execute("DELETE FROM temp.ReadingImport")
+            conn.executemany("INSERT INTO temp.ReadingImport VALUES (?, ?, ?, ?, ?, ?)",
+                             rows.itertuples(index=False, name=None))
+            conn.execute("""
+                INSERT INTO BillingReadings (FlatNo, PersonID, BillingMonth, ReadingDate, PreviousReading, PresentReading)
+                SELECT FlatNo, PersonID, BillingMonth, ReadingDate, PreviousReading, PresentReading
+                FROM temp.ReadingImport ORDER BY rowid
+            """)
+            conn.execute("DELETE FROM temp.ReadingImport")
+
+        rejected = df[~ok][["Line", "FlatNo", "BillingMonth", "PresentReading"]].assign(Reason=reasons[~ok])
+        result = ImportResult(inserted, rejected.reset_index(drop=True))
+        if before_commit is not None and not dry_run:
+            before_commit(conn, result)
+
+    if not dry_run and not inserted.empty:
+        bump_table_version("BillingReadings")
+    return result
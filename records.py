@@ -0,0 +1,475 @@
+# Description: Database access for users, meter readings, bills and surcharge mappings.
+import json
+import logging
+from collections import namedtuple
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+
+import billing_engine
+from db import bump_table_version, data_version, get_connection, table_version, transaction
+from ref_cache import REFERENCE_TABLES, reference_cache
+
+logger = logging.getLogger(__name__)
+
+
+# Fetch table data 
+def get_table_data(table_name):
+    if table_name in REFERENCE_TABLES:
+        return reference_cache.get(f"table:{table_name}", (table_name,),
+                                   lambda: _read_table(table_name))
+    return _read_table(table_name)
+
+
+def _read_table(table_name):
+    conn = get_connection()
+    df = pd.read_sql_query(f"SELECT * FROM {table_name}", conn)
+    return df
+
+
+# Insert user data 
+def insert_user(person_id, name, flat_no, user_type, load_sanctioned, phase):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO Users (PersonID, Name, FlatNo, UserType, LoadSanctioned, Phase)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (person_id, name, flat_no, user_type, load_sanctioned, phase))
+    conn.commit()
+    bump_table_version("Users")
+
+
+# Update user data 
+def update_user(person_id, name, flat_no, user_type, load_sanctioned, phase):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE Users SET Name=?, FlatNo=?, UserType=?, LoadSanctioned=?, Phase=?
+        WHERE PersonID=?
+    """, (name, flat_no, user_type, load_sanctioned, phase, person_id))
+    conn.commit()
+    bump_table_version("Users")
+
+
+# Delete user data 
+def delete_user(person_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM Users WHERE PersonID=?", (person_id,))
+    conn.commit()
+    bump_table_version("Users")
+
+
+def get_previous_billing_months(cursor, flat_no, billing_month):
+    cursor.execute("""
+        SELECT DISTINCT BillingMonth 
+        FROM BillingReadings 
+        WHERE FlatNo = ? 
+        ORDER BY BillingMonth DESC
+    """, (flat_no,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def get_surcharge_types(cursor):
+    cursor.execute("SELECT SurchargeTypeID, TypeName FROM SurchargeType")
+    return {row[0]: row[1] for row in cursor.fetchall()}
+
+
+def get_units_adjusted(cursor, flat_no, month):
+
+    query = """
+        SELECT UnitsConsumed FROM BillingCharges bc
+        JOIN BillingReadings br ON bc.ReadingID = br.ReadingID
+        WHERE br.FlatNo = ? AND br.BillingMonth = ?
+    """
+    cursor.execute(query, (flat_no, month))
+    result = cursor.fetchone()[0]
+    return result if result else 0
+
+
+def get_surcharge_amount(cursor, flat_no, month, surcharge_types):
+    if not surcharge_types:
+        return 0
+    placeholders = ",".join(["?"] * len(surcharge_types))
+    query = f"""
+        SELECT SUM(rsm.SurchargeAmount) 
+        FROM ReadingSurchargeMapping rsm
+        JOIN BillingReadings br ON rsm.ReadingID = br.ReadingID
+        WHERE br.FlatNo = ? AND rsm.BillingMonth = ? AND rsm.SurchargeID IN ({placeholders})
+    """
+    cursor.execute(query, (flat_no, month, *surcharge_types))
+    result = cursor.fetchone()[0]
+    return result if result else 0
+
+
+def replace_surcharge_mappings(cursor, reading_id, billing_month, mappings):
+    """
+    Make ``mappings`` the complete set of surcharge rows of one reading.
+
+    Rows of the reading that are not in ``mappings`` (a surcharge that was
+    deselected) are deleted. A row with the same (ReadingID, SurchargeID,
+    BillingMonth, AdjustedBillingMonth) gets the new SurchargeAmount; its
+    AdjustmentReason is kept unless a new one is given. Does not commit, so
+    the caller writes the surcharges in the same transaction as the bill.
+
+    Args:
+        cursor: Cursor of the connection holding the bill's transaction.
+        reading_id (int): ReadingID the surcharges belong to.
+        billing_month (str): Billing month of the reading ("YYYY-MM").
+        mappings (iterable): (surcharge_id, adjusted_billing_month, surcharge_amount)
+            or (..., adjustment_reason) tuples; adjusted_billing_month equals
+            billing_month for the current month's surcharges.
+
+    Returns:
+        int: Number of rows written.
+    """
+    reading_id = int(reading_id)
+    rows = []
+    for surcharge_id, adjusted_billing_month, surcharge_amount, *reason in mappings:
+        # numpy scalars from the rate DataFrames are not valid sqlite3 parameters
+        rows.append((reading_id, int(surcharge_id), billing_month, adjusted_billing_month,
+                     float(surcharge_amount), reason[0] if reason else None))
+    keep = {row[1:4] for row in rows}
+    stale = [(reading_id, *key) for key in cursor.execute("""
+        SELECT SurchargeID, BillingMonth, AdjustedBillingMonth
+        FROM ReadingSurchargeMapping WHERE ReadingID = ?
+    """, (reading_id,)).fetchall() if tuple(key) not in keep]
+    cursor.executemany("""
+        DELETE FROM ReadingSurchargeMapping
+        WHERE ReadingID = ? AND SurchargeID = ? AND BillingMonth = ? AND AdjustedBillingMonth = ?
+    """, stale)
+    cursor.executemany("""
+        INSERT INTO ReadingSurchargeMapping (
+            ReadingID, SurchargeID, BillingMonth, AdjustedBillingMonth, SurchargeAmount, AdjustmentReason
+        ) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (ReadingID, SurchargeID, BillingMonth, AdjustedBillingMonth)
+        DO UPDATE SET
+            SurchargeAmount = excluded.SurchargeAmount,
+            AdjustmentReason = COALESCE(excluded.AdjustmentReason, ReadingSurchargeMapping.AdjustmentReason)
+    """, rows)
+    return len(rows)
+
+
+def save_surcharge_mappings(reading_id, billing_month, mappings, conn=None):
+    """
+    Replace the surcharge rows of one reading in a transaction of their own.
+
+    insert_bill() and update_bill() take the mappings themselves and write
+    them with the bill; use this only to change surcharges without a bill.
+    See replace_surcharge_mappings() for the arguments. Errors are raised to
+    the caller.
+
+    Returns:
+        int: Number of rows written.
+    """
+    with transaction(conn) as conn:
+        written = replace_surcharge_mappings(conn.cursor(), reading_id, billing_month, mappings)
+    bump_table_version("ReadingSurchargeMapping")
+    return written
+
+
+def insert_or_update_readingsurchargemapping(reading_id, surcharge_id, billing_month, adjusted_billing_month, surcharge_amount, adjustment_reason=None):
+    """
+    Inserts or updates one row of the ReadingSurchargeMapping table.
+
+    Prefer save_surcharge_mappings() to write all of a reading's surcharges at once.
+
+    Parameters:
+        reading_id (int): Foreign key referencing BillingReadings.
+        surcharge_id (int): Foreign key referencing Surcharge.
+        billing_month (str): The current billing month (YYYY-MM format).
+        adjusted_billing_month (str): The previous billing month being adjusted (YYYY-MM format).
+        surcharge_amount (float): The surcharge amount (must be >= 0).
+        adjustment_reason (str, optional): Reason for adjustment (default is None).
+
+    Returns:
+        str: Success message; database errors are raised.
+    """
+    save_surcharge_mappings(reading_id, billing_month,
+                            [(surcharge_id, adjusted_billing_month, surcharge_amount, adjustment_reason)])
+    return "✅ Insert/Update successful!"
+
+
+def insert_reading(cursor, conn, flat_no, previous_reading, present_reading, billing_month=None, person_id=None):
+    cursor.execute("""
+        INSERT INTO BillingReadings (FlatNo, PersonID, BillingMonth, ReadingDate, PreviousReading, PresentReading)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (flat_no, person_id, billing_month, datetime.today().strftime("%Y-%m-%d"), previous_reading, present_reading))
+    conn.commit()
+    bump_table_version("BillingReadings")
+    return cursor.lastrowid  # Return the correct reading ID
+
+
+def fetch_complete_bill(flat_no, month):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT br.ReadingID, br.PreviousReading, br.PresentReading, br.UnitsConsumed, br.UnitsAdjusted, 
+               bc.BillID, bc.RatePerUnit, bc.VariableCharges, ac.ElectricDuty, ac.GST, 
+               sdg.MonthSurcharge,sdg.AdjustedSurcharge
+        FROM BillingReadings br
+        JOIN BillingCharges bc ON br.ReadingID = bc.ReadingID
+        JOIN SurchargeGSTDuty sdg ON br.ReadingID=sdg.ReadingID
+        JOIN AdditionalCharges ac ON  br.ReadingID=ac.ReadingID
+        WHERE br.FlatNo = ? AND br.BillingMonth = ?
+        """, 
+        (flat_no, month)
+    )
+    bill_data = cursor.fetchone()
+    return bill_data
+
+
+def update_billing_readings(cursor, flat_no, month, present_reading, previous_reading):
+    cursor.execute("""
+        UPDATE BillingReadings 
+        SET PresentReading=?, PreviousReading=? 
+        WHERE FlatNo=? AND BillingMonth=?
+    """, (present_reading, previous_reading, flat_no, month))
+
+
+def update_billing_charges(cursor,bill_id,reading_id, rate_per_unit, variable_charges, total_additional_charges, total_surcharge, net_payable_amount):
+    cursor.execute("""
+        UPDATE BillingCharges 
+        SET RatePerUnit=?, VariableCharges=?, TotalAdditionalCharges=?, TotalSurcharge=?, NetPayableAmount=?
+        WHERE ReadingID=? AND BillID=?
+    """, (rate_per_unit, variable_charges, total_additional_charges, total_surcharge, net_payable_amount, reading_id,bill_id))
+
+
+def update_additional_charges(cursor, reading_id, gst_id, electric_duty_id, gst_amount, electric_duty_amount):
+    cursor.execute("""
+        UPDATE AdditionalCharges
+        SET GSTID=?, ElectricDutyID=?, GST=?, ElectricDuty=?
+        WHERE ReadingID=?
+    """, (gst_id, electric_duty_id, gst_amount, electric_duty_amount, reading_id))
+
+
+def update_surcharge_gst_duty(cursor, reading_id, month_surcharge, adjusted_surcharge, total_surcharge,
+                              gst_id, electric_duty_id, gst_amount, electric_duty_amount):
+    cursor.execute("""
+        UPDATE SurchargeGSTDuty
+        SET MonthSurcharge=?, AdjustedSurcharge=?, TotalSurcharge=?, GSTID=?, ElectricDutyID=?,
+            GSTAmount=?, ElectricDutyAmount=?
+        WHERE ReadingID=?
+    """, (month_surcharge, adjusted_surcharge, total_surcharge, gst_id, electric_duty_id,
+          gst_amount, electric_duty_amount, reading_id))
+
+
+def fetch_surcharge_mapping(cursor, reading_id, billing_month):
+    """
+    Fetch surcharge mappings from the ReadingSurchargeMapping table filtered by ReadingID and BillingMonth.
+    
+    Args:
+        db_path (str): Path to SQLite database.
+        reading_id (int): Filter by specific ReadingID.
+        billing_month (str): Filter by specific BillingMonth (Format: 'YYYY-MM-DD').
+    
+    Returns:
+        list: List of tuples containing surcharge mapping records.
+    """
+    
+   
+    query = """
+        SELECT 
+          rsm.SurchargeID, sr.SurchargeTypeID, S.TypeName, sr.RatePerUnit, 
+          rsm.AdjustedBillingMonth, rsm.SurchargeAmount, rsm.AdjustmentReason, sr.EffectiveDate
+        FROM ReadingSurchargeMapping rsm
+        LEFT JOIN Surcharge sr ON rsm.SurchargeID = sr.SurchargeID
+        LEFT JOIN SurchargeType S ON sr.SurchargeTypeID = S.SurchargeTypeID
+        WHERE rsm.ReadingID = ? AND rsm.BillingMonth = ?
+
+       """
+    
+    cursor.execute(query, (reading_id, billing_month))
+    results = cursor.fetchall()
+    logger.debug("Fetched surcharge data for reading %s, %s: %s", reading_id, billing_month, results)
+    return results
+
+
+# Tables a bill snapshot is read from; every write path bumps their table_version
+BILL_TABLES = ("BillingReadings", "BillingCharges", "AdditionalCharges", "SurchargeGSTDuty",
+               "ReadingSurchargeMapping", "Users", "Surcharge", "SurchargeType")
+
+# One ReadingSurchargeMapping row of a bill; adjusted_units is the UnitsConsumed of the
+# flat's billed reading for adjusted_billing_month (0 when that month has no bill)
+SurchargeLine = namedtuple("SurchargeLine", [
+    "surcharge_id", "surcharge_type_id", "type_name", "rate_per_unit", "adjusted_billing_month",
+    "surcharge_amount", "adjustment_reason", "effective_date", "adjusted_units",
+])
+
+# Everything the Update/Delete Bill Record page shows for one (FlatNo, BillingMonth).
+# The charge fields are None when the reading has not been billed yet; users are the
+# (PersonID, Name) pairs of the flat and surcharges a tuple of SurchargeLine.
+BillSnapshot = namedtuple("BillSnapshot", [
+    "reading_id", "flat_no", "billing_month", "person_id", "previous_reading", "present_reading",
+    "units_consumed", "units_adjusted", "bill_id", "rate_per_unit", "variable_charges", "electric_duty", "gst",
+    "month_surcharge", "adjusted_surcharge", "total_additional_charges", "total_surcharge",
+    "net_payable_amount", "status", "users", "surcharges",
+])
+
+BILL_SNAPSHOT_QUERY = """
+    SELECT br.ReadingID, br.FlatNo, br.BillingMonth, br.PersonID, br.PreviousReading, br.PresentReading,
+           br.UnitsConsumed, br.UnitsAdjusted, bc.BillID, bc.RatePerUnit, bc.VariableCharges,
+           ac.ElectricDuty, ac.GST, sgd.MonthSurcharge, sgd.AdjustedSurcharge,
+           bc.TotalAdditionalCharges, bc.TotalSurcharge, bc.NetPayableAmount, bc.Status,
+           (SELECT json_group_array(json_array(PersonID, Name))
+            FROM (SELECT u.PersonID, u.Name FROM Users u WHERE u.FlatNo = br.FlatNo ORDER BY u.PersonID)) AS Users,
+           (SELECT json_group_array(json_array(
+                       rsm.SurchargeID, sr.SurchargeTypeID, st.TypeName, sr.RatePerUnit, rsm.AdjustedBillingMonth,
+                       rsm.SurchargeAmount, rsm.AdjustmentReason, sr.EffectiveDate,
+                       COALESCE((SELECT adj.UnitsConsumed FROM BillingReadings adj
+                                 JOIN BillingCharges adjc ON adjc.ReadingID = adj.ReadingID
+                                 WHERE adj.FlatNo = br.FlatNo AND adj.BillingMonth = rsm.AdjustedBillingMonth), 0)))
+            FROM ReadingSurchargeMapping rsm
+            LEFT JOIN Surcharge sr ON sr.SurchargeID = rsm.SurchargeID
+            LEFT JOIN SurchargeType st ON st.SurchargeTypeID = sr.SurchargeTypeID
+            WHERE rsm.ReadingID = br.ReadingID AND rsm.BillingMonth = br.BillingMonth) AS Surcharges
+    FROM BillingReadings br
+    LEFT JOIN BillingCharges bc ON bc.ReadingID = br.ReadingID
+    LEFT JOIN AdditionalCharges ac ON ac.ReadingID = br.ReadingID
+    LEFT JOIN SurchargeGSTDuty sgd ON sgd.ReadingID = br.ReadingID
+    WHERE br.FlatNo = ? AND br.BillingMonth = ?
+"""
+
+
+def _bill_versions(conn):
+    # data_version moves when another connection or process (month_close, api_server, reading_ingest) commits
+    return (id(conn), data_version(conn)) + tuple(table_version(table) for table in BILL_TABLES)
+
+
+def _session_cached(cache, key, loader, conn=None):
+    """
+    loader() memoized in cache (e.g. a st.session_state dict) until one of
+    BILL_TABLES is written here or anything is committed elsewhere.
+    """
+    if cache is None:
+        return loader()
+    versions = _bill_versions(conn or get_connection())
+    entry = cache.get(key)
+    if entry is None or entry[0] != versions:
+        entry = cache[key] = (versions, loader())
+    return entry[1]
+
+
+def get_bill_snapshot(flat_no, billing_month, cache=None, conn=None):
+    """
+    Reading, charges, user and surcharge mappings of one flat's month from a single query.
+
+    Args:
+        cache (dict, optional): Per-session store; the snapshot is served from
+            it until this process writes to one of BILL_TABLES or another
+            connection commits.
+
+    Returns:
+        BillSnapshot, or None if the flat has no reading for the month.
+    """
+    def load():
+        connection = conn or get_connection()
+        row = connection.execute(BILL_SNAPSHOT_QUERY, (flat_no, billing_month)).fetchone()
+        if row is None:
+            return None
+        *fields, users, surcharges = row
+        return BillSnapshot(
+            *fields,
+            users=[tuple(user) for user in json.loads(users)],
+            surcharges=tuple(SurchargeLine(*line) for line in json.loads(surcharges)),
+        )
+
+    return _session_cached(cache, ("bill", flat_no, billing_month), load, conn)
+
+
+def get_billed_flats(cache=None, conn=None):
+    """Flats with at least one reading, for the bill pickers."""
+    def load():
+        connection = conn or get_connection()
+        return [row[0] for row in connection.execute("SELECT DISTINCT FlatNo FROM BillingReadings ORDER BY FlatNo")]
+    return _session_cached(cache, ("flats",), load, conn)
+
+
+def get_reading_months(flat_no, cache=None, conn=None):
+    """Months with a reading for flat_no."""
+    def load():
+        connection = conn or get_connection()
+        return [row[0] for row in connection.execute(
+            "SELECT BillingMonth FROM BillingReadings WHERE FlatNo = ? ORDER BY BillingMonth", (flat_no,))]
+    return _session_cached(cache, ("months", flat_no), load, conn)
+
+
+def delete_bill(flat_no, month):
+    """Delete bill records from the database."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        bill_data = fetch_complete_bill(flat_no, month)
+        if not bill_data:
+            st.error(f"❌ No bill found for Flat {flat_no} in {month}!")
+            return
+
+        reading_id, _, _, _, _, bill_id, _, _, _, _, _, _ = bill_data
+
+        # Delete from dependent tables first
+        cursor.execute("DELETE FROM BillingCharges WHERE BillID = ?", (bill_id,))
+        cursor.execute("DELETE FROM BillingReadings WHERE ReadingID = ?", (reading_id,))
+
+        conn.commit()
+        bump_table_version("BillingCharges", "BillingReadings")
+        st.success(f"✅ Bill record for Flat {flat_no} ({month}) deleted successfully!")
+    except Exception as e:
+        conn.rollback()
+        st.error(f"❌ Error deleting bill: {e}")
+
+
+def update_bill_status(bill_id, status):
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("""
+            UPDATE BillingCharges 
+            SET Status=? 
+            WHERE BillID=?
+        """, (status, bill_id))
+
+        conn.commit()
+        bump_table_version("BillingCharges")
+        st.success(f"✅ Bill status updated successfully to '{status}'!")
+
+    except Exception as e:
+        conn.rollback()
+        st.error(f"❌ Error updating bill status: {e}")
+
+
+def get_consumption_history(person_id=None, flat_no=None):
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    query = """
+        SELECT ch.ConsumptionID, u.Name, ch.FlatNo, ch.BillingMonth, ch.UnitsConsumed, ch.RecordedAt
+        FROM ConsumptionHistory ch
+        JOIN Users u ON u.PersonID = ch.PersonID
+        WHERE 1=1
+    """
+    params = []
+    
+    if person_id:
+        query += " AND ch.PersonID = ?"
+        params.append(person_id)
+    if flat_no:
+        query += " AND ch.FlatNo = ?"
+        params.append(flat_no)
+
+    query += " ORDER BY ch.BillingMonth DESC"
+
+    df = pd.read_sql_query(query, conn, params=params)
+    
+    return df
+
+
+def iter_billing_data(selected_month, batch_size=None):
+    """Yield the month's billing rows in lists of at most batch_size (default: bill_pdf.STREAM_BATCH_SIZE)."""
+    if batch_size is None:
+        # Only the PDF export streams rows; it loads bill_pdf anyway
+        from bill_pdf import STREAM_BATCH_SIZE
+        batch_size = STREAM_BATCH_SIZE
+    return billing_engine.iter_billing_data(selected_month, batch_size)
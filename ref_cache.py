@@ -0,0 +1,98 @@
+# Description: Process-wide cache for rarely changing reference tables.
+# Shared by every Streamlit session; entries are keyed by db.table_signature()
+# of the tables they read, so a write to one of those tables, through the app or
+# by another connection or process, makes them unreachable at once, while
+# commits to other tables leave them alone.
+import os
+import threading
+from collections import OrderedDict
+
+from db import external_generation, on_db_path_change, table_signature, table_version
+
+DEFAULT_MAX_BYTES = int(os.environ.get("BILLING_CACHE_MAX_MB", "64")) * 1024 * 1024
+
+# Tables get_table_data() serves from the cache
+REFERENCE_TABLES = {"Users", "Flats", "GSTRates", "ElectricDutyRates", "Surcharge", "SurchargeType"}
+
+
+class ReferenceCache:
+    """LRU of DataFrames keyed by (name, signatures of the tables it reads), bounded in bytes."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, name, tables, loader, any_commit=False):
+        """
+        Return a copy of the cached frame for name, calling loader() on a miss.
+
+        Args:
+            name (str): Cache entry name, e.g. "table:Users".
+            tables (tuple): Tables the loader reads; their signatures are part of the key.
+            loader (callable): Returns the DataFrame to cache.
+            any_commit (bool): Key on the tables' write versions and
+                db.external_generation() instead, so any commit by another
+                connection reloads the entry. For frames over large, busy
+                tables, where fingerprinting the rows costs about as much as
+                reloading them.
+        """
+        if any_commit:
+            versions = (tuple(table_version(table) for table in tables), external_generation())
+        else:
+            versions = tuple(table_signature(table) for table in tables)
+        key = (name, versions)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0].copy()
+
+        df = loader()
+        size = int(df.memory_usage(index=True, deep=True).sum())
+
+        with self._lock:
+            self.misses += 1
+            # Older versions of the same entry can never be hit again
+            for stale in [k for k in self._entries if k[0] == name and k != key]:
+                self.bytes -= self._entries.pop(stale)[1]
+                self.invalidations += 1
+            if size <= self.max_bytes:
+                if key in self._entries:
+                    self.bytes -= self._entries.pop(key)[1]
+                self._entries[key] = (df, size)
+                self.bytes += size
+            while self.bytes > self.max_bytes and self._entries:
+                self.bytes -= self._entries.popitem(last=False)[1][1]
+                self.evictions += 1
+        return df.copy()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+reference_cache = ReferenceCache()
+# Entries describe the old file's rows
+on_db_path_change(reference_cache.clear)
@@ -0,0 +1,268 @@
+# Description: Opt-in SQL tracing for the shared connections.
+#
+#   BILLING_SQL_TRACE=1 streamlit run appchanged.py
+#
+# When enabled, db._connect() opens TracedConnection objects: every statement
+# run through a cursor is recorded with its normalized text, duration (execute
+# plus fetches), row count and the calling function, and SQLite's own trace
+# callback logs each statement it actually executes (including trigger bodies)
+# at DEBUG. Records are kept per thread between start_run() and end_run(), i.e.
+# per Streamlit rerun, API request or ingest batch, and capped at MAX_RECORDS.
+# When disabled, connections are plain sqlite3 connections.
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from functools import lru_cache, wraps
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("BILLING_SQL_TRACE", "").lower() in ("1", "true", "yes", "on")
+
+# Slowest statements listed in a summary
+TOP_N = int(os.environ.get("BILLING_SQL_TRACE_TOP", 10))
+
+# Identical statements from one caller in one run flagged as an N+1 pattern
+REPEAT_THRESHOLD = int(os.environ.get("BILLING_SQL_TRACE_REPEAT", 5))
+
+# Records kept per run; older ones are dropped (still counted) so a thread that
+# never ends its run cannot grow without bound
+MAX_RECORDS = int(os.environ.get("BILLING_SQL_TRACE_MAX_RECORDS", 10000))
+
+_REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+# Frames in these files are plumbing, not the caller of interest
+_SKIP_FILES = {os.path.join(_REPO_DIR, name) for name in ("db.py", "sql_trace.py")}
+
+_local = threading.local()
+
+
+class QueryRecord:
+    """One cursor execution; duration and rows grow as its results are fetched."""
+
+    __slots__ = ("sql", "caller", "duration", "rows")
+
+    def __init__(self, sql, caller, duration, rows):
+        self.sql = sql
+        self.caller = caller
+        self.duration = duration
+        self.rows = rows
+
+
+class _Run:
+    def __init__(self, label):
+        self.label = label
+        self.records = deque(maxlen=MAX_RECORDS)
+        self.queries = 0
+        self.statements = 0
+        self.started = time.perf_counter()
+
+
+def _current_run():
+    run = getattr(_local, "run", None)
+    if run is None:
+        run = _local.run = _Run(None)
+    return run
+
+
+def start_run(label=None):
+    """Start a fresh trace for this thread (call at the top of each rerun)."""
+    _local.run = _Run(label)
+
+
+def end_run(top=TOP_N, repeat_threshold=REPEAT_THRESHOLD):
+    """Log this thread's run (see log_summary), drop its records and return the summary."""
+    result = log_summary(top, repeat_threshold)
+    _local.run = None
+    return result
+
+
+def traced(label):
+    """
+    Decorator that traces each call as a run of its own and logs its summary.
+
+    Meant for st.fragment bodies, which rerun without the rest of the script,
+    and for the request / batch entry points of the servers. Queries of a call
+    made inside another run (a fragment during a full rerun) are also added to
+    that run; a fragment rerun after end_run() starts from nothing.
+    """
+    def decorate(func):
+        if not ENABLED:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            outer = getattr(_local, "run", None)
+            start_run(label)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                inner = _local.run
+                end_run()
+                if outer is not None:
+                    outer.records.extend(inner.records)
+                    outer.queries += inner.queries
+                    outer.statements += inner.statements
+                _local.run = outer
+        return wrapper
+    return decorate
+
+
+@lru_cache(maxsize=1024)
+def normalize(sql):
+    """Statement text with comments, literals and whitespace normalized, for grouping."""
+    sql = re.sub(r"--[^\n]*|/\*.*?\*/", " ", sql, flags=re.S)
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"(?<![\w.])-?\d+(?:\.\d+)?(?:e[+-]?\d+)?\b", "?", sql, flags=re.I)
+    sql = re.sub(r"\s+", " ", sql).strip()
+    # IN lists of any length are the same query
+    return re.sub(r"\(\s*\?(?:\s*,\s*\?)+\s*\)", "(?, ...)", sql)
+
+
+def _caller():
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_REPO_DIR) and filename not in _SKIP_FILES:
+            module = os.path.splitext(os.path.basename(filename))[0]
+            return f"{module}.{frame.f_code.co_name}:{frame.f_lineno}"
+        frame = frame.f_back
+    return "?"
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor that records each execute and adds fetch time and rows to it."""
+
+    _record = None
+
+    def _track(self, method, sql, params):
+        caller = _caller()
+        started = time.perf_counter()
+        try:
+            return method(sql, params)
+        finally:
+            self._record = QueryRecord(sql, caller, time.perf_counter() - started, max(self.rowcount, 0))
+            run = _current_run()
+            run.records.append(self._record)
+            run.queries += 1
+
+    def execute(self, sql, parameters=()):
+        return self._track(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._track(super().executemany, sql, seq_of_parameters)
+
+    def _fetched(self, started, rows):
+        if self._record is not None:
+            self._record.duration += time.perf_counter() - started
+            self._record.rows += rows
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(started, len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows))
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        row = super().__next__()
+        self._fetched(started, 1)
+        return row
+
+
+def _on_statement(sql):
+    # SQLite's trace callback: every statement it runs, with bound values expanded
+    _current_run().statements += 1
+    logger.debug("%s", sql)
+
+
+class TracedConnection(sqlite3.Connection):
+    """sqlite3.Connection whose cursors (and execute shortcuts) are TracedCursors."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.set_trace_callback(_on_statement)
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    # The C shortcuts create a plain cursor internally
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def summary(top=TOP_N, repeat_threshold=REPEAT_THRESHOLD):
+    """
+    Aggregate this thread's current run.
+
+    Returns:
+        dict: statements (executed by SQLite, including triggers), queries
+            (cursor executions), total_ms, slowest (top statements by total
+            time) and repeated (statements run repeat_threshold or more times
+            by the same caller, the usual N+1 shape). total_ms, slowest and
+            repeated cover the last MAX_RECORDS queries only.
+    """
+    run = _current_run()
+    groups, by_caller = {}, {}
+    for record in run.records:
+        key = normalize(record.sql)
+        group = groups.setdefault(key, {"sql": key, "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                        "rows": 0, "callers": set()})
+        ms = record.duration * 1000
+        group["count"] += 1
+        group["total_ms"] += ms
+        group["max_ms"] = max(group["max_ms"], ms)
+        group["rows"] += record.rows
+        group["callers"].add(record.caller)
+        by_caller[key, record.caller] = by_caller.get((key, record.caller), 0) + 1
+
+    for group in groups.values():
+        group["callers"] = sorted(group["callers"])
+    slowest = sorted(groups.values(), key=lambda g: g["total_ms"], reverse=True)[:top]
+    repeated = [
+        {"sql": key, "caller": caller, "count": count, "total_ms": groups[key]["total_ms"]}
+        for (key, caller), count in by_caller.items() if count >= repeat_threshold
+    ]
+    repeated.sort(key=lambda r: r["count"], reverse=True)
+    return {
+        "label": run.label,
+        "statements": run.statements,
+        "queries": run.queries,
+        "total_ms": sum(group["total_ms"] for group in groups.values()),
+        "wall_ms": (time.perf_counter() - run.started) * 1000,
+        "slowest": slowest,
+        "repeated": repeated,
+    }
+
+
+def log_summary(top=TOP_N, repeat_threshold=REPEAT_THRESHOLD):
+    """Log summary() (INFO for the slowest statements, WARNING for N+1 patterns) and return it."""
+    result = summary(top, repeat_threshold)
+    logger.info("%s: %d queries (%d statements) in %.1f ms of %.1f ms",
+                result["label"] or "run", result["queries"], result["statements"],
+                result["total_ms"], result["wall_ms"])
+    for group in result["slowest"]:
+        logger.info("  %8.2f ms  x%-4d %6d rows  %s  [%s]", group["total_ms"], group["count"], group["rows"],
+                    group["sql"][:200], ", ".join(group["callers"]))
+    for repeat in result["repeated"]:
+        logger.warning("Possible N+1: %d x %s from %s (%.2f ms)", repeat["count"], repeat["sql"][:200],
+                       repeat["caller"], repeat["total_ms"])
+    return result
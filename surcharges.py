@@ -0,0 +1,180 @@
+# Description: In-memory Surcharge index used for all surcharge rate lookups.
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+import numpy as np
+
+from db import TableIndex, signature_sql
+from tariffs import normalize_date
+
+
+class _Bands:
+    """All Surcharge rows of one (SurchargeTypeID, EffectiveDate), sorted by UnitsFrom."""
+
+    def __init__(self, effective_date, rows):
+        rows.sort(key=lambda row: (row[1], row[2]))
+        self.effective_date = effective_date
+        self.surcharge_ids = [row[0] for row in rows]
+        self.units_from = [row[1] for row in rows]
+        self.units_to = [row[2] for row in rows]
+        self.rates = [row[3] for row in rows]
+        self.from_array = np.array(self.units_from, dtype=float)
+        self.to_array = np.array(self.units_to, dtype=float)
+        self.rate_array = np.array(self.rates, dtype=float)
+        self.id_array = np.array(self.surcharge_ids, dtype=np.int64)
+
+    def find(self, units):
+        """Position of the band covering units, or None."""
+        i = bisect_right(self.units_from, units) - 1
+        if i >= 0 and units <= self.units_to[i]:
+            return i
+        # Overlapping bands (e.g. an open-ended row next to a ranged one)
+        for j in range(i - 1, -1, -1):
+            if units <= self.units_to[j]:
+                return j
+        return None
+
+    def find_many(self, units):
+        """Vectorized find(): (SurchargeID array, -1 where unmatched; RatePerUnit array, 0.0 where unmatched)."""
+        surcharge_ids = np.full(units.shape, -1, dtype=np.int64)
+        rates = np.zeros(units.shape, dtype=float)
+        pending = np.ones(units.shape, dtype=bool)
+        i = np.searchsorted(self.from_array, units, side="right") - 1
+        # Walk down from the nearest band so overlapping bands resolve like find()
+        while pending.any():
+            valid = pending & (i >= 0)
+            if not valid.any():
+                break
+            safe_i = np.clip(i, 0, None)
+            hit = valid & (units <= self.to_array[safe_i])
+            surcharge_ids[hit] = self.id_array[safe_i][hit]
+            rates[hit] = self.rate_array[safe_i][hit]
+            pending &= ~hit
+            i = i - 1
+        return surcharge_ids, rates
+
+
+def band_rates(bands, units):
+    """
+    Vectorized rate lookup in an ad-hoc band schedule, resolved like SurchargeResolver.resolve_many().
+
+    Args:
+        bands (iterable): (UnitsFrom, UnitsTo, RatePerUnit) tuples; a None bound is open-ended.
+        units (array): Units per reading.
+
+    Returns:
+        array: RatePerUnit per element of units, 0.0 where no band covers it.
+    """
+    rows = [(-1, float(low) if low is not None else float("-inf"), float(high) if high is not None else float("inf"),
+             float(rate)) for low, high, rate in bands]
+    units = np.nan_to_num(np.asarray(units, dtype=float))
+    if not rows:
+        return np.zeros(units.shape, dtype=float)
+    return _Bands(None, rows).find_many(units)[1]
+
+
+class SurchargeResolver(TableIndex):
+    """
+    Surcharge table indexed by (SurchargeTypeID, EffectiveDate) with sorted unit bands.
+
+    Answers "which SurchargeID and rate apply to these units on this date"
+    without SQL; the index reloads when the Surcharge table changes,
+    including right after upsert_surcharge_rate commits.
+    """
+
+    table = "Surcharge"
+    # Covers the type and band columns as well as the rates; see db.signature_sql
+    signature_query = signature_sql("Surcharge", ("SurchargeID", "SurchargeTypeID", "RatePerUnit", "UnitsFrom",
+                                                  "UnitsTo", "EffectiveDate"))
+
+    def __init__(self):
+        super().__init__()
+        self._bands = {}
+        self._dates = {}
+
+    def _load(self, conn):
+        grouped = {}
+        rows = conn.execute("SELECT SurchargeID, SurchargeTypeID, RatePerUnit, UnitsFrom, UnitsTo, EffectiveDate FROM Surcharge")
+        for surcharge_id, type_id, rate, units_from, units_to, effective_date in rows:
+            band = (
+                surcharge_id,
+                float(units_from) if units_from is not None else float("-inf"),
+                float(units_to) if units_to is not None else float("inf"),
+                float(rate) if rate is not None else 0.0,
+            )
+            grouped.setdefault((int(type_id), effective_date), []).append(band)
+
+        bands = {key: _Bands(key[1], rows) for key, rows in grouped.items()}
+        dates = {}
+        for type_id, effective_date in bands:
+            dates.setdefault(type_id, []).append((normalize_date(effective_date) or "", effective_date))
+        for type_dates in dates.values():
+            type_dates.sort()
+        self._bands = bands
+        self._dates = dates
+
+    def effective_date(self, surcharge_type_id, on_or_before=None, conn=None):
+        """Latest EffectiveDate of a surcharge type on or before a date (today by default)."""
+        self.refresh(conn)
+        type_dates = self._dates.get(int(surcharge_type_id))
+        if not type_dates:
+            return None
+        if on_or_before is None:
+            on_or_before = datetime.today()
+        cutoff = normalize_date(on_or_before) or str(on_or_before)
+        i = bisect_right(type_dates, (cutoff, "\uffff"))
+        return type_dates[i - 1][1] if i else None
+
+    def _bands_for(self, surcharge_type_id, effective_date, on_or_before, conn):
+        self.refresh(conn)
+        surcharge_type_id = int(surcharge_type_id)
+        if effective_date is None:
+            effective_date = self.effective_date(surcharge_type_id, on_or_before, conn)
+        bands = self._bands.get((surcharge_type_id, effective_date))
+        if bands is None and effective_date is not None:
+            # The caller may pass the date in another format than the table stores it
+            wanted = normalize_date(effective_date)
+            type_dates = self._dates.get(surcharge_type_id, [])
+            i = bisect_left(type_dates, (wanted or "", ""))
+            if i < len(type_dates) and type_dates[i][0] == wanted:
+                bands = self._bands[(surcharge_type_id, type_dates[i][1])]
+        return bands
+
+    def resolve(self, surcharge_type_id, units, effective_date=None, on_or_before=None, conn=None):
+        """
+        SurchargeID and rate for one reading.
+
+        Args:
+            surcharge_type_id (int): SurchargeType.SurchargeTypeID.
+            units (float): Units the surcharge applies to.
+            effective_date (str, optional): Exact EffectiveDate schedule to use.
+            on_or_before (str, optional): Without effective_date, use the latest
+                schedule effective on or before this date (today by default).
+
+        Returns:
+            tuple: (SurchargeID, RatePerUnit), or None if no band covers the units.
+        """
+        bands = self._bands_for(surcharge_type_id, effective_date, on_or_before, conn)
+        if bands is None:
+            return None
+        i = bands.find(float(units or 0))
+        if i is None:
+            return None
+        return bands.surcharge_ids[i], bands.rates[i]
+
+    def resolve_many(self, surcharge_type_id, units, effective_date=None, on_or_before=None, conn=None):
+        """
+        Vectorized resolve() for an array of units under one schedule.
+
+        Returns:
+            tuple: (SurchargeID array with -1 where unmatched, RatePerUnit array with 0.0 where unmatched).
+        """
+        units = np.nan_to_num(np.asarray(units, dtype=float))
+        bands = self._bands_for(surcharge_type_id, effective_date, on_or_before, conn)
+        if bands is None:
+            return np.full(units.shape, -1, dtype=np.int64), np.zeros(units.shape, dtype=float)
+        return bands.find_many(units)
+
+
+# Shared by every page, thread and the batch engine
+surcharge_resolver = SurchargeResolver()
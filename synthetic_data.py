@@ -0,0 +1,167 @@
+# Description: Reproducible synthetic billing database for benchmarks and load tests.
+#
+#   python synthetic_data.py --db bench.db --users 5000 --months 12 --seed 42
+#
+# Fills a fresh database with flats, users, tariff slabs, rate and surcharge
+# schedules and cumulative meter readings; every month except the last
+# --unbilled-months is billed through the month-close engine.
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from billing_engine import close_month, get_date
+from db import close_connection, get_connection, set_db_path, transaction
+from migrations import migrate
+from readings import import_readings
+
+FIRST_NAMES = ("Ahmed", "Ayesha", "Bilal", "Fatima", "Hamza", "Hira", "Imran", "Maryam", "Omar", "Sana",
+               "Usman", "Zainab", "Ali", "Khadija", "Saad", "Noor", "Farhan", "Amna", "Talha", "Rabia")
+LAST_NAMES = ("Khan", "Ahmed", "Siddiqui", "Qureshi", "Hussain", "Malik", "Shaikh", "Raza", "Iqbal", "Abbasi")
+
+# (MinUnits, MaxUnits, RatePerUnit) per category; a second schedule 6 months in raises rates 10%
+TARIFFS = {
+    "Residential": ((0, 100, 7.74), (101, 200, 10.06), (201, 300, 12.15), (301, 700, 19.55), (701, None, 22.65)),
+    "Commercial": ((0, 300, 24.1), (301, None, 29.8)),
+}
+
+# (SurchargeTypeID, UnitsFrom, UnitsTo, RatePerUnit); type 1 is banded, 2 and 3 are flat
+SURCHARGES = ((1, 1, 200, 1.0), (1, 201, 700, 2.0), (2, None, None, 0.43), (3, None, None, 1.9))
+
+
+def month_range(start_month, count):
+    """count consecutive "YYYY-MM" months starting at start_month."""
+    return [str(period) for period in pd.period_range(start_month, periods=count, freq="M")]
+
+
+def _reset(db_path):
+    close_connection()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+
+def _seed_reference_data(conn, rng, users, months):
+    start_date = f"{months[0]}-01"
+    mid_date = f"{months[len(months) // 2]}-01"
+    blocks = np.array(list("ABCDEFGH"))
+
+    flat_numbers = [f"{blocks[i % len(blocks)]}-{100 + i // len(blocks)}" for i in range(users)]
+    categories = np.where(rng.random(users) < 0.1, "Commercial", "Residential")
+    names = [f"{first} {last}" for first, last in zip(rng.choice(FIRST_NAMES, users), rng.choice(LAST_NAMES, users))]
+
+    with transaction(conn):
+        conn.executemany("INSERT INTO Flats (FlatNo, Block) VALUES (?, ?)",
+                         [(flat_no, flat_no[0]) for flat_no in flat_numbers])
+        conn.executemany("""
+            INSERT INTO Users (PersonID, Name, FlatNo, UserType, UserCategory, LoadSanctioned, Phase)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [
+            # The app's user forms use the category as UserType
+            (f"P{i:06d}", names[i], flat_numbers[i], str(categories[i]), str(categories[i]),
+             float(rng.choice((1.0, 2.0, 3.0, 5.0))), rng.choice(("1-Phase", "3-Phase")))
+            for i in range(users)
+        ])
+        slabs = []
+        for effective_date, factor in ((start_date, 1.0), (mid_date, 1.1)):
+            for category, bands in TARIFFS.items():
+                slabs += [(category, low, high, round(rate * factor, 2), effective_date) for low, high, rate in bands]
+        conn.executemany("""
+            INSERT INTO TariffSlabs (UserCategory, MinUnits, MaxUnits, RatePerUnit, RateEffectiveDate)
+            VALUES (?, ?, ?, ?, ?)
+        """, slabs)
+        conn.execute("INSERT INTO GSTRates (EffectiveDate, GST) VALUES (?, 17)", (start_date,))
+        conn.execute("INSERT INTO ElectricDutyRates (EffectiveDate, ElectricDuty) VALUES (?, 1.5)", (start_date,))
+        conn.executemany("""
+            INSERT INTO Surcharge (SurchargeTypeID, UnitsFrom, UnitsTo, RatePerUnit, EffectiveDate)
+            VALUES (?, ?, ?, ?, ?)
+        """, [row + (start_date,) for row in SURCHARGES])
+    return flat_numbers, categories
+
+
+def generate(db_path, users=1000, months=12, start_month="2024-01", unbilled_months=1, seed=42, overwrite=False):
+    """
+    Build a synthetic database at db_path.
+
+    Args:
+        users (int): Flats, one user each.
+        months (int): Months of readings per flat.
+        start_month (str): First billing month, "YYYY-MM".
+        unbilled_months (int): Trailing months left without charges (for insert_bill / month-close runs).
+        seed (int): RNG seed; the same arguments always produce the same data.
+        overwrite (bool): Replace an existing file at db_path.
+
+    Returns:
+        dict: Counts of what was generated.
+    """
+    if os.path.exists(db_path):
+        if not overwrite:
+            raise FileExistsError(f"{db_path} exists; pass overwrite=True (--force) to replace it")
+        _reset(db_path)
+    set_db_path(db_path)
+    conn = get_connection()
+    migrate(conn)
+
+    rng = np.random.default_rng(seed)
+    billing_months = month_range(start_month, months)
+    flat_numbers, categories = _seed_reference_data(conn, rng, users, billing_months)
+
+    fuel_surcharge_id = conn.execute("SELECT SurchargeID FROM Surcharge WHERE SurchargeTypeID = 3").fetchone()[0]
+    fuel_rate = SURCHARGES[-1][3]
+    # New meters: the first month's previous reading is 0
+    meter = np.zeros(users)
+    mean_units = np.where(categories == "Commercial", 900.0, 260.0)
+    billed = 0
+
+    for i, month in enumerate(billing_months):
+        # Whole kWh, like the meters: the slab and surcharge bands have integer bounds
+        # (0-100, 101-200, ...), so a fractional reading could fall between two bands
+        units = np.round(rng.gamma(4.0, mean_units / 4.0))
+        meter = meter + units
+        result = import_readings(pd.DataFrame({
+            "FlatNo": flat_numbers,
+            "BillingMonth": month,
+            "PresentReading": meter,
+            "ReadingDate": get_date(month),
+        }), conn=conn)
+        if not result.rejected.empty:
+            raise RuntimeError(f"Synthetic readings rejected for {month}: {result.rejected['Reason'].iloc[0]}")
+
+        # Fuel charge adjustment on every reading, as the clerks record it
+        with transaction(conn):
+            conn.execute("""
+                INSERT INTO ReadingSurchargeMapping (ReadingID, SurchargeID, BillingMonth, AdjustedBillingMonth,
+                                                     SurchargeAmount, AdjustmentReason)
+                SELECT ReadingID, ?, BillingMonth, BillingMonth, ROUND(UnitsConsumed * ?, 2), 'Fuel charge'
+                FROM BillingReadings WHERE BillingMonth = ?
+            """, (fuel_surcharge_id, fuel_rate, month))
+
+        if i < months - unbilled_months:
+            billed += len(close_month(month, conn=conn))
+
+    conn.execute("ANALYZE")
+    conn.commit()
+    return {"users": users, "months": months, "readings": users * months, "bills": billed,
+            "first_month": billing_months[0], "last_month": billing_months[-1], "seed": seed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic billing database.")
+    parser.add_argument("--db", default="billing_system.db", help="Database file to create (default: billing_system.db)")
+    parser.add_argument("--users", type=int, default=1000, help="Flats / users (default: 1000)")
+    parser.add_argument("--months", type=int, default=12, help="Months of readings (default: 12)")
+    parser.add_argument("--start-month", default="2024-01", help="First billing month (default: 2024-01)")
+    parser.add_argument("--unbilled-months", type=int, default=1, help="Trailing months left unbilled (default: 1)")
+    parser.add_argument("--seed", type=int, default=42, help="RNG seed (default: 42)")
+    parser.add_argument("--force", action="store_true", help="Overwrite an existing database file")
+    args = parser.parse_args()
+
+    summary = generate(args.db, args.users, args.months, args.start_month, args.unbilled_months,
+                       args.seed, overwrite=args.force)
+    print(f"{args.db}: {summary['users']} users, {summary['readings']} readings, {summary['bills']} bills "
+          f"({summary['first_month']} .. {summary['last_month']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+# Description: What-if tariff simulator over historical consumption.
+# Re-prices every recorded reading under a proposed slab table, GST, electric
+# duty and surcharge schedule with the bill formulas insert_bill uses
+# (billing_engine.compute_charges), entirely in NumPy. Nothing is written.
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from billing_engine import compute_charges, get_date
+from db import get_connection
+from rates import get_electric_duty_rates, get_gst_rates
+from ref_cache import reference_cache
+from surcharges import band_rates
+from tariffs import build_schedules, normalize_date, schedule_prices, tariff_slabs
+
+# Tables each cached frame is read from; a write to any of them, or any commit
+# by another connection, reloads it (too large to fingerprint on every commit)
+HISTORY_TABLES = ("BillingReadings", "Users")
+SURCHARGE_LINE_TABLES = ("ReadingSurchargeMapping", "Surcharge")
+
+Scenario = namedtuple("Scenario", [
+    "slabs",          # {UserCategory: [(MinUnits, MaxUnits, RatePerUnit), ...]}; other categories keep their scheduled slabs
+    "gst_rate",       # GST %, or None for the rate effective in each month
+    "electric_duty",  # Electric duty %, or None for the rate effective in each month
+    "surcharges",     # {SurchargeTypeID: [(UnitsFrom, UnitsTo, RatePerUnit), ...]}; other types keep their recorded amounts
+    "slab_modes",     # {UserCategory: "flat" | "progressive"} for the proposed slabs; default: the current schedule's mode
+], defaults=(None, None, None, None, None))
+
+SimulationResult = namedtuple("SimulationResult", [
+    "readings",  # DataFrame: one row per flat-month with its baseline and proposed bill
+    "by_flat",   # DataFrame: totals per FlatNo
+    "by_month",  # DataFrame: totals per BillingMonth
+    "totals",    # dict: readings, units, baseline, proposed, delta
+])
+
+
+def load_history(conn=None):
+    """
+    Every reading with its user category, in (BillingMonth, FlatNo) order.
+
+    Served from the reference cache; FlatNo, BillingMonth and UserCategory are
+    categoricals, so a colony's full history stays a few MiB.
+    """
+    def load():
+        frame = pd.read_sql_query("""
+            SELECT br.ReadingID, br.FlatNo, br.BillingMonth, u.UserCategory, br.UnitsConsumed
+            FROM BillingReadings br
+            LEFT JOIN Users u
+                   ON u.PersonID = COALESCE(br.PersonID, (SELECT PersonID FROM Users WHERE FlatNo = br.FlatNo LIMIT 1))
+            WHERE br.BillingMonth IS NOT NULL
+            ORDER BY br.BillingMonth, br.FlatNo
+        """, conn or get_connection())
+        return frame.astype({"FlatNo": "category", "BillingMonth": "category", "UserCategory": "category",
+                             "UnitsConsumed": float})
+    return reference_cache.get("simulator:history", HISTORY_TABLES, load, any_commit=True)
+
+
+def load_surcharge_lines(conn=None):
+    """Every ReadingSurchargeMapping line with its SurchargeTypeID; CurrentMonth marks non-adjustment lines."""
+    def load():
+        frame = pd.read_sql_query("""
+            SELECT rsm.ReadingID, rsm.BillingMonth, s.SurchargeTypeID, rsm.SurchargeAmount,
+                   rsm.AdjustedBillingMonth = rsm.BillingMonth AS CurrentMonth
+            FROM ReadingSurchargeMapping rsm
+            JOIN Surcharge s ON s.SurchargeID = rsm.SurchargeID
+        """, conn or get_connection())
+        return frame.astype({"BillingMonth": "category", "SurchargeAmount": float, "CurrentMonth": bool})
+    return reference_cache.get("simulator:surcharge_lines", SURCHARGE_LINE_TABLES, load, any_commit=True)
+
+
+def _codes(column, categories):
+    """Codes of a categorical column translated to positions in categories (-1 where absent), without strings."""
+    translate = np.append(categories.get_indexer(column.cat.categories), -1)
+    return translate[column.cat.codes.to_numpy()]
+
+
+def _line_positions(lines, reading_ids, month_codes, months):
+    """Row of each surcharge line's reading, -1 when it is outside the range or filed under another month."""
+    line_ids = lines["ReadingID"].to_numpy()
+    if not len(reading_ids) or not len(line_ids):
+        return np.full(len(line_ids), -1)
+    # Dense ReadingID -> row table; IDs are AUTOINCREMENT keys
+    size = max(int(reading_ids.max()), int(line_ids.max())) + 1
+    rows = np.full(size, -1)
+    rows[reading_ids] = np.arange(len(reading_ids))
+    positions = rows[np.clip(line_ids, 0, None)]
+    # Only lines filed under the reading's own month count, as in load_month_readings()
+    line_months = _codes(lines["BillingMonth"], months)
+    positions[(positions >= 0) & (line_months != month_codes[np.clip(positions, 0, None)])] = -1
+    return positions
+
+
+def _scheduled(rates, column, dates):
+    """The rate effective on each of dates (sorted "YYYY-MM-DD"), falling back to the latest like the engine."""
+    if rates.empty:
+        return np.zeros(len(dates))
+    effective = np.array([normalize_date(value) or str(value) for value in rates["EffectiveDate"]])
+    values = rates[column].to_numpy(dtype=float)
+    order = np.argsort(effective, kind="stable")
+    effective, values = effective[order], values[order]
+    i = np.searchsorted(effective, dates, side="right") - 1
+    return np.where(i >= 0, values[np.clip(i, 0, None)], values[-1])
+
+
+def _totals(codes, labels, count_label, units, baseline, proposed):
+    size = len(labels)
+    baseline_total = np.bincount(codes, weights=baseline, minlength=size)
+    proposed_total = np.bincount(codes, weights=proposed, minlength=size)
+    frame = pd.DataFrame({
+        labels.name: labels,
+        count_label: np.bincount(codes, minlength=size),
+        "Units": np.bincount(codes, weights=units, minlength=size),
+        "Baseline": baseline_total,
+        "Proposed": proposed_total,
+        "Delta": proposed_total - baseline_total,
+    })
+    frame = frame[frame[count_label] > 0].reset_index(drop=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frame["DeltaPct"] = np.where(frame["Baseline"] != 0, frame["Delta"] / frame["Baseline"] * 100, np.nan)
+    return frame
+
+
+def simulate(scenario, start_month=None, end_month=None, conn=None):
+    """
+    Price the recorded readings of a month range twice: as scheduled, and under scenario.
+
+    The baseline uses the tariff slabs, GST and duty rates effective at each
+    month's reading date and the surcharge amounts recorded for each reading;
+    the proposal replaces whichever of those the scenario sets. Surcharges of a
+    proposed type are recomputed as units x band rate on each reading's
+    current-month lines; adjusted-month surcharges are kept as recorded.
+
+    Args:
+        scenario (Scenario): The proposed schedules.
+        start_month (str, optional): First month, "YYYY-MM" (default: earliest reading).
+        end_month (str, optional): Last month, inclusive (default: latest reading).
+
+    Returns:
+        SimulationResult
+    """
+    history = load_history(conn)
+    months = history["BillingMonth"].cat.categories
+    month_codes = history["BillingMonth"].cat.codes.to_numpy()
+    # Rows are in month order, so a month range is one contiguous slice
+    first = months.searchsorted(start_month) if start_month else 0
+    last = months.searchsorted(end_month, side="right") if end_month else len(months)
+    rows = slice(month_codes.searchsorted(first), month_codes.searchsorted(last))
+
+    reading_ids = history["ReadingID"].to_numpy()[rows]
+    month_codes = month_codes[rows]
+    flat_codes = history["FlatNo"].cat.codes.to_numpy()[rows]
+    category_codes = history["UserCategory"].cat.codes.to_numpy()[rows]
+    category_labels = history["UserCategory"].cat.categories
+    categories = np.append(np.asarray(category_labels, dtype=object), None)[category_codes]
+    units = history["UnitsConsumed"].to_numpy(dtype=float)[rows]
+
+    # Recorded surcharge totals per reading, split like load_month_readings()
+    lines = load_surcharge_lines(conn)
+    positions = _line_positions(lines, reading_ids, month_codes, months)
+    current = lines["CurrentMonth"].to_numpy() & (positions >= 0)
+    adjusted = ~lines["CurrentMonth"].to_numpy() & (positions >= 0)
+    amounts = lines["SurchargeAmount"].to_numpy(dtype=float)
+    month_surcharge = np.bincount(positions[current], weights=amounts[current], minlength=len(units))
+    adjusted_surcharge = np.bincount(positions[adjusted], weights=amounts[adjusted], minlength=len(units))
+
+    # Scheduled slab, GST and duty rates, one as_of per month
+    reading_dates = np.array([get_date(month) for month in months])
+    baseline_variable = np.zeros(len(units))
+    baseline_rate = np.zeros(len(units))
+    bounds = np.searchsorted(month_codes, np.arange(len(months) + 1))
+    for code in range(first, last):
+        month_rows = slice(bounds[code], bounds[code + 1])
+        if month_rows.start < month_rows.stop:
+            baseline_variable[month_rows], baseline_rate[month_rows] = tariff_slabs.prices(
+                units[month_rows], categories[month_rows], as_of=reading_dates[code], conn=conn)
+    baseline_gst = _scheduled(get_gst_rates(), "GST", reading_dates)[month_codes]
+    baseline_duty = _scheduled(get_electric_duty_rates(), "ElectricDuty", reading_dates)[month_codes]
+
+    proposed_variable = baseline_variable.copy()
+    proposed_rate = baseline_rate.copy()
+    if scenario.slabs:
+        modes = {category: (scenario.slab_modes or {}).get(category) or tariff_slabs.mode(category, conn=conn)
+                 for category in scenario.slabs}
+        schedules = build_schedules((category, low, high, rate, "", modes[category])
+                                    for category, slabs in scenario.slabs.items() for low, high, rate in slabs)
+        proposed = np.isin(categories, list(scenario.slabs))
+        proposed_variable[proposed], proposed_rate[proposed] = schedule_prices(schedules, units[proposed],
+                                                                               categories[proposed])
+    proposed_gst = baseline_gst if scenario.gst_rate is None else np.full(len(units), float(scenario.gst_rate))
+    proposed_duty = (baseline_duty if scenario.electric_duty is None
+                     else np.full(len(units), float(scenario.electric_duty)))
+
+    proposed_surcharge = month_surcharge
+    if scenario.surcharges:
+        # Swap each proposed type's recorded current-month amount for units x proposed band rate
+        change = np.zeros(len(units))
+        type_ids = lines["SurchargeTypeID"].to_numpy()
+        for type_id, bands in scenario.surcharges.items():
+            of_type = current & (type_ids == type_id)
+            line_rows = positions[of_type]
+            line_units = units[line_rows]
+            change += np.bincount(line_rows, weights=line_units * band_rates(bands, line_units) - amounts[of_type],
+                                  minlength=len(units))
+        proposed_surcharge = month_surcharge + change
+
+    baseline = compute_charges(units, baseline_rate, baseline_gst, baseline_duty, month_surcharge, adjusted_surcharge,
+                               baseline_variable)
+    proposal = compute_charges(units, proposed_rate, proposed_gst, proposed_duty, proposed_surcharge,
+                               adjusted_surcharge, proposed_variable)
+    baseline_amount = baseline["NetPayableAmount"]
+    proposed_amount = proposal["NetPayableAmount"]
+
+    flats = history["FlatNo"].cat.categories.rename("FlatNo")
+    readings = pd.DataFrame({
+        "FlatNo": pd.Categorical.from_codes(flat_codes, flats),
+        "BillingMonth": pd.Categorical.from_codes(month_codes, months),
+        "UserCategory": pd.Categorical.from_codes(category_codes, category_labels),
+        "UnitsConsumed": units,
+        "BaselineRate": baseline_rate,
+        "ProposedRate": proposed_rate,
+        "Baseline": baseline_amount,
+        "Proposed": proposed_amount,
+        "Delta": proposed_amount - baseline_amount,
+    })
+    return SimulationResult(
+        readings=readings,
+        by_flat=_totals(flat_codes, flats, "Months", units, baseline_amount, proposed_amount),
+        by_month=_totals(month_codes, months.rename("BillingMonth"), "Flats", units, baseline_amount,
+                         proposed_amount),
+        totals={
+            "readings": len(units),
+            "units": float(units.sum()),
+            "baseline": float(baseline_amount.sum()),
+            "proposed": float(proposed_amount.sum()),
+            "delta": float((proposed_amount - baseline_amount).sum()),
+        },
+    )
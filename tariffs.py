@@ -0,0 +1,280 @@
+# Description: In-memory TariffSlabs index used for all slab pricing (flat or progressive).
+import logging
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+import numpy as np
+
+from db import TableIndex, signature_sql
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%Y-%m-%d %H:%M:%S", "%d-%m-%Y")
+
+
+def normalize_date(value):
+    """Convert the date formats found in the rate tables to "YYYY-MM-DD" (None if unparseable)."""
+    if value is None:
+        return None
+    if hasattr(value, "strftime"):
+        return value.strftime("%Y-%m-%d")
+    value = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+
+# TariffSlabs.PricingMode: one rate for all units, or each band of units at its own rate
+FLAT = "flat"
+PROGRESSIVE = "progressive"
+PRICING_MODES = (FLAT, PROGRESSIVE)
+
+
+class _Schedule:
+    """
+    One category's slabs for one effective date, sorted by MinUnits.
+
+    Progressive schedules also hold cumulative tables: band i covers the units
+    above the previous band's MaxUnits (the first band starts at 0), and
+    offsets[i] is the cost of all lower bands minus band i's start times its
+    rate, so the charge for u units in band i is offsets[i] + u * rates[i].
+    The top band carries on past its MaxUnits.
+    """
+
+    def __init__(self, effective_date, slabs, mode=FLAT):
+        slabs.sort(key=lambda slab: slab[0])
+        self.effective_date = effective_date
+        self.mode = mode
+        self.min_units = [slab[0] for slab in slabs]
+        self.max_units = [slab[1] for slab in slabs]
+        self.rates = [slab[2] for slab in slabs]
+        self.min_array = np.array(self.min_units, dtype=float)
+        self.max_array = np.array(self.max_units, dtype=float)
+        self.rate_array = np.array(self.rates, dtype=float)
+        if mode == PROGRESSIVE:
+            starts = np.concatenate(([0.0], self.max_array[:-1]))
+            band_costs = (self.max_array - starts) * self.rate_array
+            below = np.concatenate(([0.0], np.cumsum(band_costs[:-1])))
+            self.offset_array = below - starts * self.rate_array
+            self.offsets = self.offset_array.tolist()
+
+    def rate(self, units):
+        i = bisect_right(self.min_units, units) - 1
+        if i >= 0 and units <= self.max_units[i]:
+            return self.rates[i]
+        return None
+
+    def price(self, units):
+        """(variable charges, average rate per unit) for one reading, or None if no flat slab covers it."""
+        if self.mode == PROGRESSIVE:
+            units = max(units, 0.0)
+            i = min(bisect_left(self.max_units, units), len(self.rates) - 1)
+            charge = self.offsets[i] + units * self.rates[i]
+            return charge, (charge / units if units else self.rates[i])
+        rate = self.rate(units)
+        return None if rate is None else (units * rate, rate)
+
+    def price_many(self, units):
+        """Vectorized price(): (charges, rates, covered mask)."""
+        if self.mode == PROGRESSIVE:
+            units = np.maximum(units, 0.0)
+            i = np.minimum(np.searchsorted(self.max_array, units, side="left"), len(self.rates) - 1)
+            charges = self.offset_array[i] + units * self.rate_array[i]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                rates = np.where(units > 0, charges / units, self.rate_array[i])
+            return charges, rates, np.ones(units.shape, dtype=bool)
+        i = np.searchsorted(self.min_array, units, side="right") - 1
+        safe_i = np.clip(i, 0, None)
+        covered = (i >= 0) & (units <= self.max_array[safe_i])
+        rates = self.rate_array[safe_i]
+        return units * rates, rates, covered
+
+
+def build_schedules(rows):
+    """
+    Group slab rows into per-category schedules, newest effective date first.
+
+    Args:
+        rows (iterable): (UserCategory, MinUnits, MaxUnits, RatePerUnit, RateEffectiveDate, PricingMode)
+            tuples; a None bound is open-ended, a None mode is flat.
+
+    Returns:
+        dict: UserCategory -> list of schedules.
+    """
+    grouped, modes = {}, {}
+    for category, min_units, max_units, rate, effective_date, mode in rows:
+        slab = (
+            float(min_units) if min_units is not None else float("-inf"),
+            float(max_units) if max_units is not None else float("inf"),
+            float(rate) if rate is not None else 0.0,
+        )
+        key = (category, normalize_date(effective_date) or "")
+        grouped.setdefault(key, []).append(slab)
+        # One progressive row makes the whole schedule progressive
+        if mode == PROGRESSIVE or key not in modes:
+            modes[key] = mode or FLAT
+
+    schedules = {}
+    for (category, effective_date), slabs in grouped.items():
+        schedules.setdefault(category, []).append(_Schedule(effective_date, slabs, modes[category, effective_date]))
+    for category_schedules in schedules.values():
+        # Newest schedule first, matching ORDER BY RateEffectiveDate DESC
+        category_schedules.sort(key=lambda schedule: schedule.effective_date, reverse=True)
+    return schedules
+
+
+# (category, as_of) pairs already warned about, so batch pricing logs each once
+_warned_before_first = set()
+
+
+def _applicable(schedules, category, as_of):
+    """
+    Schedules effective on as_of, newest first.
+
+    A date before the category's first schedule gets the oldest schedule
+    (with a warning) rather than none, which would price the reading at 0.
+    """
+    category_schedules = schedules.get(category, ())
+    if as_of is None:
+        return category_schedules
+    as_of = normalize_date(as_of) or as_of
+    applicable = [schedule for schedule in category_schedules if schedule.effective_date <= as_of]
+    if not applicable and category_schedules:
+        oldest = category_schedules[-1]
+        if (category, as_of) not in _warned_before_first:
+            _warned_before_first.add((category, as_of))
+            logger.warning("No %s tariff slabs effective on %s; using the oldest schedule (effective %s)",
+                           category, as_of, oldest.effective_date)
+        return [oldest]
+    return applicable
+
+
+def schedule_prices(schedules, units, user_categories, as_of=None):
+    """
+    Vectorized pricing against build_schedules() output.
+
+    Each reading uses the newest applicable schedule that covers its units
+    (a progressive schedule covers every reading).
+
+    Returns:
+        tuple: (variable charges, RatePerUnit) arrays; both 0.0 where nothing matches.
+    """
+    units = np.nan_to_num(np.asarray(units, dtype=float))
+    user_categories = np.asarray(user_categories, dtype=object)
+    charges = np.zeros(units.shape, dtype=float)
+    rates = np.zeros(units.shape, dtype=float)
+
+    for category in set(user_categories.tolist()):
+        mask = user_categories == category
+        category_units = units[mask]
+        category_charges = np.zeros(category_units.shape, dtype=float)
+        category_rates = np.zeros(category_units.shape, dtype=float)
+        pending = np.ones(category_units.shape, dtype=bool)
+
+        for schedule in _applicable(schedules, category, as_of):
+            schedule_charges, priced_rates, covered = schedule.price_many(category_units)
+            hit = pending & covered
+            category_charges[hit] = schedule_charges[hit]
+            category_rates[hit] = priced_rates[hit]
+            pending &= ~hit
+            if not pending.any():
+                break
+
+        unpriced = int((pending & (category_units > 0)).sum())
+        if unpriced:
+            logger.warning("%d %s reading(s) matched no tariff slab%s; priced at 0", unpriced, category,
+                           f" effective on {as_of}" if as_of else "")
+        charges[mask] = category_charges
+        rates[mask] = category_rates
+    return charges, rates
+
+
+def schedule_rates(schedules, units, user_categories, as_of=None):
+    """RatePerUnit half of schedule_prices()."""
+    return schedule_prices(schedules, units, user_categories, as_of)[1]
+
+
+class TariffSlabs(TableIndex):
+    """
+    TariffSlabs loaded once into sorted boundary arrays per (UserCategory, effective date).
+
+    Lookups never touch SQL; refresh() reloads the arrays only when the
+    table has changed.
+    """
+
+    table = "TariffSlabs"
+    # Every column _load() reads, so an edit of any of them (or a swap between rows) reloads
+    signature_query = signature_sql("TariffSlabs", ("UserCategory", "MinUnits", "MaxUnits", "RatePerUnit",
+                                                    "RateEffectiveDate", "PricingMode"))
+
+    def __init__(self):
+        super().__init__()
+        self._schedules = {}
+
+    def _load(self, conn):
+        self._schedules = build_schedules(conn.execute(
+            "SELECT UserCategory, MinUnits, MaxUnits, RatePerUnit, RateEffectiveDate, PricingMode FROM TariffSlabs"))
+
+    def categories(self, conn=None):
+        """UserCategory values that have slabs."""
+        self.refresh(conn)
+        return sorted(self._schedules)
+
+    def schedule(self, user_category, as_of=None, conn=None):
+        """(MinUnits, MaxUnits, RatePerUnit) of the newest schedule effective on as_of; open bounds are None."""
+        self.refresh(conn)
+        for schedule in _applicable(self._schedules, user_category, as_of):
+            return [(None if low == float("-inf") else low, None if high == float("inf") else high, rate)
+                    for low, high, rate in zip(schedule.min_units, schedule.max_units, schedule.rates)]
+        return []
+
+    def mode(self, user_category, as_of=None, conn=None):
+        """PricingMode of the newest schedule effective on as_of (flat if there is none)."""
+        self.refresh(conn)
+        for schedule in _applicable(self._schedules, user_category, as_of):
+            return schedule.mode
+        return FLAT
+
+    def price(self, units, user_category, as_of=None, conn=None):
+        """
+        Variable charges and rate per unit for a single reading.
+
+        Args:
+            units (float): Units consumed.
+            user_category (str): Users.UserCategory.
+            as_of (str, optional): Only use slabs effective on or before this date.
+
+        Returns:
+            tuple: (variable charges, RatePerUnit); the rate is the average over all
+                units for a progressive schedule. (0.0, 0.0) if no slab matches.
+        """
+        self.refresh(conn)
+        units = float(units or 0)
+        for schedule in _applicable(self._schedules, user_category, as_of):
+            priced = schedule.price(units)
+            if priced is not None:
+                return priced
+        if units > 0:
+            logger.warning("No %s tariff slab covers %s units%s; priced at 0", user_category, units,
+                           f" effective on {as_of}" if as_of else "")
+        return 0.0, 0.0
+
+    def prices(self, units, user_categories, as_of=None, conn=None):
+        """Vectorized price(): (variable charges, RatePerUnit) arrays."""
+        self.refresh(conn)
+        return schedule_prices(self._schedules, units, user_categories, as_of)
+
+    def rate(self, units, user_category, as_of=None, conn=None):
+        """RatePerUnit of price() for a single reading (0.0 if no slab matches)."""
+        return self.price(units, user_category, as_of, conn)[1]
+
+    def rates(self, units, user_categories, as_of=None, conn=None):
+        """Vectorized rate(): one RatePerUnit per element of units / user_categories."""
+        return self.prices(units, user_categories, as_of, conn)[1]
+
+
+# Shared by every page, thread and the batch engine
+tariff_slabs = TariffSlabs()
@@ -0,0 +1,51 @@
+# Description: Bulk bill PDFs joined from several parts must keep working font resources.
+import os
+import sys
+from io import BytesIO
+
+from pypdf import PdfReader
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bill_pdf import generate_pdf, write_bulk_bills  # noqa: E402
+
+
+def _bill(n):
+    # fetch_billing_data row: FlatNo, Name, PreviousReading, PresentReading, UnitsConsumed, BillingMonth,
+    # RatePerUnit, VariableCharges, GSTID, GST, ElectricDutyID, ElectricDuty, TotalSurcharge,
+    # FuelChargeAdjustment, NetPayableAmount, GSTAmount, ElectricDutyAmount
+    return (f"T-{n:03d}", f"Tenant {n}", 100.0, 150.0 + n, 50.0 + n, "2025-03", 10.0, 500.0 + n * 10,
+            1, 17.0, 1, 1.5, 20.0, 0.0, 700.0 + n, 85.0, 7.5)
+
+
+def test_concatenated_parts_keep_text():
+    batches = [[_bill(n) for n in range(start, start + 3)] for start in (0, 3, 6)]
+    output = BytesIO()
+
+    pages = write_bulk_bills(batches, "2025-03", output, workers=1)
+    output.seek(0)
+    reader = PdfReader(output)
+
+    assert pages == len(reader.pages) == 9
+    for n, page in enumerate(reader.pages):
+        text = page.extract_text()
+        assert "�" not in text
+        assert "Flat No:" in text and f"T-{n:03d}" in text
+        assert "ELECTRIC BILL FOR NED STAFF COLONY" in text
+        # Bulk rows carry no PersonID, reading date, load or phase: no labels for them
+        assert "Pers No:" not in text and "Reading Date:" not in text and "Load Sanctioned" not in text
+        assert "\n-\n" not in text
+
+
+def test_single_bill_prints_only_supplied_fields(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    args = ("A-101", "P1", "Tenant", "2025-03", "01-03-2025", 100.0, 150.0, 50.0, 7.5, 85.0, 20.0, 500.0, 112.5,
+            612.5)
+
+    text = PdfReader(generate_pdf(*args)).pages[0].extract_text()
+    assert "Rate per Unit" not in text and "Fuel Charge" not in text and "Phase" not in text
+    assert "Pers No:" in text and "P1" in text
+
+    text = PdfReader(generate_pdf(*args, rate_per_unit=10.0, load_sanctioned=2, phase=3)).pages[0].extract_text()
+    assert "Rate per Unit:" in text and "Load Sanctioned (kW):" in text and "Phase:" in text
+    assert "\n10.0\n" in text